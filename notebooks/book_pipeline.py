@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class StagesFailed(Exception):
+    """
+    Raised by BookPipeline.run when some of the stages failed. `results` has the outputs of the stages that did
+    finish, `failed` has the exception of each stage that failed, and `skipped` the stages that depended on them.
+    """
+    def __init__(self, results: dict, failed: dict, skipped: list):
+        super().__init__(f'{len(failed)} stages failed ({", ".join(failed)}), {len(skipped)} skipped')
+        self.results = results
+        self.failed = failed
+        self.skipped = skipped
+
+
+class BookPipeline:
+    """
+    Runs the stages of generating a book (outlines, chapters, introduction and conclusion, revisions, epub) as a
+    dependency graph, so stages that don't depend on each other (i.e. the chapters) run at the same time, with at most
+    `max_workers` running at once.
+
+        BOOK.add('chapter_outlines', review_all_chapters, inputs=[reviews])
+        BOOK.add('chapter:stoicism', write_chapter, deps=['chapter_outlines'], inputs=[prompt_template, kb['id']])
+        outputs = BOOK.run()
+
+    A stage is called with the outputs of its `deps`, in order, and its output (anything that can be saved as JSON) is
+    checkpointed in `checkpoint_dir`, keyed by a hash of its `inputs` and the keys of its deps. `inputs` should be
+    everything the output depends on besides the deps (prompts, instructions, style guidance). On the next run, i.e.
+    after a kernel restart, a stage whose key hasn't changed is loaded from its checkpoint, and the stages it depends
+    on aren't run at all. Changing an input re-runs that stage and everything downstream of it, and nothing else.
+    Stages that write files (i.e. the epub) list them in `outputs`, and their checkpoint is only used while all of
+    those files still exist.
+    """
+    def __init__(self, checkpoint_dir: str, max_workers: int = 4, clock=time.monotonic):
+        self.checkpoint_dir = checkpoint_dir
+        self.max_workers = max_workers
+        self.clock = clock
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.timings = []
+
+    def add(self, name: str, fn, deps: list = (), inputs=None, outputs: list = ()):
+        # adding a stage with the same name again replaces it, so notebook cells can be re-run
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f'Stage {name} depends on {dep}, which has not been added')
+        self.stages[name] = {'fn': fn, 'deps': list(deps), 'inputs': inputs, 'outputs': list(outputs)}
+
+    def key(self, name: str) -> str:
+        stage = self.stages[name]
+        # default=str so inputs like knowledge base dicts with dates still hash the same way every time
+        content = json.dumps({
+            'stage': name,
+            'inputs': stage['inputs'],
+            'deps': [self.key(dep) for dep in stage['deps']],
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def checkpoint_path(self, name: str, key: str) -> str:
+        # stage names like 'chapter:stoicism' aren't valid file names everywhere
+        filename = re.sub(r'[^\w.-]+', '_', name)
+        return os.path.join(self.checkpoint_dir, f'{filename}-{key[:16]}.json')
+
+    def load_checkpoint(self, name: str, key: str):
+        # returns the checkpoint (with the output and how long the stage took) or None if there isn't one, or if a
+        # file the stage wrote has been deleted since
+        path = self.checkpoint_path(name, key)
+        if not os.path.exists(path) or not all(os.path.exists(output) for output in self.stages[name]['outputs']):
+            return None
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        return checkpoint if checkpoint.get('key') == key else None
+
+    def save_checkpoint(self, name: str, key: str, output, seconds: float):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        path = self.checkpoint_path(name, key)
+        # write then rename, so a kernel that dies mid-write doesn't leave a broken checkpoint behind
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'stage': name, 'key': key, 'seconds': seconds, 'output': output}, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def run(self, *names: str, summary: bool = True) -> dict:
+        # runs the named stages (all of them if none are given) and whatever they need. returns every stage's output
+        targets = list(names) or list(self.stages)
+        keys = {}
+        results = {}
+        timings = {}
+        to_run = []
+        # walk back from the targets, stopping at stages that have a checkpoint
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name in keys:
+                continue
+            keys[name] = self.key(name)
+            checkpoint = self.load_checkpoint(name, keys[name])
+            if checkpoint is not None:
+                results[name] = checkpoint['output']
+                timings[name] = {'stage': name, 'status': 'checkpoint', 'seconds': 0.0, 'saved_seconds': checkpoint['seconds']}
+            else:
+                to_run.append(name)
+                pending += self.stages[name]['deps']
+        # keep the order the stages were added in, which is also a valid order to run them in
+        to_run.sort(key=list(self.stages).index)
+
+        failed = {}
+        skipped = []
+        start_time = self.clock()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while to_run or running:
+                for name in list(to_run):
+                    deps = self.stages[name]['deps']
+                    if any(dep in failed or dep in skipped for dep in deps):
+                        to_run.remove(name)
+                        skipped.append(name)
+                        timings[name] = {'stage': name, 'status': 'skipped', 'seconds': 0.0}
+                    elif all(dep in results for dep in deps):
+                        to_run.remove(name)
+                        running[executor.submit(self.run_stage, name, keys[name], [results[dep] for dep in deps])] = name
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        output, seconds = future.result()
+                    except Exception as e:
+                        failed[name] = e
+                        timings[name] = {'stage': name, 'status': 'failed', 'seconds': getattr(e, 'stage_seconds', 0.0)}
+                        continue
+                    results[name] = output
+                    timings[name] = {'stage': name, 'status': 'ran', 'seconds': seconds}
+
+        elapsed = self.clock() - start_time
+        with self.lock:
+            self.timings = [timings[name] for name in self.stages if name in timings]
+        if summary:
+            self.print_summary(elapsed)
+        if failed:
+            raise StagesFailed(results, failed, skipped)
+        return results
+
+    def run_stage(self, name: str, key: str, dep_outputs: list):
+        stage = self.stages[name]
+        start_time = self.clock()
+        print(f'STARTING STAGE: {name}')
+        try:
+            output = stage['fn'](*dep_outputs)
+            seconds = self.clock() - start_time
+            self.save_checkpoint(name, key, output, seconds)
+        except Exception as e:
+            e.stage_seconds = self.clock() - start_time
+            print(f'FAILED STAGE: {name} ({type(e).__name__}: {e})')
+            raise
+        print(f'FINISHED STAGE: {name} in {seconds:.1f}s')
+        return output, seconds
+
+    def print_summary(self, elapsed: float):
+        with self.lock:
+            timings = list(self.timings)
+        width = max([len('stage')] + [len(timing['stage']) for timing in timings]) + 2
+        print(f"\n{'stage':<{width}}{'status':<12}{'seconds':>10}")
+        for timing in timings:
+            seconds = f"{timing['seconds']:.1f}" if timing['status'] != 'checkpoint' else f"({timing['saved_seconds']:.1f})"
+            print(f"{timing['stage']:<{width}}{timing['status']:<12}{seconds:>10}")
+        ran = [timing for timing in timings if timing['status'] == 'ran']
+        cached = [timing for timing in timings if timing['status'] == 'checkpoint']
+        print(f'{len(ran)} stages ran in {elapsed:.1f}s ({sum(timing["seconds"] for timing in ran):.1f}s of stage time), '
+              f'{len(cached)} loaded from checkpoints (saving {sum(timing["saved_seconds"] for timing in cached):.1f}s)')
@@ -0,0 +1,186 @@
+import time
+
+import requests
+import tqdm
+
+from job_poller import TERMINAL_STATUSES, JobPoller
+
+
+def review(kb_id: str, ar_instructions: str, fr_instructions: str, label: str = None, **options) -> dict:
+    # one document review for ReviewOrchestrator.run. `options` are any other fields of the review request,
+    # i.e. `reference_knowledge_base_ids` or `active_reading_model`
+    return {
+        'kb_id': kb_id,
+        'label': label,
+        'payload': {
+            'active_reading_instructions': ar_instructions,
+            'final_review_instructions': fr_instructions,
+            **options,
+        },
+    }
+
+
+class ReviewsFailed(Exception):
+    """
+    Raised by ReviewOrchestrator.run when some of the reviews failed. `results` has the final reviews that did
+    finish, and `failed` has the last status response of each review that didn't. Reviews that were given up on (past
+    their deadline, or after too many failed polls) have the reason in its `error`.
+    """
+    def __init__(self, results: dict, failed: dict):
+        super().__init__(f'{len(failed)} of {len(results) + len(failed)} reviews failed: {", ".join(map(str, failed))}')
+        self.results = results
+        self.failed = failed
+
+
+class ReviewOrchestrator:
+    """
+    Runs document reviews (`/knowledge_bases/{id}/review`) on many knowledge bases at the same time. At most
+    `max_concurrent` reviews run at once, and the rest start as soon as one finishes. All of the running reviews are
+    polled from one loop, each with its own backoff (see JobPoller), and their active reading progress is shown as one
+    progress bar per review plus an overall bar. Reviews that are waiting to start show up at 0%.
+
+        reviews = REVIEWS.run({kb['id']: review(kb['id'], ar_instructions, fr_instructions, label=kb['title']) for kb in kbs})
+
+    returns the final review of each review, by the same keys. With `display_reviews`, each final review is also
+    shown (and updated while it's being written) in the notebook.
+
+    A poll that fails (connection error, error response, invalid JSON) is retried at the review's next backoff interval.
+    A review is given up on after `max_poll_errors` failed polls in a row, or once it has run for `deadline_seconds`,
+    so one stuck review can't hold up the results of the others.
+    """
+    def __init__(self, base_url: str, auth: tuple, max_concurrent: int = 4, poller: JobPoller = None,
+                 display_reviews: bool = True, session: requests.Session = None, deadline_seconds: float = 60 * 60,
+                 max_poll_errors: int = 5, request_timeout: float = 60, sleep=time.sleep, clock=time.monotonic):
+        self.base_url = base_url
+        self.auth = auth
+        self.max_concurrent = max_concurrent
+        # reviews take minutes, so there's no need to check on them more than every few seconds
+        self.poller = poller if poller is not None else JobPoller(initial_interval=1.0, max_interval=5.0)
+        self.display_reviews = display_reviews
+        self.session = session if session is not None else requests.Session()
+        self.deadline_seconds = deadline_seconds
+        self.max_poll_errors = max_poll_errors
+        self.request_timeout = request_timeout
+        self.sleep = sleep
+        self.clock = clock
+
+    def submit(self, review: dict) -> dict:
+        # errors show up as a failed review instead of stopping the others
+        try:
+            resp = self.session.post(f'{self.base_url}/knowledge_bases/{review["kb_id"]}/review', json=review['payload'],
+                                     auth=self.auth, timeout=self.request_timeout)
+            if not resp.ok:
+                return {'status': 'FAILED', 'error': resp.text, 'response': {}}
+            job = resp.json()
+        except (requests.RequestException, ValueError) as e:
+            return {'status': 'FAILED', 'error': f'{type(e).__name__}: {e}', 'response': {}}
+        if job.get('status') not in TERMINAL_STATUSES and not job.get('status_url'):
+            return dict(job, status='FAILED', error=f'Review job has no status_url: {job}')
+        return job
+
+    def get_job_status(self, status_url: str) -> dict:
+        # raises requests.RequestException or ValueError if the status can't be fetched
+        resp = self.session.get(status_url, auth=self.auth, timeout=self.request_timeout)
+        resp.raise_for_status()
+        job = resp.json()
+        if not isinstance(job, dict) or 'status' not in job:
+            raise ValueError(f'Unexpected job status response: {resp.text[:200]}')
+        return job
+
+    def run(self, reviews: dict) -> dict:
+        # `reviews` maps any key (i.e. the knowledge base id) to a review (see `review`)
+        pending = list(reviews)
+        running = {}
+        jobs = {}
+        bars = {
+            key: tqdm.tqdm(total=1, position=i, desc=f'Active Reading Progress for {reviews[key]["label"] or key}', leave=True)
+            for i, key in enumerate(pending)
+        }
+        overall_bar = tqdm.tqdm(total=len(reviews), position=len(reviews), desc='All reviews', leave=True) if len(reviews) > 1 else None
+        displays = {}
+
+        def update(key, job: dict):
+            jobs[key] = job
+            response = job.get('response') or {}
+            bars[key].n = response.get('active_reading_progress_pct') or (1 if job['status'] == 'COMPLETE' else bars[key].n)
+            bars[key].refresh()
+            if overall_bar is not None:
+                overall_bar.n = round(sum(bar.n for bar in bars.values()), 2)
+                overall_bar.refresh()
+            if self.display_reviews and response.get('final_review') and bars[key].n >= 1:
+                self.show(key, reviews[key], response['final_review'], displays)
+
+        try:
+            while pending or running:
+                # start reviews until the concurrency cap is reached
+                while pending and len(running) < self.max_concurrent:
+                    key = pending.pop(0)
+                    job = self.submit(reviews[key])
+                    update(key, job)
+                    if job['status'] in TERMINAL_STATUSES:
+                        self.poller.record(job['status'], 0, 0.0)
+                        continue
+                    intervals = self.poller.intervals()
+                    started_at = self.clock()
+                    running[key] = {'started_at': started_at, 'deadline': started_at + self.deadline_seconds, 'polls': 0, 'errors': 0,
+                                    'intervals': intervals, 'next_poll_at': started_at + next(intervals)}
+
+                if not running:
+                    continue
+                # poll (or give up on) whichever review is due next
+                key = min(running, key=lambda k: min(running[k]['next_poll_at'], running[k]['deadline']))
+                state = running[key]
+                self.sleep(max(0.0, min(state['next_poll_at'], state['deadline']) - self.clock()))
+                if self.clock() >= state['deadline']:
+                    jobs[key] = dict(jobs[key], error=f'Review still {jobs[key]["status"]} after {self.deadline_seconds}s')
+                    self.poller.record(jobs[key]['status'], state['polls'], self.clock() - state['started_at'])
+                    del running[key]
+                    continue
+                state['polls'] += 1
+                try:
+                    job = self.get_job_status(jobs[key]['status_url'])
+                except (requests.RequestException, ValueError) as e:
+                    state['errors'] += 1
+                    if state['errors'] >= self.max_poll_errors:
+                        jobs[key] = dict(jobs[key], error=f'{state["errors"]} polls in a row failed, the last with {type(e).__name__}: {e}')
+                        self.poller.record(jobs[key]['status'], state['polls'], self.clock() - state['started_at'])
+                        del running[key]
+                    else:
+                        state['next_poll_at'] = self.clock() + next(state['intervals'])
+                    continue
+                state['errors'] = 0
+                # keep polling the same url if a status response doesn't repeat it
+                if not job.get('status_url'):
+                    job = dict(job, status_url=jobs[key]['status_url'])
+                update(key, job)
+                if job['status'] in TERMINAL_STATUSES:
+                    self.poller.record(job['status'], state['polls'], self.clock() - state['started_at'])
+                    del running[key]
+                else:
+                    state['next_poll_at'] = self.clock() + next(state['intervals'])
+        finally:
+            for bar in list(bars.values()) + [overall_bar]:
+                if bar is not None:
+                    bar.close()
+
+        results = {key: job['response']['final_review'] for key, job in jobs.items() if job['status'] == 'COMPLETE'}
+        failed = {key: job for key, job in jobs.items() if job['status'] != 'COMPLETE'}
+        if failed:
+            raise ReviewsFailed(results, failed)
+        # same order as `reviews`
+        return {key: results[key] for key in reviews}
+
+    def run_one(self, review: dict) -> str:
+        return self.run({review['label'] or review['kb_id']: review})[review['label'] or review['kb_id']]
+
+    def show(self, key, review: dict, final_review: str, displays: dict):
+        # only imported here so the orchestrator also works outside of notebooks
+        from IPython.display import display, Markdown
+        text = f'### {review["label"]}\n\n{final_review}' if review['label'] else final_review
+        if key not in displays:
+            displays[key] = display(Markdown(text), display_id=True)
+        else:
+            displays[key].update(Markdown(text))
+
+    def stats(self) -> dict:
+        return self.poller.stats()
@@ -0,0 +1,89 @@
+"""
+Benchmark the concurrent uploader against a local stand-in for the Superpowered API, so throughput and retry behavior
+can be measured without creating real documents (or paying for AutoContext).
+
+    python bench_upload.py --num-documents 200 --latency 0.5 --error-rate 0.05 --requests-per-second 10 --max-in-flight 16
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import superpowered
+
+from concurrent_upload import upload_files_concurrently
+
+
+def make_fake_api_handler(latency: float, error_rate: float):
+    class FakeSuperpoweredApi(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            self.rfile.read(length)
+            time.sleep(latency)
+            if random.random() < error_rate:
+                status, body = random.choice([429, 503]), {'message': 'simulated failure'}
+            else:
+                status, body = 200, {'id': str(uuid.uuid4()), 'vectorization_status': 'PENDING'}
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_DELETE(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeSuperpoweredApi
+
+
+def make_documents(directory: str, num_documents: int, size: int):
+    files = []
+    for i in range(num_documents):
+        file_path = os.path.join(directory, f'page_{i}.md')
+        with open(file_path, 'w') as f:
+            f.write(f'# Page {i}\n\n' + 'lorem ipsum ' * (size // 12))
+        files.append((file_path, f'/page_{i}.md'))
+    return files
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-documents', type=int, default=100)
+    parser.add_argument('--document-size', type=int, default=4000, help='approximate size of each document in bytes')
+    parser.add_argument('--latency', type=float, default=0.5, help='simulated API latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.05, help='fraction of requests that fail with 429/503')
+    parser.add_argument('--requests-per-second', type=float, default=10.0)
+    parser.add_argument('--max-in-flight', type=int, default=16)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_fake_api_handler(args.latency, args.error_rate))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    superpowered.set_base_url(f'http://127.0.0.1:{server.server_address[1]}/v1')
+    superpowered.set_api_key('local', 'local')
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = make_documents(directory, args.num_documents, args.document_size)
+        stats = upload_files_concurrently(
+            files,
+            kb_id='local-kb',
+            max_documents=args.num_documents,
+            requests_per_second=args.requests_per_second,
+            max_in_flight=args.max_in_flight,
+        )
+
+    # the sequential uploader sleeps 1 second after every document on top of the request latency
+    sequential_seconds = args.num_documents * (args.latency + 1.0)
+    print (f"Estimated sequential time: {sequential_seconds:.1f}s, concurrent time: {stats.elapsed():.1f}s")
+    server.shutdown()
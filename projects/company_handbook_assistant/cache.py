@@ -0,0 +1,72 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def hash_key(*parts) -> str:
+    # content-addressed key: any change to any of the parts gives a different key
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class DiskCache:
+    """
+    Small SQLite-backed key/value cache. Entries older than `max_age_seconds` are treated as missing, and the least
+    recently used entries are evicted once there are more than `max_entries`. With `refresh=True`, every lookup is a
+    miss (so everything gets recomputed and overwritten). Safe to use from several threads.
+    """
+    def __init__(self, path: str, max_entries: int = 10000, max_age_seconds: float = 30 * 24 * 60 * 60, refresh: bool = False):
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, key: str):
+        with self.lock:
+            row = None
+            if not self.refresh:
+                row = self.conn.execute('SELECT value, created_at FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None or time.time() - row[1] > self.max_age_seconds:
+                self.misses += 1
+                return None
+            self.conn.execute('UPDATE cache SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            self.conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, value):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now, now)
+            )
+            self.evict(now)
+            self.conn.commit()
+
+    def evict(self, now: float):
+        self.conn.execute('DELETE FROM cache WHERE created_at < ?', (now - self.max_age_seconds,))
+        self.conn.execute(
+            'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / total, 3) if total else 0.0}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,200 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import superpowered
+
+from manifest import hash_content
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. `rate` tokens are added per second, up to `capacity`. Every request takes one token, so
+    the sustained request rate never exceeds `rate` while short bursts up to `capacity` are still allowed.
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError('rate must be greater than 0')
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class UploadStats:
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.end_time = None
+        self.uploaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes_uploaded = 0
+        self.retries = 0
+
+    def elapsed(self) -> float:
+        return (self.end_time or time.monotonic()) - self.start_time
+
+    def summary(self) -> dict:
+        elapsed = self.elapsed()
+        return {
+            'uploaded': self.uploaded,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'retries': self.retries,
+            'bytes_uploaded': self.bytes_uploaded,
+            'elapsed_seconds': round(elapsed, 2),
+            'docs_per_second': round(self.uploaded / elapsed, 2) if elapsed else 0.0,
+            'bytes_per_second': round(self.bytes_uploaded / elapsed, 2) if elapsed else 0.0,
+        }
+
+    def print_summary(self):
+        s = self.summary()
+        print (f"Uploaded {s['uploaded']} documents ({s['bytes_uploaded']} bytes) in {s['elapsed_seconds']}s")
+        print (f"Throughput: {s['docs_per_second']} docs/sec, {s['bytes_per_second']} bytes/sec")
+        print (f"Retries: {s['retries']}, skipped: {s['skipped']}, failed: {s['failed']}")
+
+
+def get_status_code(e: Exception) -> int:
+    # the SDK raises exceptions as Exception(response_json, status_code)
+    if len(e.args) >= 2 and isinstance(e.args[-1], int):
+        return e.args[-1]
+    return None
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, (superpowered.exceptions.InternalServerError, ConnectionError, OSError)):
+        return True
+    status_code = get_status_code(e)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    # "full jitter" exponential backoff so that workers that failed together don't retry together
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def upload_file(file_path: str, title: str, kb_id: str, rate_limiter: TokenBucket, max_retries: int = 5,
+                base_delay: float = 1.0, max_delay: float = 30.0, preprocessor=None) -> dict:
+    with open(file_path, 'r') as f:
+        text = f.read()
+
+    result = {
+        'title': title,
+        # hash of the source file and the preprocessing config, so the same file is uploaded again when preprocessing changes
+        'content_hash': hash_content(text, preprocessor.fingerprint() if preprocessor is not None else ''),
+        'skipped': False,
+        'duplicate': False,
+        'retries': 0,
+        'document': None,
+        'error': None,
+    }
+    if preprocessor is not None:
+        text = preprocessor(title, text)
+        if text is None:
+            result['skipped'] = True
+            return result
+    result['num_bytes'] = len(text.encode('utf-8'))
+
+    for attempt in range(max_retries + 1):
+        rate_limiter.acquire()
+        try:
+            result['document'] = superpowered.create_document_via_text(knowledge_base_id=kb_id, content=text, title=title, auto_context=True)
+            return result
+        except superpowered.exceptions.DuplicateDocumentContentError:
+            # the knowledge base already has a document with this content, i.e. the manifest was lost or rebuilt
+            result['duplicate'] = True
+            return result
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                result['error'] = e
+                return result
+            result['retries'] += 1
+            time.sleep(backoff_delay(attempt, base_delay, max_delay))
+
+
+def upload_files_concurrently(files, kb_id: str, max_documents: int = 1000, requests_per_second: float = 2.0,
+                              max_in_flight: int = 8, max_retries: int = 5, on_uploaded=None, preprocessor=None) -> UploadStats:
+    """
+    - files is an iterable of (file_path, title) tuples
+    - max_documents is the maximum number of documents that get uploaded successfully 
+    - requests_per_second is the sustained rate of API calls across all workers (retries included)
+    - max_in_flight is the maximum number of uploads running at the same time
+    - on_uploaded is an optional callback that gets the result dict of every successful upload, and of every document
+      the preprocessor dropped (with result['skipped'] set) or that the knowledge base already had (with
+      result['duplicate'] set). It is called from this thread.
+    - preprocessor is an optional callable (e.g. preprocess.MarkdownPreprocessor) that takes (title, text) and returns
+      the text to upload, or None to skip the document
+    """
+    rate_limiter = TokenBucket(rate=requests_per_second)
+    stats = UploadStats()
+    files = iter(files)
+    pending = set()
+    exhausted = False
+
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    try:
+        while True:
+            # only submit as many files as could still count towards max_documents
+            while not exhausted and len(pending) < max_in_flight and stats.uploaded + len(pending) < max_documents:
+                try:
+                    file_path, title = next(files)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.add(executor.submit(upload_file, file_path, title, kb_id, rate_limiter, max_retries, preprocessor=preprocessor))
+
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # reading the file failed
+                    stats.failed += 1
+                    print (f"Error processing file: {e}")
+                    continue
+                stats.retries += result['retries']
+                if result['skipped']:
+                    stats.skipped += 1
+                    if on_uploaded is not None:
+                        on_uploaded(result)
+                    continue
+                if result['duplicate']:
+                    stats.skipped += 1
+                    print (f"Already in the knowledge base: {result['title']}")
+                    if on_uploaded is not None:
+                        on_uploaded(result)
+                    continue
+                if result['error'] is not None:
+                    stats.failed += 1
+                    print (f"Error processing {result['title']}")
+                    continue
+                stats.uploaded += 1
+                stats.bytes_uploaded += result['num_bytes']
+                print (f"Uploaded {result['title']}")
+                if on_uploaded is not None:
+                    on_uploaded(result)
+    except KeyboardInterrupt:
+        print (f"Keyboard interrupt. Exiting.")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        stats.end_time = time.monotonic()
+
+    stats.print_summary()
+    return stats
@@ -1,68 +1,205 @@
+import argparse
 import git
 import os
-import time
 import shutil
 import superpowered
 
+from concurrent_upload import upload_files_concurrently
+from manifest import Manifest, hash_content
+from preprocess import MarkdownPreprocessor
+
 
 DIR = os.path.dirname(os.path.abspath(__file__))
 
 
-def download_sourcegraph_handbook():
-    # clone the Sourcegraph handbook
-    git.Repo.clone_from('https://github.com/sourcegraph/handbook.git', f'{DIR}/_sourcegraph_company_handbook')
+HANDBOOK_REPO_URL = 'https://github.com/sourcegraph/handbook.git'
+HANDBOOK_MIRROR_DIRECTORY = f'{DIR}/_sourcegraph_company_handbook'
+
+
+def download_sourcegraph_handbook(mirror_directory=HANDBOOK_MIRROR_DIRECTORY, repo_url=HANDBOOK_REPO_URL):
+    """
+    Keep a local mirror of the handbook's `content/` directory up to date.
+
+    The first run does a shallow (depth 1), blob-less clone with a sparse checkout of `content/`. Later runs fetch the
+    latest commit and move the mirror to it instead of cloning again.
+
+    Returns (mirror_directory, changed_files), where changed_files is the set of paths (relative to `content/`, in the
+    same format as the document titles) that were added, modified or removed since the last run, or None after a
+    fresh clone, since everything is new.
+    """
+    if not os.path.isdir(os.path.join(mirror_directory, '.git')):
+        repo = git.Repo.clone_from(repo_url, mirror_directory, depth=1, no_checkout=True, filter='blob:none')
+        repo.git.sparse_checkout('set', 'content')
+        repo.git.checkout(repo.active_branch.name)
+        return mirror_directory, None
 
-    return f'{DIR}/_sourcegraph_company_handbook'
+    repo = git.Repo(mirror_directory)
+    old_commit = repo.head.commit.hexsha
+    repo.remotes.origin.fetch(repo.active_branch.name, depth=1)
+    new_commit = repo.git.rev_parse('FETCH_HEAD')
+    if new_commit == old_commit:
+        return mirror_directory, set()
 
+    # the history between the two commits isn't available in a shallow clone, but both trees are, which is all a diff needs
+    diff = repo.git.diff('--name-only', old_commit, new_commit, '--', 'content')
+    repo.git.reset('--hard', new_commit)
+    changed_files = {path[len('content'):] for path in diff.splitlines() if path.endswith('.md')}
+    return mirror_directory, changed_files
 
-def upload_documents(data_directory, kb_id, max_documents=1000):
-    num_documents = 0
-    return_flag = False
+
+def iter_markdown_files(data_directory):
+    # yields (file_path, clean_file_path) for every markdown file in the data directory
     for root, dirs, files in os.walk(data_directory):
-        if return_flag:
-            break
         for file_name in files:
             # just upload markdown files
             if file_name.endswith('.md'):
-                try:
-                    file_path = os.path.join(root, file_name)
-                    clean_file_path = file_path.replace(data_directory, "") # this will be used as the document title since most of these files are titled "index.md"
-                    
-                    with open(file_path, 'r') as f:
-                        text = f.read()
-
-                    # upload files to the Superpowered KB - using relative path as the title adds useful context for the LLM
-                    superpowered.create_document_via_text(knowledge_base_id=kb_id, content=text, title=clean_file_path, auto_context=True)
-                    print (f"Uploaded {clean_file_path}")
-                    time.sleep(1.0) # sleep for 1 second to avoid potential rate limit issues associated with AutoContext
-                except KeyboardInterrupt:
-                    print (f"Keyboard interrupt. Exiting.")
-                    return
-                except Exception as e:
-                    print (f"Error processing {clean_file_path}")
-                    continue
-
-                num_documents += 1
-                if num_documents >= max_documents:
-                    return_flag = True
-                    break
+                file_path = os.path.join(root, file_name)
+                clean_file_path = file_path.replace(data_directory, "") # this will be used as the document title since most of these files are titled "index.md"
+                yield file_path, clean_file_path
+
+
+def sync_documents(data_directory, kb_id, manifest: Manifest, max_documents=1000, requests_per_second=1.0, max_in_flight=1, preprocessor=None):
+    """
+    Bring an existing knowledge base in line with the data directory, using the manifest to work out what changed:
+    - new or modified files are uploaded (the previous version of a modified file is deleted after the new one is in)
+    - documents whose source file no longer exists are deleted
+    - unchanged files are skipped
+    """
+    if not manifest.paths(kb_id):
+        rebuild_manifest(kb_id, manifest)
+    previous_paths = manifest.paths(kb_id)
+    sources = {}
+    for file_path, clean_file_path in iter_markdown_files(data_directory):
+        with open(file_path, 'r') as f:
+            sources[(file_path, clean_file_path)] = f.read()
+    if preprocessor is not None:
+        # boilerplate is worked out from the whole handbook up front, so it doesn't depend on the upload order
+        preprocessor.fit(sources.values())
+    config = preprocessor.fingerprint() if preprocessor is not None else ''
+
+    seen_paths = set()
+    files_to_upload = []
+    for (file_path, clean_file_path), text in sources.items():
+        seen_paths.add(clean_file_path)
+        content_hash = hash_content(text, config)
+        entry = manifest.get(kb_id, clean_file_path)
+        if entry is None or entry['content_hash'] != content_hash:
+            files_to_upload.append((file_path, clean_file_path))
+
+    def on_uploaded(result):
+        # documents dropped by the preprocessor are recorded without a document id so they aren't retried every run
+        previous = manifest.get(kb_id, result['title'])
+        if result['duplicate']:
+            # unchanged since it was uploaded, so keep the document that's already there
+            manifest.upsert(kb_id, result['title'], result['content_hash'], previous['document_id'] if previous else '')
+            return
+        document_id = result['document']['id'] if result['document'] else ''
+        manifest.upsert(kb_id, result['title'], result['content_hash'], document_id)
+        if previous is not None and previous['document_id'] and previous['document_id'] != document_id:
+            delete_document(kb_id, previous['document_id'])
+
+    print (f"{len(files_to_upload)} new or modified files, {len(seen_paths) - len(files_to_upload)} unchanged")
+    if files_to_upload:
+        upload_files_concurrently(
+            files_to_upload,
+            kb_id=kb_id,
+            max_documents=max_documents,
+            requests_per_second=requests_per_second,
+            max_in_flight=max_in_flight,
+            on_uploaded=on_uploaded,
+            preprocessor=preprocessor,
+        )
+
+    num_deleted = 0
+    for clean_file_path in sorted(previous_paths - seen_paths):
+        entry = manifest.get(kb_id, clean_file_path)
+        if not entry['document_id'] or delete_document(kb_id, entry['document_id']):
+            manifest.delete(kb_id, clean_file_path)
+            num_deleted += 1
+            print (f"Deleted {clean_file_path}")
+    print (f"Deleted {num_deleted} documents whose source file was removed")
+
+
+def rebuild_manifest(kb_id, manifest: Manifest):
+    """
+    Fill an empty manifest (i.e. manifest.sqlite was deleted) from the documents that are already in the knowledge base,
+    so they aren't all uploaded again. Their content hashes aren't known, so every file is still sent once: files that
+    haven't changed come back as duplicates and keep their document, and changed files replace it.
+    """
+    documents = superpowered.list_documents(kb_id)
+    for document in documents:
+        if document.get('title'):
+            manifest.upsert(kb_id, document['title'], '', document['id'])
+    if documents:
+        print (f"Rebuilt the manifest from {len(documents)} documents already in the knowledge base")
+
+
+def delete_document(kb_id, document_id) -> bool:
+    try:
+        superpowered.delete_document(kb_id, document_id)
+    except superpowered.exceptions.NotFoundError:
+        pass # already gone
+    except Exception as e:
+        print (f"Error deleting document {document_id}: {e}")
+        return False
+    return True
 
 
 if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Create a Superpowered knowledge base from the Sourcegraph handbook')
+    parser.add_argument('--max-documents', type=int, default=1000)
+    parser.add_argument('--concurrent', action='store_true', help='upload several documents at a time under a shared rate limit')
+    parser.add_argument('--requests-per-second', type=float, default=2.0, help='only used with --concurrent')
+    parser.add_argument('--max-in-flight', type=int, default=8, help='only used with --concurrent')
+    parser.add_argument('--kb-id', help='sync an existing knowledge base instead of creating a new one')
+    parser.add_argument('--manifest', default=f'{DIR}/manifest.sqlite', help='where to keep track of uploaded documents')
+    parser.add_argument('--preprocess', action='store_true', help='strip markdown noise and skip stub pages before uploading')
+    parser.add_argument('--min-chars', type=int, default=200, help='with --preprocess, skip documents shorter than this')
+    parser.add_argument('--remove-mirror', action='store_true', help='delete the local handbook mirror when done')
+    args = parser.parse_args()
 
-    handbook_repo_directory = download_sourcegraph_handbook()
+    handbook_repo_directory, changed_files = download_sourcegraph_handbook()
     data_directory = f'{handbook_repo_directory}/content'
+    if changed_files is not None:
+        # the manifest still decides what gets uploaded, so files that failed to upload on a previous run get retried
+        print (f"{len(changed_files)} handbook files changed since the last run")
+
+    if args.kb_id:
+        kb_id = args.kb_id
+    else:
+        # create a new knowledge base and make note of the id
+        kb = superpowered.create_knowledge_base(title='Sourcegraph Handbook', description='Sourcegraph company handbook full text')
+        kb_id = kb['id']
+        print (f"Created knowledge base with id {kb_id}")
 
-    # create a new knowledge base and make note of the id
-    kb = superpowered.create_knowledge_base(title='Sourcegraph Handbook', description='Sourcegraph company handbook full text')
-    kb_id = kb['id']
-    print (f"Created knowledge base with id {kb_id}")
+    # upload new and modified documents to the knowledge base and record them in the manifest so later runs
+    # (with --kb-id) only upload what changed. With an empty manifest, every document gets uploaded.
+    manifest = Manifest(args.manifest)
+    preprocessor = MarkdownPreprocessor(min_chars=args.min_chars) if args.preprocess else None
+    try:
+        if args.concurrent:
+            sync_documents(
+                data_directory=data_directory,
+                kb_id=kb_id,
+                manifest=manifest,
+                max_documents=args.max_documents,
+                requests_per_second=args.requests_per_second,
+                max_in_flight=args.max_in_flight,
+                preprocessor=preprocessor,
+            )
+        else:
+            # one upload at a time, one request per second
+            sync_documents(data_directory=data_directory, kb_id=kb_id, manifest=manifest, max_documents=args.max_documents, preprocessor=preprocessor)
+    finally:
+        manifest.close()
 
-    # upload all documents to the knowledge base
-    upload_documents(data_directory=data_directory, kb_id=kb_id, max_documents=1000)
+    if preprocessor is not None:
+        preprocessor.print_summary()
 
-    # remove the cloned handbook safely
-    # do a couple of assertions so make sure something terrible doesn't happen
-    assert DIR in handbook_repo_directory
-    assert '_sourcegraph_company_handbook' in handbook_repo_directory
-    shutil.rmtree(handbook_repo_directory)
+    # the mirror is kept around by default so the next run only has to fetch what changed
+    if args.remove_mirror:
+        # remove the cloned handbook safely
+        # do a couple of assertions so make sure something terrible doesn't happen
+        assert DIR in handbook_repo_directory
+        assert '_sourcegraph_company_handbook' in handbook_repo_directory
+        shutil.rmtree(handbook_repo_directory)
@@ -1,7 +1,16 @@
+import argparse
+import functools
 import json
 import openai
 import os
+import statistics
 import superpowered
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from cache import DiskCache, hash_key
 
 DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -27,6 +36,34 @@ AI-GENERATED ANSWER
 GRADE
 """.strip()
 
+# grades several (query, ground truth, answer) triples in one call - see evaluate_responses_batched
+BATCH_EVALUATION_PROMPT = """
+Your job is to evaluate the performance of an AI-powered question answering system. You will be given several numbered items, each with a query, a ground truth answer, and the answer given by the AI. Your task is to grade each of the AI's answers on a scale of 0-10. A score of 0 means the AI's answer is completely wrong. A score of 10 means the AI's answer is completely correct. A score of 5 means the AI's answer is partially correct. Grade each item on its own, independently of the other items.
+
+Your response must ONLY be a JSON list with one integer grade between 0 and 10 (inclusive) per item, in the same order as the items, e.g. [7, 3, 10]. Do not include any other text in your response.
+
+GUIDELINES FOR GRADING
+- The ground truth answers are often lacking in detail, so if the AI's answer is more detailed than the ground truth answer, then that's generally a good sign.
+- Be wary of overly broad or general AI answers. If the AI's answer lacks specifics, then it probably isn't a good answer.
+
+{items}
+
+GRADES
+""".strip()
+
+BATCH_ITEM_TEMPLATE = """
+ITEM {number}
+
+QUERY
+{query}
+
+GROUND TRUTH ANSWER
+{ground_truth_answer}
+
+AI-GENERATED ANSWER
+{model_answer}
+""".strip()
+
 # we'll use this to run the evaluation prompt
 def openai_api_call(chat_messages: list[dict], model_name: str = "gpt-4", temperature: float = 0.0, max_tokens: int = 1) -> str:
     max_tokens = int(max_tokens)
@@ -70,37 +107,498 @@ def evaluate_response(query, gt_answer, model_answer):
     response = openai_api_call(chat_messages, model_name="gpt-4", temperature=0.0, max_tokens=1)
     return response
 
-def run_evaluation(eval_set: list[dict], config: dict):
+def parse_batch_grades(response: str, num_items: int) -> list:
+    # returns one grade (as a string, like evaluate_response) per item, or None for grades that can't be used
+    try:
+        grades = json.loads(response[response.index("["):response.rindex("]") + 1])
+    except ValueError:
+        return [None] * num_items
+    if not isinstance(grades, list) or len(grades) != num_items:
+        return [None] * num_items
+    return [str(grade) if isinstance(grade, int) and not isinstance(grade, bool) and 0 <= grade <= 10 else None for grade in grades]
+
+def evaluate_responses_batched(items: list[tuple]) -> tuple[list[str], int]:
+    """
+    Grades a batch of (query, gt_answer, model_answer) triples with one grader call. Any item whose grade can't be
+    parsed from the response is graded on its own with evaluate_response instead.
+    Returns (grades, number of grader calls made).
+    """
+    if len(items) == 1:
+        return [evaluate_response(*items[0])], 1
+    items_text = "\n\n".join(
+        BATCH_ITEM_TEMPLATE.format(number=i + 1, query=query, ground_truth_answer=gt_answer, model_answer=model_answer)
+        for i, (query, gt_answer, model_answer) in enumerate(items)
+    )
+    prompt = BATCH_EVALUATION_PROMPT.format(items=items_text)
+    chat_messages = [{"role": "user", "content": prompt}]
+    response = openai_api_call(chat_messages, model_name="gpt-4", temperature=0.0, max_tokens=4 * len(items) + 8)
+    grades = parse_batch_grades(response, len(items))
+    num_calls = 1
+    for i, grade in enumerate(grades):
+        if grade is None:
+            grades[i] = evaluate_response(*items[i])
+            num_calls += 1
+    return grades, num_calls
+
+@functools.lru_cache(maxsize=None)
+def kb_version(kb_id: str) -> dict:
+    # changes whenever documents are added, removed or re-uploaded, so answers cached against an older version of the
+    # knowledge base aren't reused. looked up once per knowledge base per run
+    documents = superpowered.list_documents(kb_id)
+    return {
+        "document_count": len(documents),
+        "latest_updated_at": max((str(document.get("updated_at") or document.get("created_at") or "") for document in documents), default=""),
+    }
+
+# cached versions of get_response and evaluate_response - the cache is optional, so these can be used with cache=None
+def get_response_cached(query: str, config: dict, cache: DiskCache = None) -> str:
+    if cache is None:
+        return get_response(query, config)
+    key = hash_key("answer", query, config, kb_version(config["kb_id"]))
+    model_answer = cache.get(key)
+    if model_answer is None:
+        model_answer = get_response(query, config)
+        cache.set(key, model_answer)
+    return model_answer
+
+def evaluate_response_cached(query, gt_answer, model_answer, cache: DiskCache = None):
+    # returns the grade and the number of grader API calls made, i.e. 0 on a cache hit
+    if cache is None:
+        return evaluate_response(query, gt_answer, model_answer), 1
+    # the prompt is part of the key so editing EVALUATION_PROMPT re-grades everything, without re-generating answers
+    key = hash_key("grade", query, gt_answer, model_answer, EVALUATION_PROMPT)
+    grade = cache.get(key)
+    if grade is None:
+        grade = evaluate_response(query, gt_answer, model_answer)
+        cache.set(key, grade)
+        return grade, 1
+    return grade, 0
+
+
+def evaluate_responses_batched_cached(items: list[tuple], cache: DiskCache = None) -> tuple[list[str], int]:
+    # only the items without a cached grade go to the grader. Batched grades are cached separately from single grades.
+    keys = [hash_key("batch_grade", query, gt_answer, model_answer, BATCH_EVALUATION_PROMPT) for query, gt_answer, model_answer in items]
+    grades = [cache.get(key) if cache is not None else None for key in keys]
+    missing = [i for i, grade in enumerate(grades) if grade is None]
+    num_calls = 0
+    if missing:
+        new_grades, num_calls = evaluate_responses_batched([items[i] for i in missing])
+        for i, grade in zip(missing, new_grades):
+            grades[i] = grade
+            if cache is not None:
+                cache.set(keys[i], grade)
+    return grades, num_calls
+
+
+class GradeBatcher:
     """
-    - eval_set is a list of dictionaries, where each dictionary contains:
+    Collects (query, gt_answer, model_answer) triples from several threads and grades them in batches of up to
+    `batch_size` on the given executor. A partial batch is sent once its oldest item has waited `max_wait_seconds`,
+    so nobody waits forever for a batch to fill up. submit() returns a Future for the item's grade.
+    """
+    def __init__(self, executor: ThreadPoolExecutor, batch_size: int, cache: DiskCache = None, max_wait_seconds: float = 2.0):
+        self.executor = executor
+        self.batch_size = batch_size
+        self.cache = cache
+        self.max_wait_seconds = max_wait_seconds
+        self.batch = []
+        self.batch_started_at = None
+        self.condition = threading.Condition()
+        self.closed = False
+        self.num_calls = 0
+        self.latencies = []
+        self.flusher = threading.Thread(target=self.flush_when_stale, daemon=True)
+        self.flusher.start()
+
+    def submit(self, query: str, gt_answer: str, model_answer: str) -> Future:
+        future = Future()
+        with self.condition:
+            if not self.batch:
+                self.batch_started_at = time.monotonic()
+            self.batch.append(((query, gt_answer, model_answer), future))
+            if len(self.batch) >= self.batch_size:
+                self.send_batch()
+            self.condition.notify()
+        return future
+
+    def send_batch(self):
+        # must be called with self.condition held
+        batch, self.batch = self.batch, []
+        if batch:
+            self.executor.submit(self.grade_batch, batch)
+
+    def grade_batch(self, batch: list):
+        stage_start = time.perf_counter()
+        try:
+            grades, num_calls = evaluate_responses_batched_cached([item for item, _ in batch], self.cache)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        with self.condition:
+            self.num_calls += num_calls
+            self.latencies.append(time.perf_counter() - stage_start)
+        for (_, future), grade in zip(batch, grades):
+            future.set_result(grade)
+
+    def flush_when_stale(self):
+        with self.condition:
+            while not self.closed:
+                if self.batch and time.monotonic() - self.batch_started_at >= self.max_wait_seconds:
+                    self.send_batch()
+                timeout = self.max_wait_seconds if not self.batch else max(0.0, self.batch_started_at + self.max_wait_seconds - time.monotonic())
+                self.condition.wait(timeout)
+
+    def flush(self):
+        # sends the current partial batch right away, e.g. when no more items are coming
+        with self.condition:
+            self.send_batch()
+
+    def close(self):
+        # sends whatever is left; call before shutting down the executor
+        with self.condition:
+            self.send_batch()
+            self.closed = True
+            self.condition.notify()
+        self.flusher.join()
+
+
+def compare_batched_grading(eval_results: list[dict], batch_size: int = 5, sample_size: int = 20) -> dict:
+    """
+    Grades a fixed sample of existing results (e.g. from eval_results.json) both one at a time and in batches, and
+    reports how well the grades agree and how many grader calls each approach took. Nothing is cached here.
+    """
+    sample = eval_results[:sample_size]
+    items = [(result["query"], result["gt_answer"], result["model_answer"]) for result in sample]
+    single_grades = [evaluate_response(*item) for item in items]
+
+    batched_grades = []
+    batched_calls = 0
+    for i in range(0, len(items), batch_size):
+        grades, num_calls = evaluate_responses_batched(items[i:i + batch_size])
+        batched_grades.extend(grades)
+        batched_calls += num_calls
+
+    pairs = []
+    for single_grade, batched_grade in zip(single_grades, batched_grades):
+        try:
+            pairs.append((int(single_grade), int(batched_grade)))
+        except ValueError:
+            pass # the single-item grader didn't return an integer
+    comparison = {
+        "sample_size": len(items),
+        "batch_size": batch_size,
+        "single_grader_calls": len(items),
+        "batched_grader_calls": batched_calls,
+        "exact_agreement": round(sum(a == b for a, b in pairs) / len(pairs), 3) if pairs else None,
+        "within_one_agreement": round(sum(abs(a - b) <= 1 for a, b in pairs) / len(pairs), 3) if pairs else None,
+        "mean_absolute_difference": round(statistics.mean(abs(a - b) for a, b in pairs), 3) if pairs else None,
+        "single_grades": single_grades,
+        "batched_grades": batched_grades,
+    }
+    return comparison
+
+
+def cache_stats(answer_cache: DiskCache = None, grade_cache: DiskCache = None) -> dict:
+    stats = {}
+    if answer_cache is not None:
+        stats["answers"] = answer_cache.stats()
+    if grade_cache is not None:
+        stats["grades"] = grade_cache.stats()
+    return stats
+
+
+def summarize_latencies(latencies: list[float]) -> dict:
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "mean": round(statistics.mean(latencies), 3),
+        "p50": round(latencies[int(0.50 * (len(latencies) - 1))], 3),
+        "p95": round(latencies[int(0.95 * (len(latencies) - 1))], 3),
+        "max": round(latencies[-1], 3),
+    }
+
+
+RESULTS_JSONL_PATH = f"{DIR}/eval_results.jsonl"
+
+
+def load_eval_set(path: str):
+    # streams eval items from a JSONL file (one {"query": ..., "gt_answer": ...} object per line)
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def eval_item_id(eval_item: dict, config: dict, grade_batch_size: int = 1) -> str:
+    # the grading prompt and mode are part of the id, so a result graded a different way is never resumed or exported
+    if grade_batch_size > 1:
+        grading = ("batch", grade_batch_size, BATCH_EVALUATION_PROMPT, BATCH_ITEM_TEMPLATE, EVALUATION_PROMPT)
+    else:
+        grading = ("single", EVALUATION_PROMPT)
+    return hash_key(eval_item["query"], eval_item["gt_answer"], config, grading)
+
+
+def load_completed_ids(results_path: str) -> set:
+    # ids of the items that already have a result, so a restarted run can skip them
+    completed_ids = set()
+    if not os.path.exists(results_path):
+        return completed_ids
+    with open(results_path, "r") as f:
+        for line in f:
+            try:
+                completed_ids.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                pass # partially written line from a crash - the item will just be run again
+    return completed_ids
+
+
+def append_result(f, item_id: str, eval_item: dict, model_answer: str, grade: str):
+    f.write(json.dumps({
+        "id": item_id,
+        "query": eval_item["query"],
+        "gt_answer": eval_item["gt_answer"],
+        "model_answer": model_answer,
+        "grade": grade,
+    }) + "\n")
+    f.flush()
+
+
+def open_results_file(results_path: str, resume: bool = False):
+    if not resume:
+        return open(results_path, "w")
+    # if the last run crashed halfway through a line, start on a new line so that line is the only one lost
+    if os.path.exists(results_path) and os.path.getsize(results_path) > 0:
+        with open(results_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            ends_with_newline = f.read(1) == b"\n"
+        if not ends_with_newline:
+            with open(results_path, "a") as f:
+                f.write("\n")
+    return open(results_path, "a")
+
+
+def export_results_json(item_ids: list[str], results_path: str = RESULTS_JSONL_PATH) -> list[dict]:
+    # convert the JSONL results into a pretty JSON file next to it, i.e. eval_results.jsonl -> eval_results.json
+    # (same format as eval_results.json had before results were streamed to JSONL). Only the results for item_ids (the
+    # current eval set and config) are exported, in that order, even if the JSONL file has results from other runs
+    json_path = os.path.splitext(results_path)[0] + ".json"
+    wanted_ids = set(item_ids)
+    results_by_id = {}
+    with open(results_path, "r") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            item_id = result.pop("id", None)
+            if item_id in wanted_ids:
+                results_by_id[item_id] = result
+    eval_results = [results_by_id[item_id] for item_id in item_ids if item_id in results_by_id]
+    with open(json_path, "w") as f:
+        json.dump(eval_results, f, indent=4)
+    return eval_results
+
+
+def save_timings(timings: dict, results_path: str = RESULTS_JSONL_PATH):
+    # timings are kept in a separate file next to the results (i.e. eval_results.jsonl -> eval_results_timings.json) so
+    # the eval_results.json schema doesn't change and runs with different --results don't overwrite each other's timings
+    with open(os.path.splitext(results_path)[0] + "_timings.json", "w") as f:
+        json.dump(timings, f, indent=4)
+
+    print (f"\nWall clock: {timings['wall_clock_seconds']}s ({timings['skipped']} items already done)")
+    print (f"Answer latency (s): {timings['answer_latency']}")
+    print (f"Grading latency (s): {timings['grade_latency']} ({timings['grader_calls']} grader calls)")
+    if timings.get("cache"):
+        print (f"Cache: {timings['cache']}")
+
+
+def run_evaluation(eval_set, config: dict, answer_cache: DiskCache = None, grade_cache: DiskCache = None, results_path: str = RESULTS_JSONL_PATH,
+                   grade_batch_size: int = 1, resume: bool = False):
+    """
+    - eval_set is an iterable (e.g. a list, or load_eval_set(path)) of dictionaries, where each dictionary contains:
         - "query": the query
         - "gt_answer": the ground truth answer, i.e. what you want the model to output
     - config is a dictionary containing:
         - "use_rse": whether to use the RSE or not
         - "kb_id": the ID of the knowledge base to use
         - "system_message": the system message to use
+    - answer_cache and grade_cache are optional DiskCaches for model answers and grades
+    - results_path is the JSONL file every result is written to as soon as it's ready. It's overwritten unless
+      resume=True, in which case items that already have a result there (for this config and grading prompt/mode)
+      are skipped, so an interrupted run picks up where it left off.
+    - grade_batch_size > 1 grades that many answers per grader call (see evaluate_responses_batched)
     """
     # run the evaluation
-    eval_results = []
-    for eval_item in eval_set:
-        query = eval_item["query"]
-        gt_answer = eval_item["gt_answer"]
-        model_answer = get_response(query, config)
+    start_time = time.perf_counter()
+    completed_ids = load_completed_ids(results_path) if resume else set()
+    item_ids = []
+    num_skipped = 0
+    answer_latencies = []
+    grade_latencies = []
+    num_grader_calls = 0
+    ungraded = []
 
-        grade = evaluate_response(query, gt_answer, model_answer)
-        print(grade)
-
-        # save the results
-        eval_results.append({
-            "query": query,
-            "gt_answer": gt_answer,
-            "model_answer": model_answer,
-            "grade": grade,
-        })
-
-    # export eval results to a json file
-    with open(f"{DIR}/eval_results.json", "w") as f:
-        json.dump(eval_results, f, indent=4)
+    def grade_and_save(results_file):
+        # grades everything answered so far and saves the results
+        nonlocal num_grader_calls
+        stage_start = time.perf_counter()
+        if grade_batch_size > 1:
+            grades, num_calls = evaluate_responses_batched_cached(
+                [(eval_item["query"], eval_item["gt_answer"], model_answer) for _, eval_item, model_answer in ungraded], grade_cache
+            )
+        else:
+            _, eval_item, model_answer = ungraded[0]
+            grade, num_calls = evaluate_response_cached(eval_item["query"], eval_item["gt_answer"], model_answer, grade_cache)
+            grades = [grade]
+        grade_latencies.append(time.perf_counter() - stage_start)
+        num_grader_calls += num_calls
+
+        for (item_id, eval_item, model_answer), grade in zip(ungraded, grades):
+            print(grade)
+            append_result(results_file, item_id, eval_item, model_answer, grade)
+            completed_ids.add(item_id)
+        ungraded.clear()
+
+    with open_results_file(results_path, resume) as results_file:
+        for eval_item in eval_set:
+            item_id = eval_item_id(eval_item, config, grade_batch_size)
+            item_ids.append(item_id)
+            if item_id in completed_ids:
+                num_skipped += 1
+                continue
+            stage_start = time.perf_counter()
+            model_answer = get_response_cached(eval_item["query"], config, answer_cache)
+            answer_latencies.append(time.perf_counter() - stage_start)
+
+            ungraded.append((item_id, eval_item, model_answer))
+            if len(ungraded) >= grade_batch_size:
+                grade_and_save(results_file)
+        if ungraded:
+            grade_and_save(results_file)
+
+    save_timings({
+        "wall_clock_seconds": round(time.perf_counter() - start_time, 3),
+        "skipped": num_skipped,
+        "answer_latency": summarize_latencies(answer_latencies),
+        "grade_latency": summarize_latencies(grade_latencies),
+        "grader_calls": num_grader_calls,
+        "cache": cache_stats(answer_cache, grade_cache),
+    }, results_path)
+    return export_results_json(item_ids, results_path)
+
+
+def run_evaluation_concurrently(eval_set, config: dict, max_answer_workers: int = 4, max_grade_workers: int = 4,
+                                answer_cache: DiskCache = None, grade_cache: DiskCache = None, results_path: str = RESULTS_JSONL_PATH,
+                                grade_batch_size: int = 1, resume: bool = False):
+    """
+    Same as run_evaluation, but runs several eval items at a time. Answers are generated by up to max_answer_workers
+    threads and each answer is graded (by up to max_grade_workers threads) as soon as it comes back, so grading
+    overlaps with answer generation. Results are still written in eval_set order, same as run_evaluation, and only a
+    bounded window of items is in flight at any time so large eval sets can be streamed.
+    With grade_batch_size > 1, answers are grouped into batches for the grader (see GradeBatcher).
+    """
+    start_time = time.perf_counter()
+    completed_ids = load_completed_ids(results_path) if resume else set()
+    item_ids = []
+    num_skipped = 0
+    answer_latencies = []
+    grade_latencies = []
+    grader_calls = {"count": 0}
+    grader_calls_lock = threading.Lock()
+    max_in_flight = 2 * (max_answer_workers + max_grade_workers)
+
+    def timed_get_response(query: str) -> str:
+        stage_start = time.perf_counter()
+        model_answer = get_response_cached(query, config, answer_cache)
+        answer_latencies.append(time.perf_counter() - stage_start)
+        return model_answer
+
+    def timed_evaluate_response(query: str, gt_answer: str, model_answer: str) -> str:
+        stage_start = time.perf_counter()
+        grade, num_calls = evaluate_response_cached(query, gt_answer, model_answer, grade_cache)
+        grade_latencies.append(time.perf_counter() - stage_start)
+        with grader_calls_lock:
+            grader_calls["count"] += num_calls
+        return grade
+
+    with ThreadPoolExecutor(max_workers=max_answer_workers) as answer_executor, ThreadPoolExecutor(max_workers=max_grade_workers) as grade_executor:
+        grade_batcher = GradeBatcher(grade_executor, grade_batch_size, grade_cache) if grade_batch_size > 1 else None
+        # once every answer is in, the last partial batch doesn't need to wait to fill up
+        answers_pending = {"count": 0, "all_submitted": False}
+        answers_pending_lock = threading.Lock()
+
+        def answer_finished():
+            with answers_pending_lock:
+                answers_pending["count"] -= 1
+                flush = answers_pending["all_submitted"] and answers_pending["count"] == 0
+            if flush and grade_batcher is not None:
+                grade_batcher.flush()
+
+        def grade_when_answered(answer_future: Future, eval_item: dict, slot: Future):
+            # start grading each answer as soon as it's ready
+            try:
+                model_answer = answer_future.result()
+                if grade_batcher is not None:
+                    grade_future = grade_batcher.submit(eval_item["query"], eval_item["gt_answer"], model_answer)
+                else:
+                    grade_future = grade_executor.submit(timed_evaluate_response, eval_item["query"], eval_item["gt_answer"], model_answer)
+            except Exception as e:
+                slot.set_exception(e)
+                return
+            finally:
+                answer_finished()
+            slot.set_result((model_answer, grade_future))
+
+        def write_oldest_result(results_file, in_flight: deque):
+            item_id, eval_item, slot = in_flight.popleft()
+            model_answer, grade_future = slot.result()
+            grade = grade_future.result()
+            print(grade)
+            append_result(results_file, item_id, eval_item, model_answer, grade)
+
+        in_flight = deque()
+        with open_results_file(results_path, resume) as results_file:
+            for eval_item in eval_set:
+                item_id = eval_item_id(eval_item, config, grade_batch_size)
+                item_ids.append(item_id)
+                if item_id in completed_ids:
+                    num_skipped += 1
+                    continue
+                completed_ids.add(item_id)
+                slot = Future()
+                with answers_pending_lock:
+                    answers_pending["count"] += 1
+                answer_future = answer_executor.submit(timed_get_response, eval_item["query"])
+                answer_future.add_done_callback(lambda answer_future, eval_item=eval_item, slot=slot: grade_when_answered(answer_future, eval_item, slot))
+                in_flight.append((item_id, eval_item, slot))
+                if len(in_flight) >= max_in_flight:
+                    write_oldest_result(results_file, in_flight)
+            with answers_pending_lock:
+                answers_pending["all_submitted"] = True
+                flush = answers_pending["count"] == 0
+            if flush and grade_batcher is not None:
+                grade_batcher.flush()
+            while in_flight:
+                write_oldest_result(results_file, in_flight)
+
+        num_grader_calls = grader_calls["count"]
+        if grade_batcher is not None:
+            grade_batcher.close()
+            num_grader_calls = grade_batcher.num_calls
+            grade_latencies = grade_batcher.latencies
+
+    save_timings({
+        "wall_clock_seconds": round(time.perf_counter() - start_time, 3),
+        "skipped": num_skipped,
+        "answer_latency": summarize_latencies(answer_latencies),
+        "grade_latency": summarize_latencies(grade_latencies),
+        "grader_calls": num_grader_calls,
+        "cache": cache_stats(answer_cache, grade_cache),
+    }, results_path)
+    return export_results_json(item_ids, results_path)
 
 
 # eval set is a list of dicts, each with keys "query" and "gt_answer" (ground truth answer)
@@ -158,5 +656,56 @@ config = {
     "system_message": SYSTEM_MESSAGE,
 }
 
-print ("\nRunning evaluation...")
-run_evaluation(eval_set, config)
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrent", action="store_true", help="evaluate several items at a time")
+    parser.add_argument("--max-answer-workers", type=int, default=4, help="max Superpowered chat calls in flight (with --concurrent)")
+    parser.add_argument("--max-grade-workers", type=int, default=4, help="max grading calls in flight (with --concurrent)")
+    parser.add_argument("--grade-batch-size", type=int, default=1, help="number of answers to grade per grader call")
+    parser.add_argument("--compare-grading", action="store_true", help="compare batched and single-item grades on a sample of eval_results.json and exit")
+    parser.add_argument("--compare-sample-size", type=int, default=20)
+    parser.add_argument("--eval-set", help="JSONL file with one {\"query\": ..., \"gt_answer\": ...} object per line (defaults to the eval set in this file)")
+    parser.add_argument("--results", default=RESULTS_JSONL_PATH, help="JSONL file results are written to")
+    parser.add_argument("--resume", action="store_true", help="keep the existing results file and skip the items that already have a result in it")
+    parser.add_argument("--cache", action="store_true", help="reuse answers and grades cached by earlier runs (and cache new ones)")
+    parser.add_argument("--refresh-cache", action="store_true", help="with --cache, recompute everything and overwrite the cached answers and grades")
+    parser.add_argument("--cache-max-entries", type=int, default=10000)
+    parser.add_argument("--cache-max-age-days", type=float, default=30)
+    args = parser.parse_args()
+
+    if args.compare_grading:
+        # eval_results.json only has the results of the last run, so the sample is all one eval set and config
+        with open(os.path.splitext(args.results)[0] + ".json", "r") as f:
+            comparison = compare_batched_grading(json.load(f), batch_size=max(args.grade_batch_size, 2), sample_size=args.compare_sample_size)
+        print (json.dumps(comparison, indent=4))
+        raise SystemExit
+
+    answer_cache, grade_cache = None, None
+    if args.cache:
+        cache_args = {
+            "max_entries": args.cache_max_entries,
+            "max_age_seconds": args.cache_max_age_days * 24 * 60 * 60,
+            "refresh": args.refresh_cache,
+        }
+        answer_cache = DiskCache(f"{DIR}/answer_cache.sqlite", **cache_args)
+        grade_cache = DiskCache(f"{DIR}/grade_cache.sqlite", **cache_args)
+
+    if args.eval_set:
+        eval_set = load_eval_set(args.eval_set)
+
+    print ("\nRunning evaluation...")
+    if args.concurrent:
+        run_evaluation_concurrently(
+            eval_set,
+            config,
+            results_path=args.results,
+            max_answer_workers=args.max_answer_workers,
+            max_grade_workers=args.max_grade_workers,
+            answer_cache=answer_cache,
+            grade_cache=grade_cache,
+            grade_batch_size=args.grade_batch_size,
+            resume=args.resume,
+        )
+    else:
+        run_evaluation(eval_set, config, answer_cache=answer_cache, grade_cache=grade_cache, results_path=args.results, grade_batch_size=args.grade_batch_size,
+                       resume=args.resume)
\ No newline at end of file
@@ -0,0 +1,53 @@
+import hashlib
+import sqlite3
+import time
+
+
+def hash_content(text: str, config: str = '') -> str:
+    # `config` describes how the text is processed before it's uploaded (see MarkdownPreprocessor.fingerprint)
+    return hashlib.sha256((config + text).encode('utf-8')).hexdigest()
+
+
+class Manifest:
+    """
+    On-disk record of what has been uploaded to each knowledge base. Maps the document title (the file path relative
+    to the handbook `content/` directory) to the hash of the uploaded content and the Superpowered document id.
+    """
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                kb_id TEXT NOT NULL,
+                path TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                document_id TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (kb_id, path)
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, kb_id: str, path: str) -> dict:
+        row = self.conn.execute(
+            'SELECT content_hash, document_id FROM documents WHERE kb_id = ? AND path = ?', (kb_id, path)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'content_hash': row[0], 'document_id': row[1]}
+
+    def paths(self, kb_id: str) -> set:
+        return {row[0] for row in self.conn.execute('SELECT path FROM documents WHERE kb_id = ?', (kb_id,))}
+
+    def upsert(self, kb_id: str, path: str, content_hash: str, document_id: str):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO documents (kb_id, path, content_hash, document_id, updated_at) VALUES (?, ?, ?, ?, ?)',
+            (kb_id, path, content_hash, document_id, time.time())
+        )
+        self.conn.commit()
+
+    def delete(self, kb_id: str, path: str):
+        self.conn.execute('DELETE FROM documents WHERE kb_id = ? AND path = ?', (kb_id, path))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
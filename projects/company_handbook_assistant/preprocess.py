@@ -0,0 +1,189 @@
+import hashlib
+import re
+import threading
+
+
+FRONT_MATTER_RE = re.compile(r'\A---\s*\n.*?\n---\s*\n', re.DOTALL)
+HTML_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+BADGE_RE = re.compile(r'\[!\[[^\]]*\]\([^)]*\)\]\([^)]*\)')
+MARKDOWN_IMAGE_RE = re.compile(r'!\[[^\]]*\]\([^)]*\)')
+HTML_IMAGE_RE = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+MARKDOWN_LINK_RE = re.compile(r'\[([^\]]+)\]\([^)]*\)')
+TRAILING_WHITESPACE_RE = re.compile(r'[ \t]+$', re.MULTILINE)
+BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+
+def approximate_tokens(text: str) -> int:
+    # roughly 4 characters per token for English text
+    return len(text) // 4
+
+
+def strip_front_matter(text: str) -> str:
+    return FRONT_MATTER_RE.sub('', text)
+
+
+def strip_html_comments(text: str) -> str:
+    return HTML_COMMENT_RE.sub('', text)
+
+
+def strip_images(text: str) -> str:
+    # badges/shields are images wrapped in links, so they have to go before the plain images
+    text = BADGE_RE.sub('', text)
+    text = MARKDOWN_IMAGE_RE.sub('', text)
+    return HTML_IMAGE_RE.sub('', text)
+
+
+def strip_link_urls(text: str) -> str:
+    # keep the link text but drop the URL, which is most of the bytes in tables of links and adds nothing for retrieval
+    return MARKDOWN_LINK_RE.sub(r'\1', text)
+
+
+def normalize_whitespace(text: str) -> str:
+    text = TRAILING_WHITESPACE_RE.sub('', text)
+    return BLANK_LINES_RE.sub('\n\n', text).strip() + '\n'
+
+
+class BoilerplateFilter:
+    """
+    Drops lines (navigation, footers, etc.) that show up in more than `max_repeats` documents. The line counts come
+    from a first pass over the whole corpus (`fit`), so every document is processed the same way no matter the upload
+    order. Table rows, headings and code blocks are never dropped, since shared table headers and separators
+    (`| --- | --- |`) are structure, not boilerplate. Until `fit` is called nothing is dropped.
+    """
+    def __init__(self, max_repeats: int = 3, min_line_length: int = 20):
+        self.max_repeats = max_repeats
+        self.min_line_length = min_line_length
+        self.boilerplate_lines = set()
+
+    def candidate_lines(self, text: str) -> set:
+        lines = set()
+        in_code_block = False
+        for line in text.split('\n'):
+            key = line.strip()
+            if key.startswith(('```', '~~~')):
+                in_code_block = not in_code_block
+                continue
+            if in_code_block or len(key) < self.min_line_length or key.startswith(('|', '#')):
+                continue
+            lines.add(key)
+        return lines
+
+    def fit(self, texts):
+        line_counts = {}
+        for text in texts:
+            for key in self.candidate_lines(text):
+                line_counts[key] = line_counts.get(key, 0) + 1
+        self.boilerplate_lines = {key for key, count in line_counts.items() if count > self.max_repeats}
+
+    def __call__(self, text: str) -> str:
+        if not self.boilerplate_lines:
+            return text
+        candidates = self.candidate_lines(text) & self.boilerplate_lines
+        return '\n'.join(line for line in text.split('\n') if line.strip() not in candidates)
+
+    def fingerprint(self) -> str:
+        # the fitted lines decide what gets dropped, so a corpus change that adds or removes boilerplate counts as a
+        # preprocessing change too
+        lines_hash = hashlib.sha256('\n'.join(sorted(self.boilerplate_lines)).encode('utf-8')).hexdigest()
+        return f'{self!r}[{lines_hash}]'
+
+    def __repr__(self):
+        return f'BoilerplateFilter(max_repeats={self.max_repeats}, min_line_length={self.min_line_length})'
+
+
+def default_processors() -> list:
+    return [
+        strip_front_matter,
+        strip_html_comments,
+        strip_images,
+        strip_link_urls,
+        BoilerplateFilter(),
+        normalize_whitespace,
+    ]
+
+
+class MarkdownPreprocessor:
+    """
+    Runs each document through a list of processors (functions that take and return the document text) before it
+    gets uploaded, and keeps track of how many bytes and tokens that saved. Documents that end up shorter than
+    `min_chars` are dropped. Calling the preprocessor returns the processed text, or None if the document was dropped.
+    Safe to call from several upload threads at once.
+    """
+    def __init__(self, processors: list = None, min_chars: int = 200, verbose: bool = True):
+        self.processors = processors if processors is not None else default_processors()
+        self.min_chars = min_chars
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.num_documents = 0
+        self.num_dropped = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def fit(self, texts):
+        # processors with a `fit` method (BoilerplateFilter) look at the whole corpus, as it is when it gets to them,
+        # before any document is processed
+        texts = list(texts)
+        for i, processor in enumerate(self.processors):
+            if hasattr(processor, 'fit'):
+                processor.fit([self.apply(text, self.processors[:i]) for text in texts])
+
+    def fingerprint(self) -> str:
+        # part of the manifest hash, so changing the preprocessing (or turning it on or off) re-uploads the documents
+        names = []
+        for processor in self.processors:
+            if hasattr(processor, 'fingerprint'):
+                names.append(processor.fingerprint())
+            elif hasattr(processor, '__name__'):
+                names.append(processor.__name__)
+            else:
+                names.append(repr(processor))
+        return f'preprocess:{",".join(names)};min_chars={self.min_chars}'
+
+    @staticmethod
+    def apply(text: str, processors: list) -> str:
+        for processor in processors:
+            text = processor(text)
+        return text
+
+    def __call__(self, title: str, text: str) -> str:
+        processed_text = self.apply(text, self.processors)
+
+        dropped = len(processed_text.strip()) < self.min_chars
+        bytes_before = len(text.encode('utf-8'))
+        bytes_after = 0 if dropped else len(processed_text.encode('utf-8'))
+        tokens_before = approximate_tokens(text)
+        tokens_after = 0 if dropped else approximate_tokens(processed_text)
+        with self.lock:
+            self.num_documents += 1
+            self.num_dropped += int(dropped)
+            self.bytes_before += bytes_before
+            self.bytes_after += bytes_after
+            self.tokens_before += tokens_before
+            self.tokens_after += tokens_after
+
+        if self.verbose:
+            if dropped:
+                print (f"Dropped {title} ({bytes_before} bytes, below {self.min_chars} characters after preprocessing)")
+            else:
+                print (f"Preprocessed {title}: {bytes_before} -> {bytes_after} bytes, ~{tokens_before} -> ~{tokens_after} tokens")
+        return None if dropped else processed_text
+
+    def summary(self) -> dict:
+        return {
+            'documents': self.num_documents,
+            'dropped': self.num_dropped,
+            'bytes_before': self.bytes_before,
+            'bytes_after': self.bytes_after,
+            'tokens_before': self.tokens_before,
+            'tokens_after': self.tokens_after,
+            'byte_reduction_pct': round(100 * (1 - self.bytes_after / self.bytes_before), 1) if self.bytes_before else 0.0,
+            'token_reduction_pct': round(100 * (1 - self.tokens_after / self.tokens_before), 1) if self.tokens_before else 0.0,
+        }
+
+    def print_summary(self):
+        s = self.summary()
+        print (f"Preprocessed {s['documents']} documents ({s['dropped']} dropped)")
+        print (f"Bytes: {s['bytes_before']} -> {s['bytes_after']} (-{s['byte_reduction_pct']}%)")
+        print (f"Approximate tokens: {s['tokens_before']} -> {s['tokens_after']} (-{s['token_reduction_pct']}%)")
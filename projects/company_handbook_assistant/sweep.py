@@ -0,0 +1,177 @@
+"""
+Run the handbook eval over a grid of configs and compare them.
+
+All configs share the same answer/grading thread pools, and work is shared wherever the inputs are identical: the same
+(query, config) is only answered once and the same (query, ground truth, answer) is only graded once, on top of the
+on-disk caches used by eval.py (with --cache).
+
+    python sweep.py --max-answer-workers 8 --max-grade-workers 8
+"""
+import argparse
+import itertools
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from cache import DiskCache, hash_key
+from eval import DIR, SYSTEM_MESSAGE, config, eval_set, evaluate_response_cached, get_response_cached, summarize_latencies
+
+
+def expand_config_grid(config_grid: dict) -> list[dict]:
+    # {"use_rse": [True, False], "kb_id": ["a"]} -> [{"use_rse": True, "kb_id": "a"}, {"use_rse": False, "kb_id": "a"}]
+    keys = list(config_grid.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*(config_grid[key] for key in keys))]
+
+
+def config_label(config: dict) -> str:
+    # long values (i.e. system messages) are replaced with a short hash to keep the report readable
+    parts = []
+    for key, value in config.items():
+        if isinstance(value, str) and len(value) > 40:
+            value = f"#{hash_key(value)[:8]}"
+        parts.append(f"{key}={value}")
+    return ", ".join(parts)
+
+
+def parse_grade(grade: str) -> int:
+    try:
+        grade = int(str(grade).strip())
+    except ValueError:
+        return None
+    return grade if 0 <= grade <= 10 else None
+
+
+class SharedWork:
+    """
+    Runs a function at most once per key on the given executor and hands every caller the same future.
+    """
+    def __init__(self, executor: ThreadPoolExecutor):
+        self.executor = executor
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.shared = 0
+
+    def submit(self, key: str, fn, *args):
+        with self.lock:
+            if key in self.futures:
+                self.shared += 1
+                return self.futures[key]
+            future = self.executor.submit(fn, *args)
+            self.futures[key] = future
+            return future
+
+
+def run_sweep(eval_set: list[dict], configs: list[dict], max_answer_workers: int = 4, max_grade_workers: int = 4,
+              answer_cache: DiskCache = None, grade_cache: DiskCache = None) -> dict:
+    start_time = time.perf_counter()
+    answer_latencies = {}
+    # identical configs would only produce identical results
+    configs = list({config_label(config): config for config in configs}.values())
+
+    def timed_get_response(key: str, query: str, config: dict) -> str:
+        stage_start = time.perf_counter()
+        model_answer = get_response_cached(query, config, answer_cache)
+        answer_latencies[key] = time.perf_counter() - stage_start
+        return model_answer
+
+    with ThreadPoolExecutor(max_workers=max_answer_workers) as answer_executor, ThreadPoolExecutor(max_workers=max_grade_workers) as grade_executor:
+        answers = SharedWork(answer_executor)
+        grades = SharedWork(grade_executor)
+
+        def grade_when_answered(answer_future: Future, eval_item: dict, slot: Future):
+            # called as soon as the answer is ready, so grading overlaps with generating the remaining answers
+            try:
+                model_answer = answer_future.result()
+                grade_key = hash_key("grade", eval_item["query"], eval_item["gt_answer"], model_answer)
+                grade_future = grades.submit(grade_key, evaluate_response_cached, eval_item["query"], eval_item["gt_answer"], model_answer, grade_cache)
+            except Exception as e:
+                slot.set_exception(e)
+                return
+            slot.set_result((model_answer, grade_future))
+
+        # submit every (config, item) pair up front so all configs share the same pools
+        pending = []
+        for config in configs:
+            for eval_item in eval_set:
+                answer_key = hash_key("answer", eval_item["query"], config)
+                answer_future = answers.submit(answer_key, timed_get_response, answer_key, eval_item["query"], config)
+                slot = Future()
+                answer_future.add_done_callback(lambda answer_future, eval_item=eval_item, slot=slot: grade_when_answered(answer_future, eval_item, slot))
+                pending.append((config, eval_item, answer_key, slot))
+
+        results = {config_label(config): {"config": config, "items": []} for config in configs}
+        for config, eval_item, answer_key, slot in pending:
+            model_answer, grade_future = slot.result()
+            results[config_label(config)]["items"].append({
+                "query": eval_item["query"],
+                "gt_answer": eval_item["gt_answer"],
+                "model_answer": model_answer,
+                "grade": grade_future.result()[0],
+                "answer_latency": answer_latencies[answer_key],
+            })
+
+    report = {}
+    for label, result in results.items():
+        grades_list = [parse_grade(item["grade"]) for item in result["items"]]
+        valid_grades = [grade for grade in grades_list if grade is not None]
+        report[label] = {
+            "config": result["config"],
+            "mean_grade": round(statistics.mean(valid_grades), 2) if valid_grades else None,
+            "median_grade": statistics.median(valid_grades) if valid_grades else None,
+            "grade_distribution": {str(grade): valid_grades.count(grade) for grade in range(11) if grade in valid_grades},
+            "unparseable_grades": len(grades_list) - len(valid_grades),
+            "answer_latency": summarize_latencies([item["answer_latency"] for item in result["items"]]),
+        }
+
+    return {
+        "wall_clock_seconds": round(time.perf_counter() - start_time, 3),
+        "shared_answers": answers.shared,
+        "shared_grades": grades.shared,
+        "report": report,
+        "results": results,
+    }
+
+
+def print_report(sweep: dict):
+    print (f"\nSweep finished in {sweep['wall_clock_seconds']}s ({sweep['shared_answers']} answers and {sweep['shared_grades']} grades reused)\n")
+    print (f"{'mean':>6} {'median':>6} {'p50 s':>7} {'p95 s':>7}  config")
+    for label, row in sorted(sweep["report"].items(), key=lambda item: -(item[1]["mean_grade"] or 0)):
+        latency = row["answer_latency"]
+        print (f"{row['mean_grade']!s:>6} {row['median_grade']!s:>6} {latency.get('p50')!s:>7} {latency.get('p95')!s:>7}  {label}")
+        print (f"{'':>30}grades: {row['grade_distribution']}")
+
+
+# the grid of configs to compare - every combination gets evaluated
+ALTERNATE_SYSTEM_MESSAGE = """
+You are a helpful assistant for Sourcegraph employees. Answer questions using only the company handbook excerpts provided below. If the excerpts don't contain the answer, say that you don't know.
+""".strip()
+
+config_grid = {
+    "use_rse": [True, False],
+    "kb_id": [config["kb_id"]],
+    "system_message": [SYSTEM_MESSAGE, ALTERNATE_SYSTEM_MESSAGE],
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-answer-workers", type=int, default=4, help="max Superpowered chat calls in flight, shared by all configs")
+    parser.add_argument("--max-grade-workers", type=int, default=4, help="max grading calls in flight, shared by all configs")
+    parser.add_argument("--cache", action="store_true", help="reuse answers and grades cached by earlier runs (and cache new ones)")
+    args = parser.parse_args()
+
+    answer_cache, grade_cache = None, None
+    if args.cache:
+        answer_cache = DiskCache(f"{DIR}/answer_cache.sqlite")
+        grade_cache = DiskCache(f"{DIR}/grade_cache.sqlite")
+
+    configs = expand_config_grid(config_grid)
+    print (f"Running a sweep over {len(configs)} configs and {len(eval_set)} eval items...")
+    sweep = run_sweep(eval_set, configs, args.max_answer_workers, args.max_grade_workers, answer_cache, grade_cache)
+    print_report(sweep)
+
+    with open(os.path.join(DIR, "sweep_results.json"), "w") as f:
+        json.dump(sweep, f, indent=4)
@@ -1,17 +1,8 @@
-// Replace these with your own API key ID and secret, and Knowledge Base ID
-const apiKeyId = 'YOUR_API_KEY_ID';
-const apiKeySecret = 'YOUR_API_KEY_SECRET';
-const kbId = 'YOUR_KNOWLEDGE_BASE_ID';
-
-const baseUrl = 'https://api.superpowered.ai/v1/';
-
-function init() {
-    const token = btoa(`${apiKeyId}:${apiKeySecret}`);
-    return `Bearer ${token}`;
-}
+// The extension posts every page to the local gateway (see gateway/gateway.py), which has your API key and
+// Knowledge Base ID, drops reloads and repeat visits of unchanged pages and uploads the rest in batches
+const gatewayUrl = 'http://localhost:8765/pages';
 
 const headers = {
-    'Authorization': init(),
     'Content-Type': 'application/json'
 };
 
@@ -20,19 +11,18 @@ function extractTextFromPage(data) {
 
     const payload = {
         title: title,
-        link_to_source: url,
+        url: url,
         content: content,
-        auto_context: true,
     };
 
-    fetch(`${baseUrl}knowledge_bases/${kbId}/documents/raw_text`, {
+    fetch(gatewayUrl, {
         method: 'POST',
         headers: headers,
         body: JSON.stringify(payload)
     })
         .then(response => response.json())
-        .then(data => console.log('Document uploaded:', data))
-        .catch(error => console.error('Error uploading document:', error));
+        .then(data => console.log(`Page ${data.status}:`, url))
+        .catch(error => console.error('Error sending page to the gateway:', error));
 }
 
 chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
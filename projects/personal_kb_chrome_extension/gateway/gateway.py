@@ -0,0 +1,241 @@
+"""
+Local gateway between the Chrome extension and the Superpowered API. The extension posts every page it sees to the
+gateway, which drops reloads and repeat visits of pages that haven't changed, cleans up the text and keeps the pages in
+a persistent queue (see page_queue.py) that gets uploaded in rate-limited batches.
+
+    SP_API_KEY_ID=... SP_API_KEY_SECRET=... SP_KB_ID=... python gateway.py
+
+    POST /pages   {"title": ..., "url": ..., "content": ...}   queue a page, returns what happened to it
+    GET  /stats                                                 counters for pages received vs. uploaded
+
+When a page is uploaded again because its content changed, the document of the previous version is deleted from the
+KB.
+"""
+import json
+import os
+import random
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from page_queue import PageQueue
+
+
+SP_BASE_URL = os.environ.get('SP_BASE_URL', 'https://api.superpowered.ai/v1')
+SP_API_KEY_ID = os.environ.get('SP_API_KEY_ID', '')
+SP_API_KEY_SECRET = os.environ.get('SP_API_KEY_SECRET', '')
+SP_KB_ID = os.environ.get('SP_KB_ID', '')
+
+# only listens on localhost by default, since anything that can reach the gateway can add documents to the KB
+GATEWAY_HOST = os.environ.get('GATEWAY_HOST', '127.0.0.1')
+GATEWAY_PORT = int(os.environ.get('GATEWAY_PORT', '8765'))
+GATEWAY_DB_PATH = os.environ.get('GATEWAY_DB_PATH', 'gateway.db')
+# a page is uploaded once it hasn't been visited again for this long
+DEBOUNCE_SECONDS = float(os.environ.get('DEBOUNCE_SECONDS', '30'))
+# pages with less text than this after cleanup (empty app shells, login walls) aren't uploaded
+MIN_CHARS = int(os.environ.get('MIN_CHARS', '200'))
+# every UPLOAD_INTERVAL_SECONDS, up to UPLOAD_BATCH_SIZE ready pages are uploaded at REQUESTS_PER_SECOND at most
+UPLOAD_INTERVAL_SECONDS = float(os.environ.get('UPLOAD_INTERVAL_SECONDS', '60'))
+UPLOAD_BATCH_SIZE = int(os.environ.get('UPLOAD_BATCH_SIZE', '20'))
+REQUESTS_PER_SECOND = float(os.environ.get('REQUESTS_PER_SECOND', '1'))
+MAX_UPLOAD_ATTEMPTS = int(os.environ.get('MAX_UPLOAD_ATTEMPTS', '5'))
+MAX_PAGE_BYTES = int(os.environ.get('MAX_PAGE_BYTES', str(5 * 1024 * 1024)))
+
+
+class RetryableUploadError(Exception):
+    pass
+
+
+def is_retryable_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def upload_page(session: requests.Session, page: dict) -> str:
+    # same request the extension used to make for every page. returns the id of the new document
+    url = f'{SP_BASE_URL}/knowledge_bases/{SP_KB_ID}/documents/raw_text'
+    payload = {
+        'title': page['title'],
+        'link_to_source': page['source_url'],
+        'content': page['content'],
+        'auto_context': True,
+    }
+    try:
+        resp = session.post(url, json=payload, auth=(SP_API_KEY_ID, SP_API_KEY_SECRET), timeout=60)
+    except requests.RequestException as e:
+        raise RetryableUploadError(str(e))
+    if is_retryable_status(resp.status_code):
+        raise RetryableUploadError(f'{resp.status_code}: {resp.text[:200]}')
+    if not resp.ok:
+        raise Exception(f'{resp.status_code}: {resp.text[:200]}')
+    return resp.json().get('id')
+
+
+def delete_document(session: requests.Session, document_id: str):
+    # removes the document of an older version of a page. one that's already gone counts as deleted
+    url = f'{SP_BASE_URL}/knowledge_bases/{SP_KB_ID}/documents/{document_id}'
+    try:
+        resp = session.delete(url, auth=(SP_API_KEY_ID, SP_API_KEY_SECRET), timeout=60)
+    except requests.RequestException as e:
+        raise RetryableUploadError(str(e))
+    if is_retryable_status(resp.status_code):
+        raise RetryableUploadError(f'{resp.status_code}: {resp.text[:200]}')
+    if not resp.ok and resp.status_code != 404:
+        raise Exception(f'{resp.status_code}: {resp.text[:200]}')
+
+
+class Uploader:
+    """
+    Uploads the pages that are ready from the queue, in batches of up to `batch_size` every `interval_seconds`, with
+    at least 1 / `requests_per_second` seconds between API calls. Failed uploads are retried with exponential backoff
+    (as long as the error is a rate limit, server error or connection problem) up to `max_attempts` times. After the
+    uploads, the documents of pages that were replaced by a newer version are deleted, at the same rate; the ones that
+    fail with a retryable error are tried again in the next batch.
+    """
+    def __init__(self, queue: PageQueue, session: requests.Session = None, batch_size: int = UPLOAD_BATCH_SIZE,
+                 interval_seconds: float = UPLOAD_INTERVAL_SECONDS, requests_per_second: float = REQUESTS_PER_SECOND,
+                 max_attempts: int = MAX_UPLOAD_ATTEMPTS, base_delay: float = 5.0, max_delay: float = 600.0, upload=upload_page,
+                 delete=delete_document):
+        self.queue = queue
+        self.session = session if session is not None else requests.Session()
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.min_spacing = 1 / requests_per_second
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.upload = upload
+        self.delete = delete
+        self.stopped = threading.Event()
+        self.last_request_at = 0.0
+
+    def wait_for_slot(self) -> bool:
+        # waits until the next API call is allowed. returns False if the uploader was stopped in the meantime
+        wait_time = self.last_request_at + self.min_spacing - time.monotonic()
+        if wait_time > 0 and self.stopped.wait(wait_time):
+            return False
+        self.last_request_at = time.monotonic()
+        return True
+
+    def run_batch(self) -> int:
+        # returns the number of pages that were uploaded
+        num_uploaded = 0
+        for page in self.queue.ready(self.batch_size):
+            if not self.wait_for_slot():
+                break
+            try:
+                document_id = self.upload(self.session, page)
+            except RetryableUploadError as e:
+                if page['attempts'] + 1 >= self.max_attempts:
+                    self.queue.mark_failed(page, str(e))
+                    print(f'Giving up on {page["source_url"]} after {self.max_attempts} attempts: {e}')
+                else:
+                    # "full jitter" exponential backoff, so pages that failed together don't retry together
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** page['attempts']))
+                    self.queue.retry_later(page, delay)
+                    print(f'Retrying {page["source_url"]} in {delay:.0f}s: {e}')
+                continue
+            except Exception as e:
+                self.queue.mark_failed(page, str(e))
+                print(f'Error uploading {page["source_url"]}: {e}')
+                continue
+            self.queue.mark_uploaded(page, document_id)
+            num_uploaded += 1
+            print(f'Uploaded {page["source_url"]} ({len(page["content"])} characters)')
+        self.delete_stale_documents()
+        return num_uploaded
+
+    def delete_stale_documents(self):
+        for document_id in self.queue.stale_documents(self.batch_size):
+            if not self.wait_for_slot():
+                break
+            try:
+                self.delete(self.session, document_id)
+            except RetryableUploadError as e:
+                print(f'Retrying the deletion of document {document_id} in the next batch: {e}')
+                continue
+            except Exception as e:
+                self.queue.mark_deleted(document_id, str(e))
+                print(f'Error deleting document {document_id}: {e}')
+                continue
+            self.queue.mark_deleted(document_id)
+            print(f'Deleted document {document_id}, which was replaced by a newer version of its page')
+
+    def run_forever(self):
+        while not self.stopped.is_set():
+            try:
+                self.run_batch()
+            except Exception as e:
+                # i.e. the database is locked by something else. the pages are still queued for the next batch
+                print(f'Error running upload batch: {e}')
+            self.stopped.wait(self.interval_seconds)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def make_handler(queue: PageQueue):
+    class GatewayHandler(BaseHTTPRequestHandler):
+        def send_json(self, status_code: int, body: dict):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status_code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self.send_json(200, queue.stats())
+            else:
+                self.send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/pages':
+                return self.send_json(404, {'error': 'not found'})
+            # requiring JSON means web pages can't post to the gateway without a CORS preflight, which it never allows
+            if self.headers.get('Content-Type', '').split(';')[0].strip() != 'application/json':
+                return self.send_json(415, {'error': 'Content-Type must be application/json'})
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > MAX_PAGE_BYTES:
+                return self.send_json(413, {'error': f'page is larger than {MAX_PAGE_BYTES} bytes'})
+            try:
+                page = json.loads(self.rfile.read(length))
+                url, content = page['url'], page['content']
+            except (ValueError, KeyError, TypeError):
+                return self.send_json(400, {'error': 'expected a JSON object with url, title and content'})
+            status = queue.add(page.get('title') or '', url, content)
+            self.send_json(200, {'status': status})
+
+        def log_message(self, format, *args):
+            # one line per page would drown out the upload logs
+            pass
+
+    return GatewayHandler
+
+
+if __name__ == '__main__':
+    if not (SP_API_KEY_ID and SP_API_KEY_SECRET and SP_KB_ID):
+        raise SystemExit('Set SP_API_KEY_ID, SP_API_KEY_SECRET and SP_KB_ID')
+
+    queue = PageQueue(GATEWAY_DB_PATH, debounce_seconds=DEBOUNCE_SECONDS, min_chars=MIN_CHARS)
+    uploader = Uploader(queue)
+    upload_thread = threading.Thread(target=uploader.run_forever, daemon=True)
+    upload_thread.start()
+
+    server = ThreadingHTTPServer((GATEWAY_HOST, GATEWAY_PORT), make_handler(queue))
+    # docker/systemd stop with SIGTERM. pages that are still queued are uploaded after the next start
+    signal.signal(signal.SIGTERM, lambda *args: threading.Thread(target=server.shutdown).start())
+    print(f'Gateway listening on http://{GATEWAY_HOST}:{GATEWAY_PORT} ({queue.stats()["pages_queued"]} pages queued)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        uploader.stop()
+        upload_thread.join()
+        server.server_close()
+        print(json.dumps(queue.stats(), indent=4))
+        queue.close()
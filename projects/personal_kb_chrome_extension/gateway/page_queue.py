@@ -0,0 +1,217 @@
+import sqlite3
+import threading
+import time
+import zlib
+
+from page_text import clean_text, hash_content, normalize_url
+
+
+# what PageQueue.add does with each page it receives
+QUEUED = 'queued'            # new page (or new content for a page), will be uploaded
+DEBOUNCED = 'debounced'      # replaced a page that was still waiting to be uploaded
+UNCHANGED = 'unchanged'      # same URL and content as a page that was already uploaded
+DUPLICATE = 'duplicate'      # same content as another page that was uploaded or queued
+TOO_SHORT = 'too_short'      # not enough text left after cleaning it up to be worth indexing
+
+
+class PageQueue:
+    """
+    SQLite-backed queue of pages waiting to be uploaded, plus a record of what has already been uploaded and the
+    gateway's counters, so nothing is lost or uploaded twice across restarts. Page text is stored zlib-compressed.
+
+    There is at most one queued page per (normalized) URL. A page only becomes ready to upload after `debounce_seconds`
+    without another visit to the same URL, so reloads and quick back-and-forth navigation end up as one upload of the
+    latest version of the page. Safe to use from several threads at once.
+
+    When a page is uploaded again with new content, the document of its previous version is kept in `stale_documents`
+    until the uploader has deleted it from the knowledge base, so the KB only has the latest version of each page.
+    """
+    def __init__(self, path: str, debounce_seconds: float = 30.0, min_chars: int = 200, clock=time.time):
+        self.debounce_seconds = debounce_seconds
+        self.min_chars = min_chars
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                source_url TEXT NOT NULL,
+                title TEXT NOT NULL,
+                content BLOB NOT NULL,
+                content_hash TEXT NOT NULL,
+                received_at REAL NOT NULL,
+                ready_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS pages_content_hash ON pages (content_hash);
+            CREATE INDEX IF NOT EXISTS pages_ready_at ON pages (ready_at);
+            CREATE TABLE IF NOT EXISTS uploaded (
+                url TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                document_id TEXT,
+                uploaded_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS uploaded_content_hash ON uploaded (content_hash);
+            CREATE TABLE IF NOT EXISTS stale_documents (
+                document_id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                replaced_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    def increment(self, **counts):
+        # only called with the lock held. committed together with whatever else changed
+        for name, amount in counts.items():
+            self.conn.execute(
+                'INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value',
+                (name, amount)
+            )
+
+    def add(self, title: str, url: str, content: str) -> str:
+        # returns what happened to the page (QUEUED, DEBOUNCED, UNCHANGED, DUPLICATE or TOO_SHORT)
+        text = clean_text(content)
+        key = normalize_url(url)
+        content_hash = hash_content(text)
+        now = self.clock()
+        with self.lock:
+            self.increment(pages_received=1, bytes_received=len(content.encode('utf-8')))
+            status = self.classify(key, text, content_hash)
+            if status in (QUEUED, DEBOUNCED):
+                # a revisit restarts the debounce timer and the latest version of the page wins
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO pages (url, source_url, title, content, content_hash, received_at, ready_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, url, title or key, zlib.compress(text.encode('utf-8')), content_hash, now, now + self.debounce_seconds)
+                )
+            elif status == UNCHANGED:
+                # the page went back to the version that was uploaded, so a queued change doesn't need to go out anymore
+                self.conn.execute('DELETE FROM pages WHERE url = ?', (key,))
+            self.increment(**{f'pages_{status}': 1})
+            self.conn.commit()
+        return status
+
+    def classify(self, key: str, text: str, content_hash: str) -> str:
+        if len(text) < self.min_chars:
+            return TOO_SHORT
+        uploaded = self.conn.execute('SELECT content_hash FROM uploaded WHERE url = ?', (key,)).fetchone()
+        if uploaded is not None and uploaded[0] == content_hash:
+            return UNCHANGED
+        if self.conn.execute('SELECT 1 FROM pages WHERE url = ?', (key,)).fetchone():
+            return DEBOUNCED
+        if (self.conn.execute('SELECT 1 FROM uploaded WHERE content_hash = ? LIMIT 1', (content_hash,)).fetchone()
+                or self.conn.execute('SELECT 1 FROM pages WHERE content_hash = ? LIMIT 1', (content_hash,)).fetchone()):
+            return DUPLICATE
+        return QUEUED
+
+    def ready(self, limit: int) -> list:
+        # pages whose debounce (or retry backoff) is over, oldest first
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT url, source_url, title, content, content_hash, attempts FROM pages WHERE ready_at <= ? AND error IS NULL ORDER BY received_at LIMIT ?',
+                (self.clock(), limit)
+            ).fetchall()
+        return [{
+            'url': row[0],
+            'source_url': row[1],
+            'title': row[2],
+            'content': zlib.decompress(row[3]).decode('utf-8'),
+            'content_hash': row[4],
+            'attempts': row[5],
+        } for row in rows]
+
+    def mark_uploaded(self, page: dict, document_id: str):
+        with self.lock:
+            # if the page was revisited with new content during the upload, the new version stays queued
+            self.conn.execute('DELETE FROM pages WHERE url = ? AND content_hash = ?', (page['url'], page['content_hash']))
+            previous = self.conn.execute('SELECT document_id FROM uploaded WHERE url = ?', (page['url'],)).fetchone()
+            if previous is not None and previous[0] and previous[0] != document_id:
+                self.conn.execute(
+                    'INSERT OR IGNORE INTO stale_documents (document_id, url, replaced_at) VALUES (?, ?, ?)',
+                    (previous[0], page['url'], self.clock())
+                )
+            self.conn.execute(
+                'INSERT OR REPLACE INTO uploaded (url, content_hash, document_id, uploaded_at) VALUES (?, ?, ?, ?)',
+                (page['url'], page['content_hash'], document_id, self.clock())
+            )
+            self.increment(pages_uploaded=1, bytes_uploaded=len(page['content'].encode('utf-8')))
+            self.conn.commit()
+
+    def stale_documents(self, limit: int) -> list:
+        # ids of documents that were replaced by a newer version of their page, oldest first
+        with self.lock:
+            rows = self.conn.execute('SELECT document_id FROM stale_documents ORDER BY replaced_at LIMIT ?', (limit,)).fetchall()
+        return [row[0] for row in rows]
+
+    def mark_deleted(self, document_id: str, error: str = None):
+        # with `error`, the document couldn't be deleted and won't be tried again
+        with self.lock:
+            self.conn.execute('DELETE FROM stale_documents WHERE document_id = ?', (document_id,))
+            if error is None:
+                self.increment(documents_deleted=1)
+            else:
+                self.increment(document_delete_failures=1)
+            self.conn.commit()
+
+    def retry_later(self, page: dict, delay_seconds: float):
+        with self.lock:
+            self.conn.execute(
+                'UPDATE pages SET attempts = attempts + 1, ready_at = ? WHERE url = ? AND content_hash = ?',
+                (self.clock() + delay_seconds, page['url'], page['content_hash'])
+            )
+            self.increment(upload_retries=1)
+            self.conn.commit()
+
+    def mark_failed(self, page: dict, error: str):
+        # failed pages stay in the queue (but aren't retried) so they can be looked at, or requeued with `requeue_failed`
+        with self.lock:
+            self.conn.execute(
+                'UPDATE pages SET attempts = attempts + 1, error = ? WHERE url = ? AND content_hash = ?',
+                (error, page['url'], page['content_hash'])
+            )
+            self.increment(upload_failures=1)
+            self.conn.commit()
+
+    def requeue_failed(self) -> int:
+        with self.lock:
+            num_requeued = self.conn.execute('UPDATE pages SET error = NULL, attempts = 0, ready_at = ? WHERE error IS NOT NULL', (self.clock(),)).rowcount
+            self.conn.commit()
+        return num_requeued
+
+    def stats(self) -> dict:
+        with self.lock:
+            counters = dict(self.conn.execute('SELECT name, value FROM counters').fetchall())
+            queued = self.conn.execute('SELECT COUNT(*) FROM pages WHERE error IS NULL').fetchone()[0]
+            failed = self.conn.execute('SELECT COUNT(*) FROM pages WHERE error IS NOT NULL').fetchone()[0]
+            stale = self.conn.execute('SELECT COUNT(*) FROM stale_documents').fetchone()[0]
+        received = counters.get('pages_received', 0)
+        uploaded = counters.get('pages_uploaded', 0)
+        bytes_received = counters.get('bytes_received', 0)
+        bytes_uploaded = counters.get('bytes_uploaded', 0)
+        return {
+            'pages_received': received,
+            'pages_uploaded': uploaded,
+            'pages_queued': queued,
+            'pages_failed': failed,
+            'pages_debounced': counters.get(f'pages_{DEBOUNCED}', 0),
+            'pages_unchanged': counters.get(f'pages_{UNCHANGED}', 0),
+            'pages_duplicate': counters.get(f'pages_{DUPLICATE}', 0),
+            'pages_too_short': counters.get(f'pages_{TOO_SHORT}', 0),
+            'upload_retries': counters.get('upload_retries', 0),
+            'upload_failures': counters.get('upload_failures', 0),
+            'documents_deleted': counters.get('documents_deleted', 0),
+            'documents_to_delete': stale,
+            'document_delete_failures': counters.get('document_delete_failures', 0),
+            'bytes_received': bytes_received,
+            'bytes_uploaded': bytes_uploaded,
+            # every upload is one API call and one AutoContext run, so this is also the share of those that were saved
+            'upload_reduction_pct': round(100 * (1 - (uploaded + queued + failed) / received), 1) if received else 0.0,
+            'byte_reduction_pct': round(100 * (1 - bytes_uploaded / bytes_received), 1) if bytes_received else 0.0,
+        }
+
+    def close(self):
+        self.conn.close()
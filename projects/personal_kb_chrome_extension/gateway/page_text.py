@@ -0,0 +1,45 @@
+import hashlib
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+# query parameters that only track where a visit came from, so they don't make it a different page
+TRACKING_PARAMS_RE = re.compile(r'^(utm_\w+|fbclid|gclid|dclid|msclkid|mc_cid|mc_eid|igshid|ref_src|_hsenc|_hsmi)$', re.IGNORECASE)
+# non-breaking spaces and the like show up all over innerText
+SPACES_RE = re.compile(r'[ \t\u00a0\u2000-\u200a\u202f\u205f\u3000]+')
+INVISIBLE_CHARS_RE = re.compile(r'[\u200b-\u200d\u2060\ufeff\u00ad]')
+BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+
+def normalize_url(url: str) -> str:
+    # the same page with a different #fragment, tracking parameters or parameter order is the same document. fragments
+    # that are routes in single page apps (#/inbox, #!/settings) are kept
+    parts = urlsplit(url.strip())
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if not TRACKING_PARAMS_RE.match(key))
+    path = parts.path.rstrip('/') or '/'
+    fragment = parts.fragment if parts.fragment.startswith(('/', '!')) else ''
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, urlencode(query), fragment))
+
+
+def clean_text(text: str, min_dedupe_chars: int = 30) -> str:
+    """
+    Strips a page's innerText down to what's worth indexing: invisible characters are removed, runs of whitespace are
+    collapsed, and lines of at least `min_dedupe_chars` characters that repeat on the page (cookie banners and
+    navigation that show up twice) are only kept the first time. Shorter lines are always kept, since short lines like
+    table rows, code or list items legitimately repeat.
+    """
+    text = INVISIBLE_CHARS_RE.sub('', text.replace('\r\n', '\n').replace('\r', '\n'))
+    seen_lines = set()
+    lines = []
+    for line in text.split('\n'):
+        line = SPACES_RE.sub(' ', line).strip()
+        if len(line) >= min_dedupe_chars:
+            if line in seen_lines:
+                continue
+            seen_lines.add(line)
+        lines.append(line)
+    return BLANK_LINES_RE.sub('\n\n', '\n'.join(lines)).strip()
+
+
+def hash_content(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
@@ -0,0 +1,128 @@
+"""
+Check message coalescing offline, including what happens when answering fails. Every user sends a question as several
+texts in quick succession, each text is handled on its own worker thread (like separate queue messages), and the chat
+response fails with probability --failure-rate. A failed message is redelivered after --retry-delay seconds, like SQS
+would. SSM, the Superpowered API and Twilio are replaced with in-process stubs (see ingress.py).
+
+Reports how many answers were sent per question and exits with an error if any text was never answered, i.e. if the
+texts merged into a message whose answer failed were lost instead of being answered by the retry.
+
+    python benchmark/coalescing.py --users 20 --texts 3 --failure-rate 0.3
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+RESPONSE_HANDLER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'response_handler')
+sys.path.insert(0, RESPONSE_HANDLER_DIR)
+
+from ingress import load_handler
+
+
+class ChatFailed(Exception):
+    pass
+
+
+def make_texts(num_users: int, texts_per_user: int) -> list:
+    return [
+        {
+            'MessageSid': f'SM{user:016d}{text:016d}',
+            'From': f'+1555555{user:04d}',
+            'To': '+15555550199',
+            'Body': f'user {user} text {text}',
+        }
+        # in the order they arrive: every user's first text, then every user's second text, etc.
+        for text in range(texts_per_user)
+        for user in range(num_users)
+    ]
+
+
+def deliver(response_handler, webhook: dict, received_at: float, retry_delay: float, max_attempts: int) -> int:
+    # handles the message until it succeeds, like a queue redelivering it. returns the number of attempts
+    for attempt in range(1, max_attempts + 1):
+        try:
+            response_handler.handle_message(webhook, None, received_at)
+            return attempt
+        except ChatFailed:
+            time.sleep(retry_delay)
+    return max_attempts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--texts', type=int, default=3, help='number of texts each user sends their question as')
+    parser.add_argument('--text-spacing', type=float, default=0.1, help='seconds between the texts of one user')
+    parser.add_argument('--window', type=float, default=0.5, help='COALESCE_WINDOW_SECONDS')
+    parser.add_argument('--failure-rate', type=float, default=0.3, help='probability that a chat response fails')
+    parser.add_argument('--retry-delay', type=float, default=0.2, help='seconds before a failed message is redelivered')
+    parser.add_argument('--max-attempts', type=int, default=10)
+    parser.add_argument('--chat-latency', type=float, default=0.1, help='simulated Superpowered chat response time in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    rng_lock = threading.Lock()
+
+    response_handler = load_handler(args.chat_latency, [])
+    from coalesce import MessageCoalescer
+    response_handler.COALESCER = MessageCoalescer(response_handler.IDEMPOTENCY_STORE, window_seconds=args.window, poll_interval=0.02)
+
+    def get_chat_response(thread_id: str, user_input: str, deadline_seconds: float = None) -> dict:
+        time.sleep(args.chat_latency)
+        with rng_lock:
+            failed = rng.random() < args.failure_rate
+        if failed:
+            raise ChatFailed('simulated chat failure')
+        return {'interaction': {'model_response': {'content': user_input}}}
+
+    answered = []
+    answered_lock = threading.Lock()
+
+    def send_twilio_response(to: str, from_: str, body: str):
+        with answered_lock:
+            answered.append(body.split('\n'))
+
+    response_handler.get_chat_response = get_chat_response
+    response_handler.send_twilio_response = send_twilio_response
+
+    texts = make_texts(args.users, args.texts)
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=len(texts)) as executor:
+        futures = []
+        for i, webhook in enumerate(texts):
+            # the texts of all users are interleaved, each user's texts --text-spacing apart
+            received_at = start_time + (i // args.users) * args.text_spacing
+            time.sleep(max(0.0, received_at - time.time()))
+            futures.append(executor.submit(deliver, response_handler, webhook, received_at, args.retry_delay, args.max_attempts))
+        attempts = [future.result() for future in futures]
+    elapsed = time.time() - start_time
+
+    answer_counts = {}
+    for bodies in answered:
+        for body in bodies:
+            answer_counts[body] = answer_counts.get(body, 0) + 1
+    lost = [webhook['Body'] for webhook in texts if webhook['Body'] not in answer_counts]
+    results = {
+        'users': args.users,
+        'texts': len(texts),
+        'failure_rate': args.failure_rate,
+        'answers_sent': len(answered),
+        'answers_per_question': round(len(answered) / args.users, 2),
+        'redeliveries': sum(attempts) - len(texts),
+        'texts_answered_more_than_once': sum(count > 1 for count in answer_counts.values()),
+        'texts_lost': len(lost),
+        'seconds': round(elapsed, 2),
+    }
+    print (json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    if lost:
+        raise SystemExit(f'{len(lost)} texts were never answered, i.e. {lost[:5]}')
@@ -0,0 +1,202 @@
+"""
+Measure the cold start of the SMS response handler against a local stand-in for SSM, so init duration can be tracked
+from release to release without deploying anything.
+
+Every run starts a fresh Python process (like a new Lambda container) that imports the handler and handles one webhook
+with an invalid signature, which covers everything a first invocation does before it talks to Superpowered: importing
+the handler, fetching the credentials and validating the webhook. The old eager startup path (four GetParameter calls
+and a Twilio client built at import time) is measured the same way for comparison.
+
+    python benchmark/cold_start.py --runs 10 --ssm-latency 0.03 --output cold_start.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+RESPONSE_HANDLER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'response_handler')
+
+PARAMETERS = {
+    'twilio-account-sid': 'AC00000000000000000000000000000000',
+    'twilio-auth-token': 'local-twilio-auth-token',
+    'sp-api-key-id': 'local-sp-api-key-id',
+    'sp-api-key-secret': 'local-sp-api-key-secret',
+}
+
+# runs in the child process: a first invocation of the current handler
+CURRENT_HANDLER_RUN = """
+import json, sys, time
+start_time = time.perf_counter()
+import response_handler
+import_seconds = time.perf_counter() - start_time
+
+event = {
+    'body': 'RnJvbT0lMkIxNTU1NTU1MDEwMCZUbz0lMkIxNTU1NTU1MDE5OSZCb2R5PWhp',
+    'headers': {'host': 'localhost', 'x-twilio-signature': 'invalid'},
+    'rawPath': '/',
+}
+try:
+    response_handler.lambda_handler(event, None)
+except Exception:
+    pass
+first_invocation_seconds = time.perf_counter() - start_time - import_seconds
+
+warm_start_time = time.perf_counter()
+try:
+    response_handler.lambda_handler(event, None)
+except Exception:
+    pass
+warm_invocation_seconds = time.perf_counter() - warm_start_time
+
+print(json.dumps({
+    'import_seconds': import_seconds,
+    'first_invocation_seconds': first_invocation_seconds,
+    'warm_invocation_seconds': warm_invocation_seconds,
+    'twilio_client_imported': 'twilio.rest' in sys.modules,
+}))
+"""
+
+# runs in the child process: the startup path the handler used before credentials were batched and cached
+EAGER_STARTUP_RUN = """
+import json, os, sys, time
+start_time = time.perf_counter()
+import boto3
+import requests
+from twilio.rest import Client
+from twilio.request_validator import RequestValidator
+ssm = boto3.client('ssm')
+values = [
+    ssm.get_parameter(Name=os.environ[name], WithDecryption=True)['Parameter']['Value']
+    for name in ['TWILIO_ACCOUNT_SID_PARAM_NAME', 'TWILIO_AUTH_TOKEN_PARAM_NAME', 'SP_API_KEY_ID_PARAM_NAME', 'SP_API_KEY_SECRET_PARAM_NAME']
+]
+client = Client(values[0], values[1])
+import_seconds = time.perf_counter() - start_time
+
+invocation_start_time = time.perf_counter()
+RequestValidator(values[1]).validate(uri='https://localhost/', params={}, signature='invalid')
+first_invocation_seconds = time.perf_counter() - invocation_start_time
+
+print(json.dumps({
+    'import_seconds': import_seconds,
+    'first_invocation_seconds': first_invocation_seconds,
+    'warm_invocation_seconds': first_invocation_seconds,
+    'twilio_client_imported': 'twilio.rest' in sys.modules,
+}))
+"""
+
+
+def make_fake_ssm_handler(latency: float, calls: dict, lock: threading.Lock):
+    class FakeSsm(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            operation = self.headers.get('X-Amz-Target', '').split('.')[-1]
+            with lock:
+                calls[operation] = calls.get(operation, 0) + 1
+            time.sleep(latency)
+
+            if operation == 'GetParameters':
+                names = body['Names']
+                payload = {
+                    'Parameters': [{'Name': name, 'Type': 'SecureString', 'Value': PARAMETERS[name]} for name in names if name in PARAMETERS],
+                    'InvalidParameters': [name for name in names if name not in PARAMETERS],
+                }
+                status = 200
+            elif operation == 'GetParameter' and body['Name'] in PARAMETERS:
+                payload = {'Parameter': {'Name': body['Name'], 'Type': 'SecureString', 'Value': PARAMETERS[body['Name']]}}
+                status = 200
+            else:
+                payload = {'__type': 'ParameterNotFound', 'message': 'not found'}
+                status = 400
+
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/x-amz-json-1.1')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeSsm
+
+
+def child_env(ssm_url: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        'AWS_ENDPOINT_URL_SSM': ssm_url,
+        'AWS_ACCESS_KEY_ID': 'local',
+        'AWS_SECRET_ACCESS_KEY': 'local',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'TWILIO_ACCOUNT_SID_PARAM_NAME': 'twilio-account-sid',
+        'TWILIO_AUTH_TOKEN_PARAM_NAME': 'twilio-auth-token',
+        'SP_API_KEY_ID_PARAM_NAME': 'sp-api-key-id',
+        'SP_API_KEY_SECRET_PARAM_NAME': 'sp-api-key-secret',
+        'PYTHONPATH': RESPONSE_HANDLER_DIR,
+        'PYTHONDONTWRITEBYTECODE': '1',
+    })
+    return env
+
+
+def run_cold_starts(code: str, runs: int, env: dict, calls: dict, lock: threading.Lock) -> dict:
+    with lock:
+        calls.clear()
+    results = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code], env=env, cwd=RESPONSE_HANDLER_DIR, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result['process_seconds'] = time.perf_counter() - start_time
+        results.append(result)
+
+    def median_ms(key: str) -> float:
+        return round(1000 * statistics.median(result[key] for result in results), 1)
+
+    with lock:
+        ssm_calls = dict(calls)
+    return {
+        'runs': runs,
+        'import_ms': median_ms('import_seconds'),
+        'first_invocation_ms': median_ms('first_invocation_seconds'),
+        'init_ms': round(median_ms('import_seconds') + median_ms('first_invocation_seconds'), 1),
+        'warm_invocation_ms': median_ms('warm_invocation_seconds'),
+        'process_ms': median_ms('process_seconds'),
+        'ssm_calls_per_cold_start': {operation: count / runs for operation, count in ssm_calls.items()},
+        'twilio_client_imported': any(result['twilio_client_imported'] for result in results),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5, help='number of cold starts to measure for each startup path')
+    parser.add_argument('--ssm-latency', type=float, default=0.03, help='simulated SSM round trip in seconds')
+    parser.add_argument('--output', help='write the results to this JSON file (i.e. to track init duration per release)')
+    args = parser.parse_args()
+
+    calls, lock = {}, threading.Lock()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_fake_ssm_handler(args.ssm_latency, calls, lock))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = child_env(f'http://127.0.0.1:{server.server_address[1]}')
+
+    results = {
+        'ssm_latency_seconds': args.ssm_latency,
+        'current': run_cold_starts(CURRENT_HANDLER_RUN, args.runs, env, calls, lock),
+        'eager_startup': run_cold_starts(EAGER_STARTUP_RUN, args.runs, env, calls, lock),
+    }
+    server.shutdown()
+
+    print (f"{'':<16}{'import ms':>10}{'1st call ms':>12}{'init ms':>9}{'warm ms':>9}  ssm calls")
+    for name in ['current', 'eager_startup']:
+        r = results[name]
+        print (f"{name:<16}{r['import_ms']:>10}{r['first_invocation_ms']:>12}{r['init_ms']:>9}{r['warm_invocation_ms']:>9}  {r['ssm_calls_per_cold_start']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
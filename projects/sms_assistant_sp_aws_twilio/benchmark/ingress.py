@@ -0,0 +1,165 @@
+"""
+Measure webhook ingress latency and worker throughput of the SMS handler offline. SSM, the Superpowered API and Twilio
+are replaced with in-process stubs (the chat response takes --chat-latency seconds), and the work queue is an
+in-memory or SQLite queue instead of SQS.
+
+    python benchmark/ingress.py --messages 200 --workers 8 --chat-latency 2.0 --queue sqlite
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+
+RESPONSE_HANDLER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'response_handler')
+sys.path.insert(0, RESPONSE_HANDLER_DIR)
+
+from job_queue import InMemoryQueue, SqliteQueue
+
+
+PARAMETERS = {
+    'twilio-account-sid': 'AC00000000000000000000000000000000',
+    'twilio-auth-token': 'local-twilio-auth-token',
+    'sp-api-key-id': 'local-sp-api-key-id',
+    'sp-api-key-secret': 'local-sp-api-key-secret',
+}
+WEBHOOK_HOST = 'localhost'
+WEBHOOK_PATH = '/'
+
+
+class FakeSsmClient:
+    def get_parameters(self, Names, WithDecryption=True):
+        return {'Parameters': [{'Name': name, 'Value': PARAMETERS[name]} for name in Names], 'InvalidParameters': []}
+
+
+def make_signed_event(params: dict) -> dict:
+    from twilio.request_validator import RequestValidator
+    signature = RequestValidator(PARAMETERS['twilio-auth-token']).compute_signature(f'https://{WEBHOOK_HOST}{WEBHOOK_PATH}', params)
+    return {
+        'body': base64.b64encode(urlencode(params).encode('utf-8')).decode('utf-8'),
+        'headers': {'host': WEBHOOK_HOST, 'x-twilio-signature': signature},
+        'rawPath': WEBHOOK_PATH,
+    }
+
+
+def make_events(num_messages: int, num_users: int, first_id: int = 0) -> list:
+    # MessageSids are numbered from `first_id`, so separate sets of events aren't deduplicated against each other
+    return [
+        make_signed_event({
+            'MessageSid': f'SM{i:032d}',
+            'From': f'+1555555{i % num_users:04d}',
+            'To': '+15555550199',
+            'Body': f'What is the answer to question {i}?',
+        })
+        for i in range(first_id, first_id + num_messages)
+    ]
+
+
+def load_handler(chat_latency: float, sent_messages: list):
+    for name, value in [('TWILIO_ACCOUNT_SID_PARAM_NAME', 'twilio-account-sid'), ('TWILIO_AUTH_TOKEN_PARAM_NAME', 'twilio-auth-token'),
+                        ('SP_API_KEY_ID_PARAM_NAME', 'sp-api-key-id'), ('SP_API_KEY_SECRET_PARAM_NAME', 'sp-api-key-secret')]:
+        os.environ[name] = value
+    import response_handler
+
+    # stand-ins for everything outside the handler
+    response_handler.SSM_PARAMETERS.client_factory = FakeSsmClient
+    response_handler.get_chat_thread_by_phone_number = lambda phone_number: f'thread-{phone_number}'
+
+    def get_chat_response(thread_id: str, user_input: str, deadline_seconds: float = None) -> dict:
+        time.sleep(chat_latency)
+        return {'interaction': {'model_response': {'content': f'Answer to: {user_input}'}}}
+
+    def send_twilio_response(to: str, from_: str, body: str):
+        sent_messages.append(time.time())
+
+    response_handler.get_chat_response = get_chat_response
+    response_handler.send_twilio_response = send_twilio_response
+    # the per-message stats the handler logs would drown out the results
+    response_handler.print = lambda *args, **kwargs: None
+    response_handler.TRACER.emit = lambda line: None
+    return response_handler
+
+
+def summarize_ms(seconds: list) -> dict:
+    seconds = sorted(seconds)
+    return {
+        'count': len(seconds),
+        'p50_ms': round(1000 * statistics.median(seconds), 2),
+        'p95_ms': round(1000 * seconds[int(0.95 * (len(seconds) - 1))], 2),
+        'max_ms': round(1000 * seconds[-1], 2),
+    }
+
+
+def time_ingress(response_handler, events: list) -> list:
+    latencies = []
+    for event in events:
+        start_time = time.perf_counter()
+        resp = response_handler.lambda_handler(event, None)
+        latencies.append(time.perf_counter() - start_time)
+        assert resp['statusCode'] == 200
+    return latencies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--users', type=int, default=20, help='number of distinct phone numbers sending the messages')
+    parser.add_argument('--workers', type=int, default=4, help='number of worker threads answering queued messages')
+    parser.add_argument('--chat-latency', type=float, default=2.0, help='simulated Superpowered chat response time in seconds')
+    parser.add_argument('--queue', choices=['memory', 'sqlite'], default='memory')
+    parser.add_argument('--inline-samples', type=int, default=3, help='messages to time with the worker disabled, for comparison')
+    parser.add_argument('--drain-timeout', type=float, default=300, help='give up if the workers haven\'t answered every message after this many seconds')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    sent_messages = []
+    response_handler = load_handler(args.chat_latency, sent_messages)
+    events = make_events(args.messages, args.users)
+
+    # the old behavior: the webhook only returns once the message has been answered
+    response_handler.WORK_QUEUE = None
+    # with their own MessageSids, since the handler would drop the queued copies of these as duplicates
+    inline_latencies = time_ingress(response_handler, make_events(args.inline_samples, args.users, first_id=args.messages))
+    sent_messages.clear()
+
+    with tempfile.TemporaryDirectory() as directory:
+        queue = InMemoryQueue() if args.queue == 'memory' else SqliteQueue(os.path.join(directory, 'queue.sqlite'))
+        response_handler.WORK_QUEUE = queue
+
+        # ingress first with no workers running, so its latency isn't affected by them
+        ingress_latencies = time_ingress(response_handler, events)
+
+        stop_event = threading.Event()
+        workers = [threading.Thread(target=response_handler.run_worker, args=(queue, stop_event, 0.1)) for _ in range(args.workers)]
+        start_time = time.time()
+        for worker in workers:
+            worker.start()
+        while len(sent_messages) < args.messages and time.time() - start_time < args.drain_timeout:
+            time.sleep(0.01)
+        drain_seconds = time.time() - start_time
+        stop_event.set()
+        for worker in workers:
+            worker.join()
+        if len(sent_messages) < args.messages:
+            raise SystemExit(f'Only {len(sent_messages)} of {args.messages} messages were answered after {args.drain_timeout}s')
+
+    results = {
+        'queue': args.queue,
+        'messages': args.messages,
+        'workers': args.workers,
+        'chat_latency_seconds': args.chat_latency,
+        'inline_webhook_latency': summarize_ms(inline_latencies) if inline_latencies else None,
+        'queued_webhook_latency': summarize_ms(ingress_latencies),
+        'worker_drain_seconds': round(drain_seconds, 2),
+        'worker_messages_per_second': round(args.messages / drain_seconds, 2),
+    }
+    print (json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
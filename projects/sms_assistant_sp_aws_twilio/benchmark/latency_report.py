@@ -0,0 +1,99 @@
+"""
+Aggregate the per-message metrics the handler logs (see response_handler/tracing.py) into p50/p95/p99 latency per
+stage, overall and per command. Reads log files exported from CloudWatch (or captured locally), skipping every line
+that isn't an embedded metric format record, or stdin if no files are given.
+
+    aws logs tail /aws/lambda/SmsWorkerLambda --since 1d > worker.log
+    python benchmark/latency_report.py worker.log --output latency.json
+"""
+import argparse
+import json
+import math
+import sys
+from collections import defaultdict
+
+
+def read_records(lines) -> list:
+    records = []
+    for line in lines:
+        # CloudWatch prefixes each line with a timestamp and request id
+        start = line.find('{')
+        if start == -1:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            continue
+        if isinstance(record, dict) and '_aws' in record:
+            records.append(record)
+    return records
+
+
+def percentile(values: list, pct: float) -> float:
+    # nearest rank, on sorted values
+    index = max(0, math.ceil(pct / 100 * len(values)) - 1)
+    return values[index]
+
+
+def summarize(records: list) -> dict:
+    # stage (metric name without the _ms) -> count and percentiles
+    samples = defaultdict(list)
+    for record in records:
+        for metric in record['_aws']['CloudWatchMetrics'][0]['Metrics']:
+            if metric['Unit'] == 'Milliseconds' and isinstance(record.get(metric['Name']), (int, float)):
+                samples[metric['Name'][:-len('_ms')]].append(record[metric['Name']])
+    summary = {}
+    for stage, values in samples.items():
+        values.sort()
+        summary[stage] = {
+            'count': len(values),
+            'p50_ms': round(percentile(values, 50), 2),
+            'p95_ms': round(percentile(values, 95), 2),
+            'p99_ms': round(percentile(values, 99), 2),
+        }
+    # slowest stages first, with the total at the top
+    return dict(sorted(summary.items(), key=lambda item: (item[0] != 'total', -item[1]['p50_ms'])))
+
+
+def print_table(title: str, summary: dict):
+    print (f'\n{title}')
+    print (f"{'stage':<22}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, s in summary.items():
+        print (f"{stage:<22}{s['count']:>7}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('logs', nargs='*', help='log files to read (stdin if none are given)')
+    parser.add_argument('--function', help='only include records from this function (webhook or worker)')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    records = []
+    if args.logs:
+        for path in args.logs:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                records += read_records(f)
+    else:
+        records = read_records(sys.stdin)
+    if args.function:
+        records = [record for record in records if record.get('function') == args.function]
+    if not records:
+        sys.exit('No metric records found')
+
+    by_command = defaultdict(list)
+    for record in records:
+        by_command[f"{record.get('function', '?')} {record.get('command', 'unknown')}"].append(record)
+
+    results = {
+        'records': len(records),
+        'errors': sum(1 for record in records if record.get('error')),
+        'overall': summarize(records),
+        'by_command': {command: summarize(command_records) for command, command_records in sorted(by_command.items())},
+    }
+    print_table(f"all messages ({results['records']}, {results['errors']} errors)", results['overall'])
+    for command, summary in results['by_command'].items():
+        print_table(f'{command} ({len(by_command[command])})', summary)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,402 @@
+"""
+Load test the SMS handler end to end without any real endpoints. Local HTTP servers stand in for SSM, the
+Superpowered chat thread/job API and the Twilio messages API, so the handler runs its real code paths: the SSM
+client, the pooled Superpowered client, job polling and the Twilio SDK. Correctly signed webhooks are generated for a
+mix of commands and chat messages from many phone numbers, and sent to `lambda_handler` from concurrent threads
+(each thread is like one Lambda invocation, answering the message inline).
+
+Reports throughput, latency percentiles (overall, per command and per stage, from the handler's own metrics) and API
+calls per message. With --baseline, it exits with an error if the latency or API calls per message got worse than
+in an earlier --output file, so regressions in the hot path are caught before deploying.
+
+    python benchmark/load_test.py --messages 500 --users 50 --concurrency 16 --chat-latency 0.5 --output load.json
+    python benchmark/load_test.py --messages 500 --users 50 --concurrency 16 --chat-latency 0.5 --baseline load.json
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+RESPONSE_HANDLER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'response_handler')
+sys.path.insert(0, RESPONSE_HANDLER_DIR)
+
+from cold_start import PARAMETERS, make_fake_ssm_handler
+from ingress import make_signed_event
+from latency_report import percentile, summarize
+
+
+# relative weights of each kind of message
+TRAFFIC_MIX = 'chat=80,settings=6,help=4,timeframe=3,temperature=3,model=2,name=2'
+CHAT_QUESTIONS = [
+    "What's the weather today?",
+    'whats the news',
+    'How do I get a red wine stain out of a carpet?',
+    'Who won the game last night?',
+    'Give me a quick dinner idea',
+    'What time does the sun set in Boston?',
+    'How many ounces are in a cup?',
+    'Tell me more about that',
+    'Can you explain how compound interest works?',
+    'Is it going to rain tomorrow in Seattle?',
+]
+MODEL_ANSWER = (
+    'Here’s a quick summary:\n\n'
+    '- **First**, the most relevant fact, in one short sentence.\n'
+    '- **Second**, a supporting detail with a number or two (about 70–80%).\n'
+    '- **Third**, what to do next — keep it simple.\n\n'
+    'Let me know if you want more detail!'
+)
+
+
+class Calls:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def add(self, name: str):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.counts)
+
+
+class LocalServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 refuses connections under load
+    request_queue_size = 256
+
+
+def start_server(handler_class) -> tuple:
+    server = LocalServer(('127.0.0.1', 0), handler_class)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+class JsonHandler(BaseHTTPRequestHandler):
+    # keep-alive, so the handler's connection pooling works like it does against the real API
+    protocol_version = 'HTTP/1.1'
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def send_json(self, status: int, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def has_basic_auth(self, username: str, password: str) -> bool:
+        expected = base64.b64encode(f'{username}:{password}'.encode('utf-8')).decode('utf-8')
+        return self.headers.get('Authorization') == f'Basic {expected}'
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_fake_superpowered_handler(latency: float, chat_latency: float, failure_rate: float, calls: Calls):
+    # just enough of the chat thread and job endpoints for the handler. every request takes `latency` seconds and
+    # fails with a 503 with probability `failure_rate`. chat jobs complete `chat_latency` seconds after they're created
+    lock = threading.Lock()
+    threads, jobs = {}, {}
+
+    class FakeSuperpowered(JsonHandler):
+        def handle_request(self, method: str):
+            url = urlparse(self.path)
+            path = url.path[len('/v1/'):] if url.path.startswith('/v1/') else url.path
+            # the same endpoint with different ids is counted once
+            calls.add(f"{method} {re.sub(r'/[0-9a-f-]{36}', '/{id}', path)}")
+            body = self.read_body()
+            time.sleep(latency)
+            if not self.has_basic_auth(PARAMETERS['sp-api-key-id'], PARAMETERS['sp-api-key-secret']):
+                return self.send_json(401, {'message': 'Unauthorized'})
+            if random.random() < failure_rate:
+                return self.send_json(503, {'message': 'Service Unavailable'})
+            payload = json.loads(body) if body else {}
+
+            parts = path.strip('/').split('/')
+            with lock:
+                if parts == ['chat', 'threads'] and method == 'POST':
+                    thread = {
+                        'id': str(uuid.uuid4()),
+                        'supp_id': payload.get('supp_id'),
+                        'title': payload.get('title'),
+                        'default_options': dict({'temperature': 0.0, 'web_search_config': None}, **payload.get('default_options', {})),
+                    }
+                    threads[thread['id']] = thread
+                    return self.send_json(200, thread)
+                if parts == ['chat', 'threads'] and method == 'GET':
+                    supp_id = parse_qs(url.query).get('supp_id', [None])[0]
+                    return self.send_json(200, {'chat_threads': [thread for thread in threads.values() if thread['supp_id'] == supp_id]})
+                if parts[:2] == ['chat', 'threads'] and len(parts) >= 3:
+                    thread = threads.get(parts[2])
+                    if thread is None:
+                        return self.send_json(404, {'message': 'Chat thread not found'})
+                    if len(parts) == 4 and parts[3] == 'get_response' and method == 'POST':
+                        job_id = str(uuid.uuid4())
+                        jobs[job_id] = {'ready_at': time.monotonic() + chat_latency, 'input': payload.get('input', '')}
+                        status_url = f'http://127.0.0.1:{self.server.server_address[1]}/v1/jobs/{job_id}'
+                        return self.send_json(200, {'id': job_id, 'status': 'PENDING', 'status_url': status_url})
+                    if method == 'GET':
+                        return self.send_json(200, thread)
+                    if method == 'PATCH':
+                        thread['title'] = payload.get('title', thread['title'])
+                        thread['default_options'].update(payload.get('default_options', {}))
+                        return self.send_json(200, thread)
+                    if method == 'DELETE':
+                        del threads[parts[2]]
+                        return self.send_json(200, {})
+                if parts[0] == 'jobs' and len(parts) == 2 and method == 'GET':
+                    job = jobs.get(parts[1])
+                    if job is None:
+                        return self.send_json(404, {'message': 'Job not found'})
+                    if time.monotonic() < job['ready_at']:
+                        return self.send_json(200, {'id': parts[1], 'status': 'IN_PROGRESS', 'status_url': self.path})
+                    response = {'interaction': {'user_input': job['input'], 'model_response': {'content': MODEL_ANSWER}}}
+                    return self.send_json(200, {'id': parts[1], 'status': 'COMPLETE', 'response': response})
+            return self.send_json(404, {'message': f'No route for {method} {path}'})
+
+        def do_GET(self):
+            self.handle_request('GET')
+
+        def do_POST(self):
+            self.handle_request('POST')
+
+        def do_PATCH(self):
+            self.handle_request('PATCH')
+
+        def do_DELETE(self):
+            self.handle_request('DELETE')
+
+    return FakeSuperpowered
+
+
+def make_fake_twilio_handler(latency: float, calls: Calls):
+    class FakeTwilio(JsonHandler):
+        def do_POST(self):
+            params = {k: v[0] for k, v in parse_qs(self.read_body().decode('utf-8')).items()}
+            time.sleep(latency)
+            if not self.has_basic_auth(PARAMETERS['twilio-account-sid'], PARAMETERS['twilio-auth-token']):
+                return self.send_json(401, {'message': 'Authenticate'})
+            calls.add('messages')
+            self.send_json(201, {
+                'sid': f'SM{uuid.uuid4().hex}',
+                'account_sid': PARAMETERS['twilio-account-sid'],
+                'to': params.get('To'),
+                'from': params.get('From'),
+                'body': params.get('Body'),
+                'status': 'queued',
+                'num_segments': '1',
+                'direction': 'outbound-api',
+                'date_created': time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime()),
+            })
+
+    return FakeTwilio
+
+
+def make_twilio_client(base_url: str):
+    # the real Twilio SDK, with its requests sent to the local server instead of api.twilio.com
+    from twilio.http.http_client import TwilioHttpClient
+    from twilio.rest import Client
+
+    class LocalTwilioHttpClient(TwilioHttpClient):
+        def request(self, method, url, *args, **kwargs):
+            return super().request(method, re.sub(r'^https://[^/]+', base_url, url), *args, **kwargs)
+
+    return Client(PARAMETERS['twilio-account-sid'], PARAMETERS['twilio-auth-token'], http_client=LocalTwilioHttpClient())
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def make_body(command: str, rng: random.Random) -> str:
+    if command == 'chat':
+        return rng.choice(CHAT_QUESTIONS)
+    if command == 'settings':
+        return rng.choice(['/settings', u'\U00002699\U0000FE0F'])
+    if command == 'help':
+        return rng.choice(['/help', u'\U00002753'])
+    if command == 'timeframe':
+        return f'/timeframe {rng.choice([1, 7, 30])}'
+    if command == 'temperature':
+        return f'/temperature {rng.choice([0.0, 0.3, 0.7])}'
+    if command == 'model':
+        return f"/model {rng.choice(['gpt-3.5-turbo', 'claude-3-haiku', 'mixtral'])}"
+    if command == 'name':
+        return f"/name {rng.choice(['Alfred', 'Jeeves', 'Ada'])}"
+    raise ValueError(f'Unknown command in traffic mix: {command}')
+
+
+def make_traffic(num_messages: int, num_users: int, mix: dict, seed: int) -> list:
+    rng = random.Random(seed)
+    commands = rng.choices(list(mix), weights=list(mix.values()), k=num_messages)
+    traffic = []
+    for command in commands:
+        event = make_signed_event({
+            'MessageSid': f'SM{uuid.UUID(int=rng.getrandbits(128)).hex}',
+            'From': f'+1555{rng.randrange(num_users):07d}',
+            'To': '+15555550199',
+            'Body': make_body(command, rng),
+        })
+        traffic.append((command, event))
+    return traffic
+
+
+def send_webhook(response_handler, command: str, event: dict) -> dict:
+    start_time = time.perf_counter()
+    try:
+        response_handler.lambda_handler(event, None)
+        error = None
+    except Exception as e:
+        error = type(e).__name__
+    return {'command': command, 'seconds': time.perf_counter() - start_time, 'error': error}
+
+
+def summarize_seconds(seconds: list) -> dict:
+    seconds = sorted(seconds)
+    if not seconds:
+        return {'count': 0}
+    return {
+        'count': len(seconds),
+        'p50_ms': round(1000 * percentile(seconds, 50), 2),
+        'p95_ms': round(1000 * percentile(seconds, 95), 2),
+        'p99_ms': round(1000 * percentile(seconds, 99), 2),
+        'mean_ms': round(1000 * statistics.mean(seconds), 2),
+    }
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    # latency percentiles and API calls per message that got worse than the baseline by more than `tolerance`
+    regressions = []
+    for key in ['p50_ms', 'p95_ms']:
+        before, after = baseline['latency'][key], results['latency'][key]
+        if after > before * (1 + tolerance):
+            regressions.append(f'latency {key}: {before} -> {after}')
+    for api in ['superpowered', 'twilio', 'ssm']:
+        before = baseline['api_calls_per_message'][api]['total']
+        after = results['api_calls_per_message'][api]['total']
+        if after > before * (1 + tolerance) + 0.01:
+            regressions.append(f'{api} calls per message: {before} -> {after}')
+    return regressions
+
+
+def per_message(calls: dict, num_messages: int) -> dict:
+    counts = {name: round(count / num_messages, 3) for name, count in sorted(calls.items())}
+    counts['total'] = round(sum(calls.values()) / num_messages, 3)
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=300)
+    parser.add_argument('--users', type=int, default=50, help='number of distinct phone numbers sending the messages')
+    parser.add_argument('--concurrency', type=int, default=16, help='number of webhooks handled at the same time')
+    parser.add_argument('--mix', default=TRAFFIC_MIX, help='relative weight of each kind of message')
+    parser.add_argument('--sp-latency', type=float, default=0.02, help='simulated Superpowered round trip in seconds')
+    parser.add_argument('--chat-latency', type=float, default=0.5, help='simulated time for a chat job to complete in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of Superpowered requests that fail with a 503')
+    parser.add_argument('--twilio-latency', type=float, default=0.02, help='simulated Twilio round trip in seconds')
+    parser.add_argument('--ssm-latency', type=float, default=0.03, help='simulated SSM round trip in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='fail if the results are worse than the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression against the baseline, as a fraction')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    sp_calls, twilio_calls, ssm_calls, ssm_lock = Calls(), Calls(), {}, threading.Lock()
+    sp_server, sp_url = start_server(make_fake_superpowered_handler(args.sp_latency, args.chat_latency, args.failure_rate, sp_calls))
+    twilio_server, twilio_url = start_server(make_fake_twilio_handler(args.twilio_latency, twilio_calls))
+    ssm_server, ssm_url = start_server(make_fake_ssm_handler(args.ssm_latency, ssm_calls, ssm_lock))
+
+    os.environ.update({
+        'AWS_ENDPOINT_URL_SSM': ssm_url,
+        'AWS_ACCESS_KEY_ID': 'local',
+        'AWS_SECRET_ACCESS_KEY': 'local',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'TWILIO_ACCOUNT_SID_PARAM_NAME': 'twilio-account-sid',
+        'TWILIO_AUTH_TOKEN_PARAM_NAME': 'twilio-auth-token',
+        'SP_API_KEY_ID_PARAM_NAME': 'sp-api-key-id',
+        'SP_API_KEY_SECRET_PARAM_NAME': 'sp-api-key-secret',
+        'SP_BASE_URL': f'{sp_url}/v1',
+        # every webhook is answered inline, like a deployment without the work queue
+        'WORK_QUEUE': '',
+    })
+    import response_handler
+
+    twilio_client = make_twilio_client(twilio_url)
+    response_handler.get_twilio_client = lambda: twilio_client
+    # the handler's log lines are collected instead of printed. the metric records give the per-stage latencies
+    metric_records = []
+    response_handler.TRACER.emit = lambda line: metric_records.append(json.loads(line))
+    response_handler.print = lambda *args, **kwargs: None
+
+    traffic = make_traffic(args.messages, args.users, parse_mix(args.mix), args.seed)
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        outcomes = list(executor.map(lambda message: send_webhook(response_handler, *message), traffic))
+    elapsed = time.perf_counter() - start_time
+    for server in [sp_server, twilio_server, ssm_server]:
+        server.shutdown()
+
+    with ssm_lock:
+        ssm_counts = dict(ssm_calls)
+    ok = [outcome for outcome in outcomes if outcome['error'] is None]
+    results = {
+        'config': {name: value for name, value in vars(args).items() if name not in ['output', 'baseline']},
+        'messages': len(outcomes),
+        'errors': {error: sum(1 for outcome in outcomes if outcome['error'] == error) for error in {outcome['error'] for outcome in outcomes} if error},
+        'elapsed_seconds': round(elapsed, 2),
+        'messages_per_second': round(len(outcomes) / elapsed, 2),
+        'latency': summarize_seconds([outcome['seconds'] for outcome in ok]),
+        'latency_by_command': {
+            command: summarize_seconds([outcome['seconds'] for outcome in ok if outcome['command'] == command])
+            for command in sorted({outcome['command'] for outcome in outcomes})
+        },
+        'stages': summarize(metric_records),
+        'api_calls_per_message': {
+            'superpowered': per_message(sp_calls.snapshot(), len(outcomes)),
+            'twilio': per_message(twilio_calls.snapshot(), len(outcomes)),
+            'ssm': per_message(ssm_counts, len(outcomes)),
+        },
+    }
+
+    print (f"{results['messages']} messages in {results['elapsed_seconds']}s ({results['messages_per_second']}/s), errors: {results['errors'] or 'none'}")
+    print (f"\n{'command':<14}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for command, s in [('all', results['latency'])] + list(results['latency_by_command'].items()):
+        if s['count']:
+            print (f"{command:<14}{s['count']:>7}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}")
+    print (f"\n{'stage':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, s in results['stages'].items():
+        print (f"{stage:<22}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}")
+    print ('\nAPI calls per message:')
+    print (json.dumps(results['api_calls_per_message'], indent=4))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit('Regressions against the baseline:\n' + '\n'.join(regressions))
+        print ('\nNo regressions against the baseline')
@@ -0,0 +1,69 @@
+"""
+Report how many Twilio segments the SMS encoder saves on a corpus of assistant responses, one JSON object with a
+"response" field per line. Exits with an error if any response is billed more segments after encoding than before.
+
+    python benchmark/sms_segments.py --corpus benchmark/sms_corpus.jsonl --strip-emoji
+"""
+import argparse
+import json
+import os
+import sys
+
+
+RESPONSE_HANDLER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'response_handler')
+sys.path.insert(0, RESPONSE_HANDLER_DIR)
+
+from sms_encoding import MAX_MESSAGE_CHARS, count_segments, encode_sms
+
+
+def load_corpus(path: str) -> list:
+    with open(path) as f:
+        return [json.loads(line)['response'] for line in f if line.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sms_corpus.jsonl'))
+    parser.add_argument('--strip-emoji', action='store_true', help='also remove emoji, like SMS_STRIP_EMOJI=true does')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    rows = []
+    for i, response in enumerate(load_corpus(args.corpus)):
+        before = count_segments(response)
+        encoded = encode_sms(response, remove_emoji=args.strip_emoji)
+        rows.append({
+            'response': i,
+            'chars': len(response),
+            'encoding_before': before['encoding'],
+            'encoding_after': encoded['encoding'],
+            'segments_before': encoded['segments_before'],
+            'segments_after': encoded['segments'],
+            'messages': len(encoded['messages']),
+            'too_long': any(len(message) > MAX_MESSAGE_CHARS for message in encoded['messages']),
+        })
+
+    print (f"{'#':>3} {'chars':>6} {'before':>14} {'after':>14} {'messages':>9}")
+    for row in rows:
+        print (f"{row['response']:>3} {row['chars']:>6} {row['segments_before']:>3} ({row['encoding_before']}) "
+               f"{row['segments_after']:>3} ({row['encoding_after']}) {row['messages']:>9}")
+
+    segments_before = sum(row['segments_before'] for row in rows)
+    segments_after = sum(row['segments_after'] for row in rows)
+    regressions = [row['response'] for row in rows if row['segments_after'] > row['segments_before'] or row['too_long']]
+    results = {
+        'responses': len(rows),
+        'strip_emoji': args.strip_emoji,
+        'segments_before': segments_before,
+        'segments_after': segments_after,
+        'segments_saved_pct': round(100 * (segments_before - segments_after) / segments_before, 1) if segments_before else 0.0,
+        'ucs2_before': sum(row['encoding_before'] == 'UCS-2' for row in rows),
+        'ucs2_after': sum(row['encoding_after'] == 'UCS-2' for row in rows),
+        'regressions': regressions,
+    }
+    print (json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'summary': results, 'responses': rows}, f, indent=4)
+    if regressions:
+        sys.exit(f'{len(regressions)} responses got more expensive (or too long) after encoding: {regressions}')
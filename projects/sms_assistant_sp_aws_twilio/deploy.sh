@@ -50,6 +50,15 @@ if [ -z "$TWILIO_PHONE_NUMBER" ]; then
     exit 1
 fi
 
+###############################
+# CHECK SHARED CODE
+###############################
+# response_handler/job_poller.py is a copy of notebooks/job_poller.py, since sam only packages the response_handler directory
+if ! cmp -s response_handler/job_poller.py ../../notebooks/job_poller.py; then
+    echo "Error: response_handler/job_poller.py and notebooks/job_poller.py are different, copy the change to both" >&2
+    exit 1
+fi
+
 ###############################
 # SET SSM PARAMETERS IF THEY WERE PASSED IN
 ###############################
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+
+from idempotency import Counters
+from thread_cache import LRUCache
+
+
+# answers are cached for at most this long. 0 turns the cache off
+ANSWER_CACHE_MAX_TTL_SECONDS = float(os.environ.get('ANSWER_CACHE_MAX_TTL_SECONDS', '0'))
+# threads that only search the last few days of the web want fresh answers, so their answers expire sooner:
+# a 1 day timeframe keeps answers for 10 minutes by default, a 7 day timeframe for 70 minutes (up to the max TTL)
+ANSWER_CACHE_TTL_SECONDS_PER_TIMEFRAME_DAY = float(os.environ.get('ANSWER_CACHE_TTL_SECONDS_PER_TIMEFRAME_DAY', '600'))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', '500'))
+# longer messages are rarely sent twice, and are more likely to be part of a conversation
+ANSWER_CACHE_MAX_WORDS = int(os.environ.get('ANSWER_CACHE_MAX_WORDS', '12'))
+
+# dropped before comparing questions, so "hey what's the news?" and "whats the news" are the same question
+FILLER_WORDS = {'hey', 'hi', 'hello', 'ok', 'okay', 'please', 'pls', 'plz', 'thanks', 'thx', 'um', 'so'}
+# questions with any of these depend on the conversation (or on who's asking), so they always go to the model
+FOLLOW_UP_WORDS = {
+    'it', 'its', 'that', 'this', 'these', 'those', 'they', 'them', 'their', 'he', 'him', 'his', 'she', 'her',
+    'there', 'then', 'more', 'else', 'also', 'again', 'another', 'other', 'above', 'previous', 'earlier', 'instead',
+    'same', 'continue', 'elaborate', 'why', 'yes', 'no', 'i', 'im', 'me', 'my', 'we', 'us', 'our',
+}
+PUNCTUATION_RE = re.compile(r"[^\w\s]")
+
+
+def normalize_question(text: str) -> str:
+    text = unicodedata.normalize('NFKC', text).casefold()
+    # "what's" and "whats" are the same word
+    text = PUNCTUATION_RE.sub(lambda m: '' if m.group(0) in "'’" else ' ', text)
+    return ' '.join(word for word in text.split() if word not in FILLER_WORDS)
+
+
+def is_follow_up(normalized_question: str) -> bool:
+    return any(word in FOLLOW_UP_WORDS for word in normalized_question.split())
+
+
+def answer_ttl_seconds(default_options: dict, max_ttl_seconds: float = ANSWER_CACHE_MAX_TTL_SECONDS,
+                       ttl_seconds_per_timeframe_day: float = ANSWER_CACHE_TTL_SECONDS_PER_TIMEFRAME_DAY) -> float:
+    timeframe_days = (default_options.get('web_search_config') or {}).get('timeframe_days')
+    if not default_options.get('use_web_search') or not timeframe_days:
+        return max_ttl_seconds
+    return min(max_ttl_seconds, timeframe_days * ttl_seconds_per_timeframe_day)
+
+
+class AnswerCache:
+    """
+    Short-lived cache of model answers to standalone questions, so a question that many people text (i.e. "weather
+    today?") only goes to the model once every few minutes. Answers are keyed on the normalized question plus everything
+    in the thread's settings that changes the answer: model, temperature, web search timeframe and assistant name.
+    Questions that look like follow-ups (see FOLLOW_UP_WORDS) or are longer than `max_words` are never cached.
+
+    Like ThreadCache, there's an in-process LRU and an optional persistent store shared by all containers. Store
+    errors are logged and treated as misses.
+
+    A cached answer isn't added to the user's chat thread, so the thread doesn't know what it "said". The exchange is
+    kept instead (see remember_served) and prepended to the user's next question that does go to the model.
+    """
+    def __init__(self, local: LRUCache = None, store=None, max_ttl_seconds: float = ANSWER_CACHE_MAX_TTL_SECONDS,
+                 max_words: int = ANSWER_CACHE_MAX_WORDS):
+        self.local = local if local is not None else LRUCache(max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl_seconds=max_ttl_seconds)
+        self.store = store
+        self.max_ttl_seconds = max_ttl_seconds
+        self.max_words = max_words
+        self.counters = Counters('lookups', 'hits', 'misses', 'not_cacheable', 'store_errors')
+
+    def key_for(self, question: str, thread: dict) -> str:
+        # returns None if the answer to `question` shouldn't be cached
+        normalized = normalize_question(question)
+        if not normalized or len(normalized.split()) > self.max_words or is_follow_up(normalized):
+            self.counters.increment('not_cacheable')
+            return None
+        default_options = thread.get('default_options') or {}
+        settings = [
+            default_options.get('model'),
+            default_options.get('temperature'),
+            default_options.get('use_web_search'),
+            (default_options.get('web_search_config') or {}).get('timeframe_days'),
+            thread.get('title'),
+        ]
+        digest = hashlib.sha256(json.dumps([normalized, settings]).encode('utf-8')).hexdigest()
+        return f'answer:{digest}'
+
+    def store_call(self, method: str, *args):
+        try:
+            return getattr(self.store, method)(*args)
+        except Exception as e:
+            print(f'Answer cache store error: {e}')
+            self.counters.increment('store_errors')
+            return None
+
+    def get(self, key: str) -> str:
+        self.counters.increment('lookups')
+        answer = self.local.get(key)
+        if answer is None and self.store is not None:
+            entry = self.store_call('get', key)
+            if entry is not None:
+                # keep it locally for as long as the store still would
+                answer = entry['answer']
+                self.local.set(key, answer, max(0.0, entry['expires_at'] - time.time()))
+        self.counters.increment('hits' if answer is not None else 'misses')
+        return answer
+
+    def set(self, key: str, answer: str, thread: dict):
+        ttl_seconds = answer_ttl_seconds(thread.get('default_options') or {}, self.max_ttl_seconds)
+        if ttl_seconds <= 0:
+            return
+        self.local.set(key, answer, ttl_seconds)
+        if self.store is not None:
+            self.store_call('set', key, {'answer': answer, 'expires_at': time.time() + ttl_seconds}, ttl_seconds)
+
+    def remember_served(self, thread_id: str, question: str, answer: str):
+        # cached answers skip the chat thread, so remember the exchange for the thread's next model call
+        exchanges = (self.store_call('get', f'served:{thread_id}') if self.store is not None else self.local.get(f'served:{thread_id}')) or []
+        exchanges = (exchanges + [{'question': question, 'answer': answer}])[-3:]
+        self.local.set(f'served:{thread_id}', exchanges, self.max_ttl_seconds)
+        if self.store is not None:
+            self.store_call('set', f'served:{thread_id}', exchanges, self.max_ttl_seconds)
+
+    def take_served(self, thread_id: str) -> list:
+        # returns (and forgets) the exchanges answered from the cache since the thread's last model call
+        key = f'served:{thread_id}'
+        exchanges = self.store_call('get', key) if self.store is not None else self.local.get(key)
+        if exchanges:
+            self.local.delete(key)
+            if self.store is not None:
+                self.store_call('delete', key)
+        return exchanges or []
+
+    def stats(self) -> dict:
+        stats = self.counters.stats()
+        stats['hit_rate'] = round(stats['hits'] / stats['lookups'], 3) if stats['lookups'] else None
+        return stats
+
+    def reset_stats(self):
+        self.counters.reset()
+
+
+def with_served_exchanges(user_input: str, exchanges: list) -> str:
+    # the model didn't see the questions that were answered from the cache, so they're added to the next input
+    if not exchanges:
+        return user_input
+    earlier = '\n\n'.join(f"I asked: {exchange['question']}\nYou answered: {exchange['answer']}" for exchange in exchanges)
+    return f'<EARLIER IN THIS CONVERSATION>\n{earlier}\n</EARLIER IN THIS CONVERSATION>\n\n{user_input}'
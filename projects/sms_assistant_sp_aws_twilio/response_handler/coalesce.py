@@ -0,0 +1,111 @@
+import os
+import time
+
+from idempotency import MESSAGE_DEDUP_TTL_SECONDS, Counters, PhoneNumberLock
+
+
+# messages from the same number that arrive less than this many seconds apart are answered together. 0 turns it off
+COALESCE_WINDOW_SECONDS = float(os.environ.get('COALESCE_WINDOW_SECONDS', '0'))
+# never wait longer than this after the first message, even if the user keeps typing
+COALESCE_MAX_WAIT_SECONDS = float(os.environ.get('COALESCE_MAX_WAIT_SECONDS', '10'))
+
+
+class MessageCoalescer:
+    """
+    Merges messages from the same phone number that arrive in quick succession (i.e. a question sent as several texts,
+    or a long text the carrier split up) into one chat input, so they get a single answer.
+
+    The first message from a number starts a buffer and becomes its leader. Messages that arrive while the buffer is
+    open are appended to it and their workers return right away. The leader waits until nothing new has arrived for
+    `window_seconds` (or `max_wait_seconds` have passed since the buffer was opened), then takes the whole buffer and
+    answers the merged messages in the order they were received. The buffer lives in the shared key/value store, so
+    this works across workers.
+
+    A taken buffer is kept until the leader calls `finish` (once its reply has been sent). If answering fails, `put_back`
+    returns the messages to the number's buffer, and the next message to arrive (i.e. the leader's retry) leads it. A
+    retry of a leader that died without either gets its taken buffer back in `add`.
+    """
+    def __init__(self, store, window_seconds: float = COALESCE_WINDOW_SECONDS, max_wait_seconds: float = COALESCE_MAX_WAIT_SECONDS,
+                 poll_interval: float = 0.2):
+        self.store = store
+        self.window_seconds = window_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.poll_interval = poll_interval
+        self.buffer_lock = PhoneNumberLock(store, ttl_seconds=10, poll_interval=0.05, prefix='coalesce-lock')
+        self.buffer_ttl_seconds = max_wait_seconds + 60
+        # as long as a retry of the leader could still show up
+        self.taken_ttl_seconds = MESSAGE_DEDUP_TTL_SECONDS
+        self.counters = Counters('buffers', 'merged_messages', 'restored_messages')
+
+    def taken_key(self, phone_number: str, leader_sid: str) -> str:
+        return f'coalesce-taken:{phone_number}:{leader_sid}'
+
+    def add(self, phone_number: str, message_sid: str, body: str, received_at: float) -> bool:
+        # adds the message to the number's buffer. returns True if it leads the buffer (and has to answer it)
+        key = f'coalesce:{phone_number}'
+        with self.buffer_lock.hold(phone_number):
+            if message_sid:
+                taken = self.store.get(self.taken_key(phone_number, message_sid))
+                if taken is not None:
+                    self.restore(phone_number, taken['messages'])
+                    self.store.delete(self.taken_key(phone_number, message_sid))
+            buffer = self.store.get(key) or {'leader': None, 'opened_at': time.time(), 'messages': []}
+            if buffer['leader'] is None:
+                buffer['leader'] = message_sid
+            # a retried message can already be in a buffer that was put back
+            if not (message_sid and any(message['sid'] == message_sid for message in buffer['messages'])):
+                buffer['messages'].append({'sid': message_sid, 'body': body, 'received_at': received_at})
+            buffer['last_added_at'] = time.time()
+            self.store.set(key, buffer, self.buffer_ttl_seconds)
+        is_leader = buffer['leader'] == message_sid
+        self.counters.increment('buffers' if is_leader else 'merged_messages')
+        return is_leader
+
+    def wait_and_take(self, phone_number: str) -> list:
+        # called by the leader: waits for the window to close, then removes the buffer and returns its messages in order
+        key = f'coalesce:{phone_number}'
+        while True:
+            buffer = self.store.get(key)
+            now = time.time()
+            if buffer is None or now >= buffer['last_added_at'] + self.window_seconds or now >= buffer['opened_at'] + self.max_wait_seconds:
+                break
+            time.sleep(self.poll_interval)
+        with self.buffer_lock.hold(phone_number):
+            buffer = self.store.get(key)
+            self.store.delete(key)
+            if buffer and buffer['leader']:
+                self.store.set(self.taken_key(phone_number, buffer['leader']), buffer, self.taken_ttl_seconds)
+        messages = buffer['messages'] if buffer else []
+        return sorted(messages, key=lambda message: message['received_at'])
+
+    def finish(self, phone_number: str, leader_sid: str):
+        # called by the leader once the merged messages have been answered
+        if leader_sid:
+            self.store.delete(self.taken_key(phone_number, leader_sid))
+
+    def put_back(self, phone_number: str, leader_sid: str):
+        # called by the leader if answering failed, so the merged messages are answered by whoever leads the buffer next
+        if not leader_sid:
+            return
+        with self.buffer_lock.hold(phone_number):
+            taken = self.store.get(self.taken_key(phone_number, leader_sid))
+            if taken is not None:
+                self.restore(phone_number, taken['messages'])
+                self.store.delete(self.taken_key(phone_number, leader_sid))
+
+    def restore(self, phone_number: str, messages: list):
+        # must be called with the buffer lock held. messages that arrived since keep their place after these, and a
+        # buffer that's already open keeps its leader. otherwise the next message to arrive leads it
+        key = f'coalesce:{phone_number}'
+        now = time.time()
+        buffer = self.store.get(key) or {'leader': None, 'opened_at': now, 'last_added_at': now, 'messages': []}
+        sids = {message['sid'] for message in buffer['messages'] if message['sid']}
+        buffer['messages'] = [message for message in messages if message['sid'] not in sids] + buffer['messages']
+        self.store.set(key, buffer, self.buffer_ttl_seconds)
+        self.counters.increment('restored_messages', len(messages))
+
+    def stats(self) -> dict:
+        return self.counters.stats()
+
+    def reset_stats(self):
+        self.counters.reset()
@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+# twilio (and SQS) can deliver the same message more than once. a message is remembered for this long once answered
+MESSAGE_DEDUP_TTL_SECONDS = float(os.environ.get('MESSAGE_DEDUP_TTL_SECONDS', str(24 * 60 * 60)))
+# while a message is being answered it's claimed for this long, so a worker that dies mid-message doesn't block the
+# retry forever. has to be longer than the worker's timeout
+MESSAGE_CLAIM_TTL_SECONDS = float(os.environ.get('MESSAGE_CLAIM_TTL_SECONDS', '150'))
+PHONE_LOCK_TTL_SECONDS = float(os.environ.get('PHONE_LOCK_TTL_SECONDS', '30'))
+
+
+class Counters:
+    def __init__(self, *names):
+        self.lock = threading.Lock()
+        self.counts = {name: 0 for name in names}
+
+    def increment(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counts)
+
+    def reset(self):
+        with self.lock:
+            self.counts = {name: 0 for name in self.counts}
+
+
+class MessageDeduplicator:
+    """
+    Makes sure each inbound message (by Twilio MessageSid) is only answered once. `claim` returns False if the message
+    is already being answered or was answered in the last `dedup_ttl_seconds`. After a successful claim, call `done`
+    once the reply has been sent, or `release` if answering failed so a retry can claim it again.
+    """
+    def __init__(self, store, claim_ttl_seconds: float = MESSAGE_CLAIM_TTL_SECONDS, dedup_ttl_seconds: float = MESSAGE_DEDUP_TTL_SECONDS):
+        self.store = store
+        self.claim_ttl_seconds = claim_ttl_seconds
+        self.dedup_ttl_seconds = dedup_ttl_seconds
+        self.counters = Counters('claimed', 'duplicates_suppressed', 'released')
+
+    def claim(self, message_sid: str) -> bool:
+        claimed = self.store.add(f'message:{message_sid}', {'state': 'processing', 'claimed_at': time.time()}, self.claim_ttl_seconds)
+        self.counters.increment('claimed' if claimed else 'duplicates_suppressed')
+        return claimed
+
+    def done(self, message_sid: str):
+        self.store.set(f'message:{message_sid}', {'state': 'done', 'done_at': time.time()}, self.dedup_ttl_seconds)
+
+    def release(self, message_sid: str):
+        self.store.delete(f'message:{message_sid}')
+        self.counters.increment('released')
+
+    def stats(self) -> dict:
+        return self.counters.stats()
+
+    def reset_stats(self):
+        self.counters.reset()
+
+
+class PhoneNumberLock:
+    """
+    Per phone number lock, so two messages from a new number that arrive at the same time don't both create a chat
+    thread. The lock expires after `ttl_seconds` in case its holder dies without releasing it. Locks with a different
+    `prefix` are independent of each other.
+    """
+    def __init__(self, store, ttl_seconds: float = PHONE_LOCK_TTL_SECONDS, poll_interval: float = 0.1, prefix: str = 'lock'):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+        self.counters = Counters('acquired', 'waited', 'timed_out')
+
+    @contextmanager
+    def hold(self, phone_number: str, wait_seconds: float = 10.0):
+        key = f'{self.prefix}:{phone_number}'
+        token = str(uuid.uuid4())
+        deadline = time.monotonic() + wait_seconds
+        waited = False
+        while not self.store.add(key, token, self.ttl_seconds):
+            if time.monotonic() >= deadline:
+                self.counters.increment('timed_out')
+                raise TimeoutError(f'Timed out waiting for the lock on {phone_number}')
+            waited = True
+            time.sleep(self.poll_interval)
+        self.counters.increment('acquired')
+        if waited:
+            self.counters.increment('waited')
+        try:
+            yield
+        finally:
+            # only release the lock if it's still ours (it could have expired and been taken by someone else)
+            if self.store.get(key) == token:
+                self.store.delete(key)
+
+    def stats(self) -> dict:
+        return self.counters.stats()
+
+    def reset_stats(self):
+        self.counters.reset()
@@ -0,0 +1,94 @@
+# the same file is in notebooks/ and projects/sms_assistant_sp_aws_twilio/response_handler/ (the Lambda package can only
+# include its own directory). keep the two copies identical - the sms assistant's deploy.sh refuses to deploy otherwise
+import random
+import threading
+import time
+
+
+# async Superpowered jobs (chat responses, reviews, long form, revisions, exports) end in one of these
+TERMINAL_STATUSES = ('COMPLETE', 'FAILED')
+
+
+class JobDeadlineExceeded(Exception):
+    """
+    Raised when a job isn't finished by the poller's deadline. The job keeps running on the Superpowered side;
+    `job` is the last status response that was received.
+    """
+    def __init__(self, job: dict, elapsed_seconds: float):
+        super().__init__(f'Job still {job.get("status")} after {elapsed_seconds:.1f}s')
+        self.job = job
+        self.elapsed_seconds = elapsed_seconds
+
+
+class JobPoller:
+    """
+    Polls the `status_url` of an async Superpowered job until it's COMPLETE or FAILED. The wait between polls starts
+    at `initial_interval` and grows by `multiplier` up to `max_interval`, with some random jitter so many jobs started
+    at the same time don't all poll in lockstep. If `deadline_seconds` is set (here or per call), JobDeadlineExceeded is
+    raised once the job has been polled for that long. Keeps poll counts and latencies for every job it has polled.
+    """
+    def __init__(self, initial_interval: float = 0.5, max_interval: float = 5.0, multiplier: float = 1.5,
+                 jitter: float = 0.2, deadline_seconds: float = None, sleep=time.sleep, clock=time.monotonic):
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.deadline_seconds = deadline_seconds
+        self.sleep = sleep
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.history = []
+
+    def intervals(self):
+        # 0.5, 0.75, 1.1, 1.7, ... up to max_interval, each shortened by up to `jitter` (as a fraction)
+        interval = self.initial_interval
+        while True:
+            yield interval * (1 - random.uniform(0, self.jitter))
+            interval = min(interval * self.multiplier, self.max_interval)
+
+    def poll(self, job: dict, fetch, on_update=None, deadline_seconds: float = None) -> dict:
+        # `job` is the response from submitting the job and `fetch` takes a status url and returns the job's json.
+        # `on_update` is called with each new status response, i.e. to show partial results while the job runs
+        deadline_seconds = deadline_seconds if deadline_seconds is not None else self.deadline_seconds
+        start_time = self.clock()
+        num_polls = 0
+        intervals = self.intervals()
+        try:
+            while job['status'] not in TERMINAL_STATUSES:
+                elapsed = self.clock() - start_time
+                wait = next(intervals)
+                if deadline_seconds is not None:
+                    if elapsed >= deadline_seconds:
+                        raise JobDeadlineExceeded(job, elapsed)
+                    wait = min(wait, deadline_seconds - elapsed)
+                self.sleep(wait)
+                job = fetch(job['status_url'])
+                num_polls += 1
+                if on_update is not None:
+                    on_update(job)
+        finally:
+            self.record(job.get('status'), num_polls, self.clock() - start_time)
+        return job
+
+    def record(self, status: str, num_polls: int, seconds: float):
+        with self.lock:
+            self.history.append({'status': status, 'polls': num_polls, 'seconds': seconds})
+
+    def stats(self) -> dict:
+        with self.lock:
+            history = list(self.history)
+        if not history:
+            return {'jobs': 0}
+        seconds = sorted(job['seconds'] for job in history)
+        return {
+            'jobs': len(history),
+            'unfinished': sum(1 for job in history if job['status'] not in TERMINAL_STATUSES),
+            'polls': sum(job['polls'] for job in history),
+            'mean_polls': round(sum(job['polls'] for job in history) / len(history), 1),
+            'mean_seconds': round(sum(seconds) / len(seconds), 3),
+            'max_seconds': round(seconds[-1], 3),
+        }
+
+    def reset_stats(self):
+        with self.lock:
+            self.history = []
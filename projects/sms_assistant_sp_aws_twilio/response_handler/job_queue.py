@@ -0,0 +1,135 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+
+
+class InMemoryQueue:
+    """
+    Queue for running the ingress and the worker in the same process (i.e. locally or in benchmarks). Messages are
+    removed as soon as they're received, so there's no redelivery.
+    """
+    def __init__(self):
+        self.messages = deque()
+        self.condition = threading.Condition()
+        self.next_id = 0
+
+    def send(self, message: dict):
+        with self.condition:
+            self.next_id += 1
+            self.messages.append((self.next_id, message))
+            self.condition.notify()
+
+    def receive(self, max_messages: int = 10, wait_seconds: float = 0.0) -> list:
+        # returns a list of (receipt, message) pairs, waiting up to `wait_seconds` for the first one
+        with self.condition:
+            if not self.messages and wait_seconds:
+                self.condition.wait(wait_seconds)
+            received = []
+            while self.messages and len(received) < max_messages:
+                received.append(self.messages.popleft())
+            return received
+
+    def delete(self, receipt):
+        pass
+
+    def __len__(self):
+        return len(self.messages)
+
+
+class SqliteQueue:
+    """
+    Queue in a local SQLite file with SQS-like semantics: received messages are hidden for `visibility_timeout`
+    seconds and show up again unless they're deleted, so a worker that crashes mid-message doesn't lose it.
+    """
+    def __init__(self, path: str, visibility_timeout: float = 180.0):
+        self.visibility_timeout = visibility_timeout
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                body TEXT NOT NULL,
+                visible_at REAL NOT NULL,
+                receive_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self.conn.commit()
+
+    def send(self, message: dict):
+        with self.lock:
+            self.conn.execute('INSERT INTO messages (body, visible_at) VALUES (?, ?)', (json.dumps(message), time.time()))
+            self.conn.commit()
+
+    def receive(self, max_messages: int = 10, wait_seconds: float = 0.0) -> list:
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            now = time.time()
+            with self.lock:
+                rows = self.conn.execute(
+                    'SELECT id, body FROM messages WHERE visible_at <= ? ORDER BY id LIMIT ?', (now, max_messages)
+                ).fetchall()
+                if rows:
+                    self.conn.executemany(
+                        'UPDATE messages SET visible_at = ?, receive_count = receive_count + 1 WHERE id = ?',
+                        [(now + self.visibility_timeout, row[0]) for row in rows]
+                    )
+                    self.conn.commit()
+                    return [(row[0], json.loads(row[1])) for row in rows]
+            if time.monotonic() >= deadline:
+                return []
+            time.sleep(0.05)
+
+    def delete(self, receipt):
+        with self.lock:
+            self.conn.execute('DELETE FROM messages WHERE id = ?', (receipt,))
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class SqsQueue:
+    """
+    Same interface, backed by an SQS queue. In Lambda the worker is triggered by the SQS event source instead of
+    calling `receive`, so this is mostly used by the ingress to send messages.
+    """
+    def __init__(self, queue_url: str):
+        # only imported when SQS is actually used, so the local queues don't pay for it
+        import boto3
+        self.queue_url = queue_url
+        self.client = boto3.client('sqs')
+
+    def send(self, message: dict):
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(message))
+
+    def receive(self, max_messages: int = 10, wait_seconds: float = 0.0) -> list:
+        resp = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=min(max_messages, 10),
+            WaitTimeSeconds=int(wait_seconds),
+        )
+        return [(message['ReceiptHandle'], json.loads(message['Body'])) for message in resp.get('Messages', [])]
+
+    def delete(self, receipt):
+        self.client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=receipt)
+
+
+def create_queue(spec: str):
+    # "memory", "sqlite:/tmp/queue.sqlite" or "sqs:https://sqs...". returns None if `spec` is empty (no queue, so
+    # messages are handled inline by the ingress)
+    if not spec:
+        return None
+    kind, _, location = spec.partition(':')
+    if kind == 'memory':
+        return InMemoryQueue()
+    if kind == 'sqlite':
+        return SqliteQueue(location)
+    if kind == 'sqs':
+        return SqsQueue(location)
+    raise ValueError(f'Unknown queue: {spec}')
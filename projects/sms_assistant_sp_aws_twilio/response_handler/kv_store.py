@@ -0,0 +1,151 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class InMemoryKeyValueStore:
+    """
+    Key/value store with per-key expiry in a dict. Only shared by the threads of one process, so it's meant for running
+    things locally when there's no persistent store.
+    """
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        with self.lock:
+            item = self.items.get(key)
+        if item is None or (item[1] is not None and item[1] < time.time()):
+            return None
+        return json.loads(item[0])
+
+    def set(self, key: str, value, ttl_seconds: float = None):
+        with self.lock:
+            self.items[key] = (json.dumps(value), time.time() + ttl_seconds if ttl_seconds else None)
+
+    def add(self, key: str, value, ttl_seconds: float = None) -> bool:
+        # sets the key only if it doesn't exist (or has expired). returns whether it was set
+        now = time.time()
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and (item[1] is None or item[1] >= now):
+                return False
+            self.items[key] = (json.dumps(value), now + ttl_seconds if ttl_seconds else None)
+            return True
+
+    def delete(self, key: str):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def close(self):
+        pass
+
+
+class SqliteKeyValueStore:
+    """
+    Key/value store with per-key expiry in a local SQLite file. Used to run and benchmark the handler locally, and as a
+    stand-in for DynamoDB (a file in /tmp only lives as long as the Lambda container does).
+    """
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS kv (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.conn.execute('SELECT value, expires_at FROM kv WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value, ttl_seconds: float = None):
+        expires_at = time.time() + ttl_seconds if ttl_seconds else None
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)', (key, json.dumps(value), expires_at))
+            self.conn.commit()
+
+    def add(self, key: str, value, ttl_seconds: float = None) -> bool:
+        # sets the key only if it doesn't exist (or has expired). returns whether it was set
+        now = time.time()
+        expires_at = now + ttl_seconds if ttl_seconds else None
+        with self.lock:
+            self.conn.execute('DELETE FROM kv WHERE key = ? AND expires_at < ?', (key, now))
+            cursor = self.conn.execute('INSERT OR IGNORE INTO kv (key, value, expires_at) VALUES (?, ?, ?)', (key, json.dumps(value), expires_at))
+            self.conn.commit()
+            return cursor.rowcount == 1
+
+    def delete(self, key: str):
+        with self.lock:
+            self.conn.execute('DELETE FROM kv WHERE key = ?', (key,))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class DynamoDbKeyValueStore:
+    """
+    Same interface as SqliteKeyValueStore, backed by a DynamoDB table with a string partition key named `key`. Expired
+    items are ignored on read, since DynamoDB's own TTL deletion (on the `expires_at` attribute) can lag by hours.
+    """
+    def __init__(self, table_name: str):
+        # only imported when DynamoDB is actually used, so the local store doesn't pay for it
+        import boto3
+        self.table = boto3.resource('dynamodb').Table(table_name)
+        self.conditional_check_failed = self.table.meta.client.exceptions.ConditionalCheckFailedException
+
+    def get(self, key: str):
+        item = self.table.get_item(Key={'key': key}, ConsistentRead=True).get('Item')
+        if item is None or ('expires_at' in item and int(item['expires_at']) < time.time()):
+            return None
+        return json.loads(item['value'])
+
+    def set(self, key: str, value, ttl_seconds: float = None):
+        item = {'key': key, 'value': json.dumps(value)}
+        if ttl_seconds:
+            item['expires_at'] = int(time.time() + ttl_seconds)
+        self.table.put_item(Item=item)
+
+    def add(self, key: str, value, ttl_seconds: float = None) -> bool:
+        # sets the key only if it doesn't exist (or has expired). returns whether it was set
+        item = {'key': key, 'value': json.dumps(value)}
+        if ttl_seconds:
+            item['expires_at'] = int(time.time() + ttl_seconds)
+        try:
+            self.table.put_item(
+                Item=item,
+                ConditionExpression='attribute_not_exists(#key) OR expires_at < :now',
+                ExpressionAttributeNames={'#key': 'key'},
+                ExpressionAttributeValues={':now': int(time.time())},
+            )
+        except self.conditional_check_failed:
+            return False
+        return True
+
+    def delete(self, key: str):
+        self.table.delete_item(Key={'key': key})
+
+    def close(self):
+        pass
+
+
+def create_kv_store(spec: str):
+    # "memory", "sqlite:/tmp/cache.sqlite" or "dynamodb:table-name". returns None if `spec` is empty (no store)
+    if not spec:
+        return None
+    kind, _, location = spec.partition(':')
+    if kind == 'memory':
+        return InMemoryKeyValueStore()
+    if kind == 'sqlite':
+        return SqliteKeyValueStore(location)
+    if kind == 'dynamodb':
+        return DynamoDbKeyValueStore(location)
+    raise ValueError(f'Unknown key/value store: {spec}')
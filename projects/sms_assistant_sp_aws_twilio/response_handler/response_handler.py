@@ -1,42 +1,95 @@
 # twilio documentation about webhooks: https://www.twilio.com/docs/messaging/guides/webhook-request
 import base64
-import boto3
 import json
 import os
-import requests
+import time
 from urllib.parse import parse_qs
 
-from twilio.rest import Client
 from twilio.request_validator import RequestValidator
 
+from answer_cache import ANSWER_CACHE_MAX_TTL_SECONDS, AnswerCache, with_served_exchanges
+from coalesce import COALESCE_WINDOW_SECONDS, MessageCoalescer
+from idempotency import MESSAGE_CLAIM_TTL_SECONDS, Counters, MessageDeduplicator, PhoneNumberLock
+from job_poller import JobDeadlineExceeded, JobPoller
+from job_queue import create_queue
+from kv_store import create_kv_store
+from sms_encoding import encode_sms, strip_emoji
+from sp_client import SuperpoweredClient
+from ssm_parameters import ParameterCache
+from thread_cache import ChatThreadNotFound, ThreadCache
+from tracing import Tracer
+
 
 # GET CREDENTIALS FROM SSM
 # THIS STEP ASSUMES THAT YOU HAVE STORED YOUR CREDENTIALS IN SSM
-# twilio
-ssm = boto3.client('ssm')
-TWILIO_ACCOUNT_SID = ssm.get_parameter(
-    Name=os.environ['TWILIO_ACCOUNT_SID_PARAM_NAME'],
-    WithDecryption=True
-)['Parameter']['Value']
-TWILIO_AUTH_TOKEN = ssm.get_parameter(
-    Name=os.environ['TWILIO_AUTH_TOKEN_PARAM_NAME'],
-    WithDecryption=True
-)['Parameter']['Value']
-TWILIO_CLIENT = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-
-# superpowered
-SP_API_KEY_ID = ssm.get_parameter(
-    Name=os.environ['SP_API_KEY_ID_PARAM_NAME'],
-    WithDecryption=True
-)['Parameter']['Value']
-SP_API_KEY_SECRET = ssm.get_parameter(
-    Name=os.environ['SP_API_KEY_SECRET_PARAM_NAME'],
-    WithDecryption=True
-)['Parameter']['Value']
-
-
-SP_BASE_URL = 'https://api.superpowered.ai/v1'
-SP_AUTH = (SP_API_KEY_ID, SP_API_KEY_SECRET)
+# nothing is fetched at import time: the first invocation fetches all four parameters in one call and warm
+# invocations reuse them until the cache's TTL runs out
+TWILIO_ACCOUNT_SID_PARAM_NAME = os.environ['TWILIO_ACCOUNT_SID_PARAM_NAME']
+TWILIO_AUTH_TOKEN_PARAM_NAME = os.environ['TWILIO_AUTH_TOKEN_PARAM_NAME']
+SP_API_KEY_ID_PARAM_NAME = os.environ['SP_API_KEY_ID_PARAM_NAME']
+SP_API_KEY_SECRET_PARAM_NAME = os.environ['SP_API_KEY_SECRET_PARAM_NAME']
+SSM_PARAMETERS = ParameterCache([
+    TWILIO_ACCOUNT_SID_PARAM_NAME,
+    TWILIO_AUTH_TOKEN_PARAM_NAME,
+    SP_API_KEY_ID_PARAM_NAME,
+    SP_API_KEY_SECRET_PARAM_NAME,
+])
+
+# the twilio client is only needed to send messages, so it's built on first use (see get_twilio_client)
+TWILIO_CLIENT = None
+# outgoing messages are cleaned up (markdown, smart quotes, etc.) and split to use as few billed segments as possible
+# (see sms_encoding.py). with SMS_STRIP_EMOJI set, emoji are also removed from model responses so they can be sent
+# as GSM-7 (160 characters per segment) instead of UCS-2 (70 characters per segment)
+SMS_STRIP_EMOJI = os.environ.get('SMS_STRIP_EMOJI', '').lower() in ['1', 'true', 'yes']
+SMS_STATS = Counters('messages', 'segments', 'segments_before_encoding')
+
+
+# SP_BASE_URL can point the handler at a local stand-in for the API (see benchmark/load_test.py)
+SP_BASE_URL = os.environ.get('SP_BASE_URL', 'https://api.superpowered.ai/v1')
+# created once per Lambda container so warm invocations reuse the open connections to the API
+# the credentials are set at the start of each invocation (see load_credentials)
+SP_CLIENT = SuperpoweredClient(SP_BASE_URL, auth=None)
+
+# phone number -> thread id and thread id -> thread settings, so most messages don't have to look the thread up.
+# THREAD_CACHE_STORE adds a persistent tier shared by all containers, i.e. "dynamodb:table-name" or
+# "sqlite:/tmp/thread_cache.sqlite" (see kv_store.py). every helper below that changes a thread updates the cache
+THREAD_CACHE = ThreadCache(store=create_kv_store(os.environ.get('THREAD_CACHE_STORE', '')))
+
+# validated webhooks are put on this queue and answered by the worker (see worker_handler), so the webhook itself is
+# acknowledged right away. i.e. "sqs:https://sqs...", "sqlite:/tmp/queue.sqlite" or "memory" (see job_queue.py).
+# if it's not set, lambda_handler answers the message itself before returning
+WORK_QUEUE = create_queue(os.environ.get('WORK_QUEUE', ''))
+
+# webhooks and queue messages can be delivered more than once, so each MessageSid is only answered once, and only one
+# message per phone number at a time gets to create (or reset) a chat thread. IDEMPOTENCY_STORE has to be shared by
+# every worker to catch all duplicates, i.e. "dynamodb:table-name" (see kv_store.py). "memory" only works per container
+IDEMPOTENCY_STORE = create_kv_store(os.environ.get('IDEMPOTENCY_STORE', 'memory'))
+MESSAGE_DEDUPLICATOR = MessageDeduplicator(IDEMPOTENCY_STORE)
+PHONE_NUMBER_LOCK = PhoneNumberLock(IDEMPOTENCY_STORE)
+
+# with COALESCE_WINDOW_SECONDS set, messages from the same number that arrive within that many seconds of each other
+# are answered together (see coalesce.py), and answers to the same number are sent one at a time, in order
+COALESCER = MessageCoalescer(IDEMPOTENCY_STORE) if COALESCE_WINDOW_SECONDS > 0 else None
+ANSWER_LOCK = PhoneNumberLock(IDEMPOTENCY_STORE, ttl_seconds=MESSAGE_CLAIM_TTL_SECONDS, prefix='answer-lock')
+# messages starting with one of these are commands (see get_help_message) and are never merged with other messages
+COMMAND_PREFIXES = ('/', u'\U00002753', u'\U00002754', u'\U0000274C', u'\U00002699', u'\U0001F4C5', u'\U0001F525')
+
+# chat jobs are polled with backoff instead of back to back, and given up on well before the Lambda times out (120s)
+CHAT_RESPONSE_DEADLINE_SECONDS = float(os.environ.get('CHAT_RESPONSE_DEADLINE_SECONDS', '90'))
+# time left at the end of the invocation for sending the SMS
+RESPONSE_SEND_MARGIN_SECONDS = 10
+CHAT_JOB_POLLER = JobPoller(initial_interval=0.5, max_interval=3.0, deadline_seconds=CHAT_RESPONSE_DEADLINE_SECONDS)
+STILL_THINKING_MESSAGE = "I'm still thinking about that one. Please try again in a minute or two."
+
+# with ANSWER_CACHE_MAX_TTL_SECONDS set, answers to standalone questions are reused for a few minutes for anyone who
+# asks the same question with the same thread settings (see answer_cache.py). ANSWER_CACHE_STORE shares them between
+# containers, i.e. "dynamodb:table-name"
+ANSWER_CACHE = AnswerCache(store=create_kv_store(os.environ.get('ANSWER_CACHE_STORE', ''))) if ANSWER_CACHE_MAX_TTL_SECONDS > 0 else None
+
+
+# time spent in each stage of answering a message, logged as one structured line per message (see tracing.py).
+# METRICS_MODE=off turns it off
+TRACER = Tracer()
 
 
 CHAT_SYSTEM_MESSAGE = """\
@@ -73,62 +126,137 @@ def create_chat_thread(phone_number: str, web_search_timeframe_days: int = None,
         payload['default_options']['web_search_config'] = {
             'timeframe_days': web_search_timeframe_days
         }
-    resp = requests.post(
-        url=f'{SP_BASE_URL}/chat/threads',
-        json=payload,
-        auth=SP_AUTH
+    resp = SP_CLIENT.post(
+        'chat/threads',
+        name='create_chat_thread',
+        json=payload
     )
     if not resp.ok:
         raise Exception(f'Error creating superpowered chat thread: {resp.text}')
 
-    return resp.json()['id']
+    thread = resp.json()
+    THREAD_CACHE.set_thread_id(phone_number, thread['id'])
+    if 'default_options' in thread:
+        THREAD_CACHE.set_thread(thread)
+    return thread['id']
 
 
 def get_chat_thread_by_phone_number(phone_number: str) -> str:
     # NOTE: THIS ASSUMES THERE IS ONLY ONE THREAD PER PHONE NUMBER
-    resp = requests.get(
-        url=f'{SP_BASE_URL}/chat/threads',
-        params={'supp_id': phone_number},
-        auth=SP_AUTH
+    thread_id = THREAD_CACHE.get_thread_id(phone_number)
+    if thread_id:
+        return thread_id
+
+    resp = SP_CLIENT.get(
+        'chat/threads',
+        name='get_chat_thread_by_phone_number',
+        params={'supp_id': phone_number}
     )
     if not resp.ok:
         raise Exception(f'Error getting superpowered chat thread by phone number: {resp.text}')
 
-    return resp.json()['chat_threads'][0]['id'] if resp.json()['chat_threads'] else None
+    if not resp.json()['chat_threads']:
+        return None
+    thread = resp.json()['chat_threads'][0]
+    THREAD_CACHE.set_thread_id(phone_number, thread['id'])
+    THREAD_CACHE.set_thread(thread)
+    return thread['id']
+
+
+def get_chat_job_status(status_url: str) -> dict:
+    resp = SP_CLIENT.get(
+        status_url,
+        name='poll_chat_job'
+    )
+    if not resp.ok:
+        raise Exception(f'Error getting superpowered chat response: {resp.text}')
+
+    return resp.json()
 
 
-def get_chat_response(thread_id: str, user_input: str) -> str:
+def get_chat_response(thread_id: str, user_input: str, deadline_seconds: float = None) -> str:
     # get the response from the chat thread
     # this will first create a chat job and then wait for it to complete
+    # raises JobDeadlineExceeded if it isn't complete after `deadline_seconds`
     payload = {
         'input': user_input,
         'async': True
     }
-    resp = requests.post(
-        url=f'{SP_BASE_URL}/chat/threads/{thread_id}/get_response',
-        json=payload,
-        auth=SP_AUTH
-    )
+    with TRACER.span('chat_submit'):
+        resp = SP_CLIENT.post(
+            f'chat/threads/{thread_id}/get_response',
+            name='create_chat_job',
+            json=payload
+        )
+    if resp.status_code == 404:
+        raise ChatThreadNotFound(thread_id)
     if not resp.ok:
         raise Exception(f'Error getting superpowered chat response: {resp.text}')
 
-    while resp.json()['status'] not in ['COMPLETE', 'FAILED']:
-        resp = requests.get(
-            url=resp.json()['status_url'],
-            auth=SP_AUTH
-        )
-        if not resp.ok:
-            raise Exception(f'Error getting superpowered chat response: {resp.text}')
+    with TRACER.span('chat_poll'):
+        job = CHAT_JOB_POLLER.poll(resp.json(), get_chat_job_status, deadline_seconds=deadline_seconds)
+    return job['response']
 
-    return resp.json()['response']
 
+def get_chat_answer(thread_id: str, user_input: str, deadline_seconds: float = None) -> str:
+    # the model's answer to `user_input`, from the answer cache if the same question was asked recently
+    if ANSWER_CACHE is None:
+        model_response = get_chat_response(thread_id=thread_id, user_input=user_input, deadline_seconds=deadline_seconds)
+        return model_response['interaction']['model_response']['content']
 
-def send_twilio_response(to: str, from_: str, body: str):
-    return TWILIO_CLIENT.messages.create(
-        to=to,
-        from_=from_,
-        body=body
+    with TRACER.span('answer_cache_lookup'):
+        thread = get_chat_thread(thread_id)
+        cache_key = ANSWER_CACHE.key_for(user_input, thread)
+        answer = ANSWER_CACHE.get(cache_key) if cache_key else None
+    if answer is not None:
+        ANSWER_CACHE.remember_served(thread_id, user_input, answer)
+        return answer
+
+    model_response = get_chat_response(
+        thread_id=thread_id,
+        user_input=with_served_exchanges(user_input, ANSWER_CACHE.take_served(thread_id)),
+        deadline_seconds=deadline_seconds
     )
+    answer = model_response['interaction']['model_response']['content']
+    if cache_key:
+        ANSWER_CACHE.set(cache_key, answer, thread)
+    return answer
+
+
+def load_credentials() -> dict:
+    # returns the (cached) SSM parameters and makes sure the superpowered client uses the current API key
+    parameters = SSM_PARAMETERS.get_all()
+    SP_CLIENT.set_auth((parameters[SP_API_KEY_ID_PARAM_NAME], parameters[SP_API_KEY_SECRET_PARAM_NAME]))
+    return parameters
+
+
+def get_twilio_client():
+    # twilio.rest is by far the slowest import in this function, so it's only imported when a message is sent.
+    # the client is rebuilt if the credentials changed since it was created
+    global TWILIO_CLIENT
+    parameters = SSM_PARAMETERS.get_all()
+    credentials = (parameters[TWILIO_ACCOUNT_SID_PARAM_NAME], parameters[TWILIO_AUTH_TOKEN_PARAM_NAME])
+    if TWILIO_CLIENT is None or (TWILIO_CLIENT.username, TWILIO_CLIENT.password) != credentials:
+        from twilio.rest import Client
+        TWILIO_CLIENT = Client(*credentials)
+    return TWILIO_CLIENT
+
+
+def send_twilio_response(to: str, from_: str, body: str):
+    encoded = encode_sms(body)
+    with TRACER.span('twilio_send'):
+        messages = [
+            get_twilio_client().messages.create(
+                to=to,
+                from_=from_,
+                body=message
+            )
+            for message in encoded['messages']
+        ]
+    SMS_STATS.increment('messages', len(messages))
+    SMS_STATS.increment('segments', encoded['segments'])
+    SMS_STATS.increment('segments_before_encoding', encoded['segments_before'])
+    return messages
 
 
 def get_help_message():
@@ -151,63 +279,84 @@ Available commands:
 """
 
 
-def delete_chat_thread(thread_id: str):
+def delete_chat_thread(thread_id: str, phone_number: str = None):
     # reset the chat thread
-    resp = requests.delete(
-        url=f'{SP_BASE_URL}/chat/threads/{thread_id}',
-        auth=SP_AUTH
+    resp = SP_CLIENT.delete(
+        f'chat/threads/{thread_id}',
+        name='delete_chat_thread'
     )
-    if not resp.ok:
+    THREAD_CACHE.invalidate_thread(thread_id, phone_number)
+    # a thread that's already gone doesn't need resetting
+    if not resp.ok and resp.status_code != 404:
         raise Exception(f'Error resetting superpowered chat thread: {resp.text}')
     
 
 def get_chat_thread(thread_id: str):
-    resp = requests.get(
-        url=f'{SP_BASE_URL}/chat/threads/{thread_id}',
-        auth=SP_AUTH
+    thread = THREAD_CACHE.get_thread(thread_id)
+    if thread:
+        return thread
+
+    resp = SP_CLIENT.get(
+        f'chat/threads/{thread_id}',
+        name='get_chat_thread'
     )
+    if resp.status_code == 404:
+        raise ChatThreadNotFound(thread_id)
     if not resp.ok:
         raise Exception(f'Error getting superpowered chat thread settings: {resp.text}')
 
+    THREAD_CACHE.set_thread(resp.json())
     return resp.json()
 
 
 def update_chat_thread_web_search_timeframe(thread_id: str, timeframe_days: int):
-    resp = requests.patch(
-        url=f'{SP_BASE_URL}/chat/threads/{thread_id}',
-        json={'default_options': {'web_search_config': {'timeframe_days': timeframe_days}}},
-        auth=SP_AUTH
+    resp = SP_CLIENT.patch(
+        f'chat/threads/{thread_id}',
+        name='update_chat_thread',
+        json={'default_options': {'web_search_config': {'timeframe_days': timeframe_days}}}
     )
+    THREAD_CACHE.invalidate_thread(thread_id)
+    if resp.status_code == 404:
+        raise ChatThreadNotFound(thread_id)
     if not resp.ok:
         raise Exception(f'Error updating superpowered chat thread web search timeframe: {resp.text}')
 
 
 def update_assistant_name(thread_id: str, name: str):
-    resp = requests.patch(
-        url=f'{SP_BASE_URL}/chat/threads/{thread_id}',
-        json={'title': name, 'default_options': {'system_message': CHAT_SYSTEM_MESSAGE.format(assistant_name=name)}},
-        auth=SP_AUTH
+    resp = SP_CLIENT.patch(
+        f'chat/threads/{thread_id}',
+        name='update_chat_thread',
+        json={'title': name, 'default_options': {'system_message': CHAT_SYSTEM_MESSAGE.format(assistant_name=name)}}
     )
+    THREAD_CACHE.invalidate_thread(thread_id)
+    if resp.status_code == 404:
+        raise ChatThreadNotFound(thread_id)
     if not resp.ok:
         raise Exception(f'Error updating superpowered chat thread assistant name: {resp.text}')
 
 
 def update_assistant_model(thread_id: str, model: str):
-    resp = requests.patch(
-        url=f'{SP_BASE_URL}/chat/threads/{thread_id}',
-        json={'default_options': {'model': model}},
-        auth=SP_AUTH
+    resp = SP_CLIENT.patch(
+        f'chat/threads/{thread_id}',
+        name='update_chat_thread',
+        json={'default_options': {'model': model}}
     )
+    THREAD_CACHE.invalidate_thread(thread_id)
+    if resp.status_code == 404:
+        raise ChatThreadNotFound(thread_id)
     if not resp.ok:
         raise Exception(f'Error updating superpowered chat thread assistant name: {resp.text}')
 
 
 def update_assistant_temperature(thread_id: str, temperature: float):
-    resp = requests.patch(
-        url=f'{SP_BASE_URL}/chat/threads/{thread_id}',
-        json={'default_options': {'temperature': temperature}},
-        auth=SP_AUTH
+    resp = SP_CLIENT.patch(
+        f'chat/threads/{thread_id}',
+        name='update_chat_thread',
+        json={'default_options': {'temperature': temperature}}
     )
+    THREAD_CACHE.invalidate_thread(thread_id)
+    if resp.status_code == 404:
+        raise ChatThreadNotFound(thread_id)
     if not resp.ok:
         raise Exception(f'Error updating superpowered chat thread assistant name: {resp.text}')
 
@@ -220,11 +369,10 @@ def print_unicode_representation(text):
         print(unicode_string)
 
 
-def lambda_handler(event, context):
-    ############################
-    # WEBHOOK VALIDATION
-    ############################
-    validator = RequestValidator(TWILIO_AUTH_TOKEN)
+def validate_webhook(event: dict) -> dict:
+    # returns the parsed twilio webhook, or raises if the request didn't come from twilio
+    parameters = load_credentials()
+    validator = RequestValidator(parameters[TWILIO_AUTH_TOKEN_PARAM_NAME])
 
     # parse the event body but make sure to keep empty values for webhook validation
     body = base64.b64decode(event['body']).decode('utf-8')
@@ -236,7 +384,112 @@ def lambda_handler(event, context):
 
     if not validator.validate(uri=url, params=twilio_webhook, signature=event['headers'].get('x-twilio-signature')):
         raise Exception('Not authorized to access this endpoint.')
-    
+
+    return twilio_webhook
+
+
+def handle_message(twilio_webhook: dict, context=None, received_at: float = None):
+    # everything that happens after the webhook has been validated
+    # the clients outlive the invocation, so only count the calls made for this message
+    SP_CLIENT.reset_stats()
+    CHAT_JOB_POLLER.reset_stats()
+    THREAD_CACHE.reset_stats()
+    MESSAGE_DEDUPLICATOR.reset_stats()
+    PHONE_NUMBER_LOCK.reset_stats()
+    if COALESCER is not None:
+        COALESCER.reset_stats()
+    if ANSWER_CACHE is not None:
+        ANSWER_CACHE.reset_stats()
+    SMS_STATS.reset()
+    if received_at:
+        TRACER.metric('queue_delay_ms', 1000 * (time.time() - received_at), 'Milliseconds')
+    with TRACER.span('load_credentials'):
+        load_credentials()
+
+    message_sid = twilio_webhook.get('MessageSid')
+    with TRACER.span('claim_message'):
+        claimed = not message_sid or MESSAGE_DEDUPLICATOR.claim(message_sid)
+    if not claimed:
+        # a retry of a message that's already been answered (or is being answered right now)
+        TRACER.set(command='duplicate')
+        print(json.dumps({'duplicate_message_suppressed': message_sid}))
+        return
+
+    user_phone_number = twilio_webhook['From']
+    leading = False
+    merged_sids = []
+    try:
+        if COALESCER is not None and not twilio_webhook['Body'].startswith(COMMAND_PREFIXES):
+            with TRACER.span('coalesce_wait'):
+                twilio_webhook, merged_sids = coalesce_message(twilio_webhook, received_at or time.time())
+            if twilio_webhook is None:
+                TRACER.set(command='merged')
+            if twilio_webhook is not None:
+                leading = True
+                with ANSWER_LOCK.hold(user_phone_number, wait_seconds=MESSAGE_CLAIM_TTL_SECONDS / 2):
+                    respond_to_message(twilio_webhook, context)
+        else:
+            respond_to_message(twilio_webhook, context)
+    except Exception:
+        # let the retry answer it, together with the messages that were merged into this one
+        if leading:
+            COALESCER.put_back(user_phone_number, message_sid)
+        for sid in [message_sid] + merged_sids:
+            if sid:
+                MESSAGE_DEDUPLICATOR.release(sid)
+        raise
+    # a merged message stays claimed until the message it was merged into has been answered
+    if message_sid and twilio_webhook is not None:
+        MESSAGE_DEDUPLICATOR.done(message_sid)
+    for sid in merged_sids:
+        MESSAGE_DEDUPLICATOR.done(sid)
+    if leading:
+        COALESCER.finish(user_phone_number, message_sid)
+    TRACER.metric('chat_job_polls', CHAT_JOB_POLLER.stats().get('polls', 0))
+    TRACER.metric('sms_segments', SMS_STATS.stats()['segments'])
+
+    # per-call timings, chat job polling, cache hits and duplicates for this message (shows up in CloudWatch logs)
+    print(json.dumps({
+        'superpowered_api_timings': SP_CLIENT.stats(),
+        'chat_job_polling': CHAT_JOB_POLLER.stats(),
+        'thread_cache': THREAD_CACHE.stats(),
+        'message_dedup': MESSAGE_DEDUPLICATOR.stats(),
+        'phone_number_lock': PHONE_NUMBER_LOCK.stats(),
+        'coalescing': COALESCER.stats() if COALESCER is not None else None,
+        'answer_cache': ANSWER_CACHE.stats() if ANSWER_CACHE is not None else None,
+        'sms': SMS_STATS.stats(),
+        'seconds_since_received': round(time.time() - received_at, 3) if received_at else None,
+    }))
+
+
+def coalesce_message(twilio_webhook: dict, received_at: float) -> tuple:
+    # returns the webhook to answer, with the bodies of all the messages that were merged into it, and the MessageSids
+    # of those other messages. the webhook is None if this message was merged into another message that will be
+    # answered instead
+    user_phone_number = twilio_webhook['From']
+    message_sid = twilio_webhook.get('MessageSid')
+    if not COALESCER.add(user_phone_number, message_sid, twilio_webhook['Body'], received_at):
+        return None, []
+    messages = COALESCER.wait_and_take(user_phone_number)
+    if not messages:
+        return twilio_webhook, []
+    merged_sids = [message['sid'] for message in messages if message['sid'] and message['sid'] != message_sid]
+    return dict(twilio_webhook, Body='\n'.join(message['body'] for message in messages)), merged_sids
+
+
+def respond_to_message(twilio_webhook: dict, context=None):
+    # a cached thread id can point to a thread that was deleted since (from another container, or the dashboard). the
+    # API returns a 404 for it, so the cached entries are dropped and the message is handled again with a fresh lookup
+    try:
+        act_on_message(twilio_webhook, context)
+    except ChatThreadNotFound as e:
+        print(e)
+        THREAD_CACHE.invalidate_thread(e.thread_id, twilio_webhook['From'])
+        act_on_message(twilio_webhook, context)
+
+
+def act_on_message(twilio_webhook: dict, context=None):
+    # look up the thread, act on the message and reply
     ############################⚙️
     # WEBHOOK HANDLING
     ############################
@@ -247,18 +500,23 @@ def lambda_handler(event, context):
     ############################
     # GET OR CREATE CHAT THREAD
     ############################
-    thread_id = get_chat_thread_by_phone_number(user_phone_number)
+    with TRACER.span('thread_lookup'):
+        thread_id = get_chat_thread_by_phone_number(user_phone_number)
     if not thread_id:
-        # create a chat thread for this user
-        thread_id = create_chat_thread(user_phone_number)
-        # send an initial message to the user
-        sms_response = f'Hello! You can view/adjust settings via keywords and emojis.\n\n'
-        sms_response += get_help_message()
-        send_twilio_response(
-            to=user_phone_number,
-            from_=twilio_phone_number,
-            body=sms_response
-        )
+        # the first few messages from a new number can arrive at the same time, and only one of them should create a thread
+        with TRACER.span('thread_create'), PHONE_NUMBER_LOCK.hold(user_phone_number):
+            thread_id = get_chat_thread_by_phone_number(user_phone_number)
+            if not thread_id:
+                # create a chat thread for this user
+                thread_id = create_chat_thread(user_phone_number)
+                # send an initial message to the user
+                sms_response = f'Hello! You can view/adjust settings via keywords and emojis.\n\n'
+                sms_response += get_help_message()
+                send_twilio_response(
+                    to=user_phone_number,
+                    from_=twilio_phone_number,
+                    body=sms_response
+                )
 
     ############################
     # DEPENDING ON POSSIBLE FIRST WORD,
@@ -276,10 +534,12 @@ def lambda_handler(event, context):
 
     ### HELP
     if first_word in [u'/help', u'\U00002753', u'\U00002754']:
+        TRACER.set(command='help')
         # send help message
         sms_response = get_help_message()
     ### CLEAR
     elif first_word in [u'/clear', u'\U0000274C']:
+        TRACER.set(command='clear')
         # reset the chat thread
         thread = get_chat_thread(thread_id)
         assistant_name = thread['title']
@@ -287,34 +547,43 @@ def lambda_handler(event, context):
             assistant_name = assistant_name[1]
         else:
             assistant_name = 'Alfred'
-        delete_chat_thread(thread_id)
-        thread_id = create_chat_thread(user_phone_number, assistant_name=assistant_name)
+        with TRACER.span('thread_reset'), PHONE_NUMBER_LOCK.hold(user_phone_number):
+            delete_chat_thread(thread_id, user_phone_number)
+            thread_id = create_chat_thread(user_phone_number, assistant_name=assistant_name)
         sms_response = 'Conversation settings have been reset to defaults.'
     ### VIEW SETTINGS
     elif first_word == u'/settings' or first_char == u'\U00002699':
+        TRACER.set(command='settings')
         thread = get_chat_thread(thread_id)
         chat_thread_defaults = thread['default_options']
         assistant_name = thread.get('title', 'Alfred')
         sms_response = f"**name**: {assistant_name}\n**model**: {chat_thread_defaults['model']}\n**web search timeframe**: {chat_thread_defaults['web_search_config']['timeframe_days'] if chat_thread_defaults['web_search_config'] else 'all time'}\n**temperature**: {round(chat_thread_defaults['temperature'], 2)}"
     ### SET TIMEFRAME DAYS
     elif first_word in [u'/timeframe', u'\U0001F4C5']:
+        TRACER.set(command='timeframe')
         try:
             timeframe_days = int(words[1])
             update_chat_thread_web_search_timeframe(thread_id, timeframe_days)
             sms_response = f'Web search timeframe set to {timeframe_days} days.'
+        except ChatThreadNotFound:
+            raise
         except:
             sms_response = 'Invalid timeframe. Please use a number.'
     ### SET ASSISTANT NAME
     elif first_word in [u'/name']:
+        TRACER.set(command='name')
         try:
             assistant_name = words[1]
             update_assistant_name(thread_id, assistant_name)
             sms_response = f'Assistant name set to {assistant_name}.'
+        except ChatThreadNotFound:
+            raise
         except Exception as e:
             print(e)
             sms_response = 'Invalid input. Please specify the new name like "/name Alfred".'
     ### SET MODEL
     elif first_word in [u'/model']:
+        TRACER.set(command='model')
         try:
             model = words[1].lower()
             if model not in ['gpt-3.5-turbo', 'claude-3-haiku', 'mixtral']:
@@ -322,29 +591,45 @@ def lambda_handler(event, context):
             else:
                 update_assistant_model(thread_id, model)
                 sms_response = f'Assistant model set to {model}.'
+        except ChatThreadNotFound:
+            raise
         except Exception as e:
             print(e)
             sms_response = 'Invalid model. Must be one of "gpt-3.5-turbo", "claude-3-haiku", "mixtral".'
     ### SET TEMPERATURE
     elif first_word in [u'/temperature', u'\U0001F525']:
+        TRACER.set(command='temperature')
         try:
             temperature = float(words[1])
             update_assistant_temperature(thread_id, temperature)
             sms_response = f'Assistant temperature set to {temperature}.'
+        except ChatThreadNotFound:
+            raise
         except Exception as e:
             print(e)
             sms_response = 'Invalid input. Please specify the new temperature like "/temperature 0.5".'
     ### SEND NORMAL SP RESPONSE
     else:
+        TRACER.set(command='chat')
         ############################
         # GET API RESPONSE FROM SUPERPOWERED API
         ############################
         # get the response from the model
-        model_response = get_chat_response(
-            thread_id=thread_id, 
-            user_input=twilio_webhook['Body']
-        )
-        sms_response = model_response['interaction']['model_response']['content']
+        # leave enough time to send a fallback message if the response takes too long
+        deadline_seconds = CHAT_RESPONSE_DEADLINE_SECONDS
+        if context is not None:
+            deadline_seconds = min(deadline_seconds, context.get_remaining_time_in_millis() / 1000 - RESPONSE_SEND_MARGIN_SECONDS)
+        try:
+            sms_response = get_chat_answer(
+                thread_id=thread_id, 
+                user_input=twilio_webhook['Body'],
+                deadline_seconds=deadline_seconds
+            )
+            if SMS_STRIP_EMOJI:
+                sms_response = strip_emoji(sms_response)
+        except JobDeadlineExceeded as e:
+            print(e)
+            sms_response = STILL_THINKING_MESSAGE
 
     ############################
     # SEND RESPONSE BACK TO USER VIA TWILIO
@@ -355,7 +640,57 @@ def lambda_handler(event, context):
         body=sms_response
     )
 
+
+def lambda_handler(event, context):
+    with TRACER.trace(function='webhook'):
+        ############################
+        # WEBHOOK VALIDATION
+        ############################
+        with TRACER.span('validate_webhook'):
+            twilio_webhook = validate_webhook(event)
+
+        ############################
+        # HAND OFF TO THE WORKER
+        ############################
+        # twilio gives up on (and retries) webhooks that take too long, so the message is queued and answered by the worker
+        if WORK_QUEUE is not None:
+            TRACER.set(command='queued')
+            with TRACER.span('enqueue'):
+                WORK_QUEUE.send({'webhook': twilio_webhook, 'received_at': time.time()})
+        else:
+            handle_message(twilio_webhook, context)
+
     return {
         'statusCode': 200,
         'body': json.dumps('OK')
     }
+
+
+def worker_handler(event, context):
+    # triggered by the SQS work queue. failed messages are reported back so only they get retried
+    # (see ReportBatchItemFailures in resources.yaml)
+    batch_item_failures = []
+    for record in event['Records']:
+        try:
+            message = json.loads(record['body'])
+            with TRACER.trace(function='worker'):
+                handle_message(message['webhook'], context, received_at=message.get('received_at'))
+        except Exception as e:
+            print(f'Error handling message {record["messageId"]}: {e}')
+            batch_item_failures.append({'itemIdentifier': record['messageId']})
+
+    return {'batchItemFailures': batch_item_failures}
+
+
+def run_worker(queue, stop_event, wait_seconds: float = 1.0):
+    # local equivalent of the SQS trigger: answers messages from `queue` until `stop_event` is set.
+    # messages that fail are left on the queue, so a SqliteQueue delivers them again after its visibility timeout
+    while not stop_event.is_set():
+        for receipt, message in queue.receive(max_messages=1, wait_seconds=wait_seconds):
+            try:
+                with TRACER.trace(function='worker'):
+                    handle_message(message['webhook'], received_at=message.get('received_at'))
+            except Exception as e:
+                print(f'Error handling message: {e}')
+                continue
+            queue.delete(receipt)
@@ -0,0 +1,198 @@
+import re
+import unicodedata
+
+
+# https://www.twilio.com/docs/glossary/what-is-gsm-7-character-encoding
+GSM7_BASIC_CHARS = set(
+    '@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !"#¤%&\'()*+,-./0123456789:;<=>?'
+    '¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà'
+)
+# these take two septets (an escape character and the character itself)
+GSM7_EXTENSION_CHARS = set('^{}\\[~]|€')
+
+# single segment messages get the full capacity, each part of a concatenated message loses some to the header
+GSM7_SINGLE_SEGMENT = 160
+GSM7_MULTI_SEGMENT = 153
+UCS2_SINGLE_SEGMENT = 70
+UCS2_MULTI_SEGMENT = 67
+# twilio rejects message bodies longer than this
+MAX_MESSAGE_CHARS = 1600
+# sent instead of an empty reply, which twilio would reject
+EMPTY_REPLY_MESSAGE = "Sorry, I don't have an answer to that. Please try asking in a different way."
+
+# replacements that don't change the meaning of the text, for characters that would otherwise force UCS-2
+TRANSLITERATIONS = {
+    '‘': "'", '’': "'", '‚': "'", '‛': "'", '′': "'", '´': "'", '`': "'",
+    '“': '"', '”': '"', '„': '"', '‟': '"', '″': '"', '«': '"', '»': '"',
+    '‐': '-', '‑': '-', '‒': '-', '–': '-', '—': '-', '―': '-', '−': '-',
+    '•': '-', '·': '-', '●': '-', '▪': '-', '‣': '-', '⁃': '-',
+    '…': '...', '\u00a0': ' ', '\u2009': ' ', '\u202f': ' ', '\u200b': '', '\ufeff': '',
+    '×': 'x', '→': '->', '←': '<-', '≤': '<=', '≥': '>=', '≠': '!=',
+    '©': '(c)', '®': '(R)', '™': 'TM', '°': ' deg', '½': '1/2', '¼': '1/4', '¾': '3/4',
+}
+
+MARKDOWN_LINK_RE = re.compile(r'\[([^\]]+)\]\((\S+?)\)')
+MARKDOWN_BOLD_RE = re.compile(r'(\*\*|__)(?=\S)(.+?)(?<=\S)\1')
+MARKDOWN_ITALIC_RE = re.compile(r'(?<![\w*])\*(?=\S)([^*\n]+?)(?<=\S)\*(?![\w*])')
+MARKDOWN_CODE_FENCE_RE = re.compile(r'^```[^\n]*\n?', re.MULTILINE)
+MARKDOWN_INLINE_CODE_RE = re.compile(r'`([^`\n]+)`')
+MARKDOWN_HEADER_RE = re.compile(r'^[ \t]*#{1,6}[ \t]+', re.MULTILINE)
+MARKDOWN_BULLET_RE = re.compile(r'^([ \t]*)[*+][ \t]+', re.MULTILINE)
+TRAILING_WHITESPACE_RE = re.compile(r'[ \t]+$', re.MULTILINE)
+BLANK_LINES_RE = re.compile(r'\n{3,}')
+# pictographs, dingbats, flags, variation selectors and zero width joiners
+EMOJI_RE = re.compile('[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\uFE0E\uFE0F\u200D\u20E3]')
+
+# where long messages get split, from most to least natural
+SPLIT_SEPARATORS = ['\n\n', '\n', '. ', '? ', '! ', '; ', ', ', ' ']
+
+
+def strip_markdown(text: str) -> str:
+    # phones show markdown literally, so **bold** just costs four extra characters
+    text = MARKDOWN_LINK_RE.sub(lambda m: m.group(2) if m.group(1) == m.group(2) else f'{m.group(1)} ({m.group(2)})', text)
+    text = MARKDOWN_CODE_FENCE_RE.sub('', text)
+    text = MARKDOWN_INLINE_CODE_RE.sub(r'\1', text)
+    text = MARKDOWN_BOLD_RE.sub(r'\2', text)
+    text = MARKDOWN_ITALIC_RE.sub(r'\1', text)
+    text = MARKDOWN_HEADER_RE.sub('', text)
+    text = MARKDOWN_BULLET_RE.sub(r'\1- ', text)
+    text = TRAILING_WHITESPACE_RE.sub('', text)
+    return BLANK_LINES_RE.sub('\n\n', text).strip()
+
+
+def strip_emoji(text: str) -> str:
+    text = EMOJI_RE.sub('', text)
+    return re.sub(r'[ \t]{2,}', ' ', text)
+
+
+def is_gsm7(text: str) -> bool:
+    return all(char in GSM7_BASIC_CHARS or char in GSM7_EXTENSION_CHARS for char in text)
+
+
+def transliterate(text: str) -> str:
+    # replaces characters outside of GSM-7 with GSM-7 equivalents where that's safe (punctuation, spaces, accented
+    # latin letters). anything else (i.e. emoji or non-latin scripts) is left as is, and the message will be sent as UCS-2
+    chars = []
+    for char in text:
+        if char in GSM7_BASIC_CHARS or char in GSM7_EXTENSION_CHARS:
+            chars.append(char)
+        elif char in TRANSLITERATIONS:
+            chars.append(TRANSLITERATIONS[char])
+        else:
+            decomposed = unicodedata.normalize('NFKD', char)
+            base = ''.join(c for c in decomposed if not unicodedata.combining(c))
+            chars.append(base if base and is_gsm7(base) else char)
+    return ''.join(chars)
+
+
+def char_units(char: str, encoding: str) -> int:
+    # septets for GSM-7, UTF-16 code units for UCS-2
+    if encoding == 'GSM-7':
+        return 2 if char in GSM7_EXTENSION_CHARS else 1
+    return 2 if ord(char) > 0xFFFF else 1
+
+
+def text_units(text: str, encoding: str) -> int:
+    return sum(char_units(char, encoding) for char in text)
+
+
+def count_segments(text: str) -> dict:
+    # the number of segments twilio bills for `text` sent as one message. a character that takes two units is never
+    # split across segments, so this packs characters one by one instead of just dividing by the segment size
+    encoding = 'GSM-7' if is_gsm7(text) else 'UCS-2'
+    single, multi = (GSM7_SINGLE_SEGMENT, GSM7_MULTI_SEGMENT) if encoding == 'GSM-7' else (UCS2_SINGLE_SEGMENT, UCS2_MULTI_SEGMENT)
+    units = text_units(text, encoding)
+    if units <= single:
+        return {'encoding': encoding, 'segments': 1 if text else 0, 'units': units}
+
+    segments, used = 1, 0
+    for char in text:
+        n = char_units(char, encoding)
+        if used + n > multi:
+            segments += 1
+            used = 0
+        used += n
+    return {'encoding': encoding, 'segments': segments, 'units': units}
+
+
+def split_text(text: str, max_units: int, encoding: str, separators: list = SPLIT_SEPARATORS) -> list:
+    # splits `text` into as few chunks of at most `max_units` as possible, preferring the most natural separator
+    if text_units(text, encoding) <= max_units:
+        return [text]
+    if not separators:
+        # no natural boundary left, so cut wherever the chunk is full
+        chunks, chunk, used = [], '', 0
+        for char in text:
+            n = char_units(char, encoding)
+            if used + n > max_units:
+                chunks.append(chunk)
+                chunk, used = '', 0
+            chunk += char
+            used += n
+        return chunks + [chunk] if chunk else chunks
+
+    separator, rest = separators[0], separators[1:]
+    pieces = text.split(separator)
+    # keep the separator's punctuation with the sentence it ends
+    keep = separator.rstrip()
+    pieces = [piece + keep if keep and i < len(pieces) - 1 else piece for i, piece in enumerate(pieces)]
+    joiner = '\n\n' if separator == '\n\n' else ('\n' if separator == '\n' else ' ')
+
+    chunks, chunk = [], ''
+    for piece in pieces:
+        for part in split_text(piece, max_units, encoding, rest):
+            candidate = f'{chunk}{joiner}{part}' if chunk else part
+            if text_units(candidate, encoding) <= max_units:
+                chunk = candidate
+            else:
+                if chunk:
+                    chunks.append(chunk)
+                chunk = part
+    if chunk:
+        chunks.append(chunk)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+def total_segments(messages: list) -> int:
+    return sum(count_segments(message)['segments'] for message in messages)
+
+
+def plan_messages(text: str) -> list:
+    # the text is sent as one message (the phone joins its segments back together) unless it's longer than twilio
+    # allows. then it's split at the most natural boundaries, and each part is numbered ("1/3 ") so the user can tell
+    # the parts belong together if they arrive out of order
+    if not text.strip():
+        return [EMPTY_REPLY_MESSAGE]
+    if len(text) <= MAX_MESSAGE_CHARS:
+        return [text]
+
+    encoding = 'GSM-7' if is_gsm7(text) else 'UCS-2'
+    num_parts = 2
+    while True:
+        # room for the longest prefix, i.e. "10/12 ". if the text needs more parts than that allows, try again with
+        # the longer prefix
+        prefix_units = len(f'{num_parts}/{num_parts} ')
+        parts = split_text(text, MAX_MESSAGE_CHARS - prefix_units, encoding)
+        if len(f'{len(parts)}/{len(parts)} ') <= prefix_units:
+            return [f'{i}/{len(parts)} {part}' for i, part in enumerate(parts, start=1)]
+        num_parts = len(parts)
+
+
+def encode_sms(text: str, remove_emoji: bool = False) -> dict:
+    # the outbound encoding stage: cleans up the text, picks the encoding and plans the messages.
+    # returns the messages to send plus before/after segment counts for logging
+    before = count_segments(text)
+    cleaned = strip_markdown(text)
+    if remove_emoji:
+        cleaned = strip_emoji(cleaned)
+    cleaned = transliterate(cleaned)
+    if not cleaned.strip():
+        # i.e. a reply that was only emoji or markdown. send it as it was rather than an empty message
+        cleaned = text.strip()
+    messages = plan_messages(cleaned)
+    return {
+        'messages': messages,
+        'encoding': 'GSM-7' if is_gsm7(cleaned) else 'UCS-2',
+        'segments': total_segments(messages),
+        'segments_before': before['segments'],
+    }
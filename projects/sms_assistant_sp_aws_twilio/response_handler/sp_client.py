@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# (connect, read) timeouts in seconds. the read timeout only has to cover a single request since chat responses are
+# polled with `async: True`
+SP_CONNECT_TIMEOUT = float(os.environ.get('SP_CONNECT_TIMEOUT', '3.05'))
+SP_READ_TIMEOUT = float(os.environ.get('SP_READ_TIMEOUT', '20'))
+SP_MAX_RETRIES = int(os.environ.get('SP_MAX_RETRIES', '3'))
+SP_POOL_SIZE = int(os.environ.get('SP_POOL_SIZE', '10'))
+
+# only these get retried automatically - a retried POST could create a second chat thread or chat job.
+# PATCH is included because every PATCH we send sets fields to fixed values
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'PATCH', 'DELETE'])
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+
+class SuperpoweredClient:
+    """
+    Thin wrapper around a `requests.Session` for the Superpowered API. The session keeps connections to the API open,
+    so when the client is created at module level it's reused by every call in an invocation and by every warm Lambda
+    invocation after that, instead of paying for a new TCP + TLS handshake on each request. Idempotent requests are
+    retried with backoff on connection errors and 429/5xx responses, and every call is timed by name so the per-call
+    latency can be logged at the end of an invocation.
+    """
+    def __init__(self, base_url: str, auth: tuple = None, connect_timeout: float = SP_CONNECT_TIMEOUT,
+                 read_timeout: float = SP_READ_TIMEOUT, max_retries: int = SP_MAX_RETRIES, pool_size: int = SP_POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.auth = auth
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=0.5,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=IDEMPOTENT_METHODS,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.lock = threading.Lock()
+        self.timings = {}
+
+    def request(self, method: str, url: str, name: str = None, **kwargs) -> requests.Response:
+        # `url` can be a path relative to the base url or a full url (i.e. a `status_url` returned by the API)
+        if not url.startswith('http'):
+            url = f'{self.base_url}/{url.lstrip("/")}'
+        kwargs.setdefault('timeout', self.timeout)
+        start_time = time.perf_counter()
+        try:
+            resp = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self.record(name or method, time.perf_counter() - start_time, error=True)
+            raise
+        self.record(name or method, time.perf_counter() - start_time, error=not resp.ok)
+        return resp
+
+    def set_auth(self, auth: tuple):
+        self.session.auth = auth
+
+    def get(self, url: str, name: str = None, **kwargs) -> requests.Response:
+        return self.request('GET', url, name=name, **kwargs)
+
+    def post(self, url: str, name: str = None, **kwargs) -> requests.Response:
+        return self.request('POST', url, name=name, **kwargs)
+
+    def patch(self, url: str, name: str = None, **kwargs) -> requests.Response:
+        return self.request('PATCH', url, name=name, **kwargs)
+
+    def delete(self, url: str, name: str = None, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, name=name, **kwargs)
+
+    def record(self, name: str, seconds: float, error: bool = False):
+        with self.lock:
+            timing = self.timings.setdefault(name, {'calls': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            timing['calls'] += 1
+            timing['errors'] += int(error)
+            timing['total_seconds'] += seconds
+            timing['max_seconds'] = max(timing['max_seconds'], seconds)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                name: {
+                    'calls': timing['calls'],
+                    'errors': timing['errors'],
+                    'total_ms': round(1000 * timing['total_seconds'], 1),
+                    'mean_ms': round(1000 * timing['total_seconds'] / timing['calls'], 1),
+                    'max_ms': round(1000 * timing['max_seconds'], 1),
+                }
+                for name, timing in self.timings.items()
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.timings = {}
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,62 @@
+import os
+import threading
+import time
+
+
+# how long fetched parameters are reused by warm invocations before they're fetched again (i.e. after a key rotation)
+SSM_PARAMETER_TTL_SECONDS = float(os.environ.get('SSM_PARAMETER_TTL_SECONDS', '300'))
+# GetParameters accepts at most 10 names per call
+SSM_MAX_NAMES_PER_CALL = 10
+
+
+def create_ssm_client():
+    # boto3 takes a noticeable part of the cold start to import, so it's only imported once parameters are needed
+    import boto3
+    return boto3.client('ssm')
+
+
+class ParameterCache:
+    """
+    Fetches a fixed set of SSM parameters with as few GetParameters calls as possible (one, for up to 10 names) and
+    keeps them in memory for `ttl_seconds`, so warm Lambda invocations don't call SSM at all. The SSM client is only
+    created on the first fetch. `fetch_count` and `fetch_seconds` track the calls that were actually made.
+    """
+    def __init__(self, names: list, ttl_seconds: float = SSM_PARAMETER_TTL_SECONDS, client_factory=create_ssm_client):
+        self.names = list(dict.fromkeys(names))
+        self.ttl_seconds = ttl_seconds
+        self.client_factory = client_factory
+        self.client = None
+        self.values = None
+        self.fetched_at = 0.0
+        self.fetch_count = 0
+        self.fetch_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def get_all(self) -> dict:
+        with self.lock:
+            if self.values is None or time.monotonic() - self.fetched_at > self.ttl_seconds:
+                self.values = self.fetch()
+                self.fetched_at = time.monotonic()
+            return self.values
+
+    def get(self, name: str) -> str:
+        return self.get_all()[name]
+
+    def fetch(self) -> dict:
+        start_time = time.perf_counter()
+        if self.client is None:
+            self.client = self.client_factory()
+        values = {}
+        for i in range(0, len(self.names), SSM_MAX_NAMES_PER_CALL):
+            resp = self.client.get_parameters(Names=self.names[i:i + SSM_MAX_NAMES_PER_CALL], WithDecryption=True)
+            self.fetch_count += 1
+            if resp.get('InvalidParameters'):
+                raise Exception(f'SSM parameters not found: {resp["InvalidParameters"]}')
+            values.update({parameter['Name']: parameter['Value'] for parameter in resp['Parameters']})
+        self.fetch_seconds += time.perf_counter() - start_time
+        return values
+
+    def invalidate(self):
+        # forces the next lookup to fetch again, i.e. after a request failed because a credential was rotated
+        with self.lock:
+            self.values = None
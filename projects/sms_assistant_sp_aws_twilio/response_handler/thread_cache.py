@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+THREAD_CACHE_MAX_ENTRIES = int(os.environ.get('THREAD_CACHE_MAX_ENTRIES', '1000'))
+# the in-process tier only lives as long as the Lambda container, the persistent tier is shared by all of them. changes
+# made by another container only reach the persistent tier, so the in-process tier is kept short to not serve them stale
+THREAD_CACHE_TTL_SECONDS = float(os.environ.get('THREAD_CACHE_TTL_SECONDS', '15'))
+THREAD_CACHE_STORE_TTL_SECONDS = float(os.environ.get('THREAD_CACHE_STORE_TTL_SECONDS', str(7 * 24 * 60 * 60)))
+
+
+class ChatThreadNotFound(Exception):
+    """
+    Raised when the API returns a 404 for a chat thread, i.e. a cached thread id for a thread that has since been
+    deleted. The cached entries for it should be invalidated and the thread looked up again.
+    """
+    def __init__(self, thread_id: str):
+        super().__init__(f'Chat thread {thread_id} not found')
+        self.thread_id = thread_id
+
+
+class LRUCache:
+    """
+    In-process cache that drops entries after `ttl_seconds` and evicts the least recently used entry once there are
+    more than `max_entries`.
+    """
+    def __init__(self, max_entries: int = THREAD_CACHE_MAX_ENTRIES, ttl_seconds: float = THREAD_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl_seconds: float = None):
+        # `ttl_seconds` overrides the cache's TTL for this entry
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + (ttl_seconds if ttl_seconds is not None else self.ttl_seconds))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class ThreadCache:
+    """
+    Two-tier cache of phone number -> chat thread id and chat thread id -> chat thread (title and default_options).
+    Lookups check the in-process LRU first, then the optional persistent store (see kv_store.py), and fill the LRU
+    from the store on a hit. Writes and invalidations go to both tiers. Errors from the persistent store are logged
+    and treated as misses so a store outage only costs the API calls the cache would have saved.
+    """
+    def __init__(self, local: LRUCache = None, store=None, store_ttl_seconds: float = THREAD_CACHE_STORE_TTL_SECONDS):
+        self.local = local if local is not None else LRUCache()
+        self.store = store
+        self.store_ttl_seconds = store_ttl_seconds
+        self.lock = threading.Lock()
+        self.counts = {'local_hits': 0, 'store_hits': 0, 'misses': 0, 'store_errors': 0}
+
+    def count(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+
+    def get(self, key: str):
+        value = self.local.get(key)
+        if value is not None:
+            self.count('local_hits')
+            return value
+        if self.store is not None:
+            try:
+                value = self.store.get(key)
+            except Exception as e:
+                print(f'Thread cache store error: {e}')
+                self.count('store_errors')
+                value = None
+            if value is not None:
+                self.local.set(key, value)
+                self.count('store_hits')
+                return value
+        self.count('misses')
+        return None
+
+    def set(self, key: str, value):
+        self.local.set(key, value)
+        if self.store is not None:
+            try:
+                self.store.set(key, value, self.store_ttl_seconds)
+            except Exception as e:
+                print(f'Thread cache store error: {e}')
+                self.count('store_errors')
+
+    def delete(self, key: str):
+        self.local.delete(key)
+        if self.store is not None:
+            try:
+                self.store.delete(key)
+            except Exception as e:
+                print(f'Thread cache store error: {e}')
+                self.count('store_errors')
+
+    def get_thread_id(self, phone_number: str) -> str:
+        return self.get(f'phone:{phone_number}')
+
+    def set_thread_id(self, phone_number: str, thread_id: str):
+        self.set(f'phone:{phone_number}', thread_id)
+
+    def get_thread(self, thread_id: str) -> dict:
+        return self.get(f'thread:{thread_id}')
+
+    def set_thread(self, thread: dict):
+        # only what the handler reads is kept, not the whole thread
+        self.set(f'thread:{thread["id"]}', {
+            'id': thread['id'],
+            'supp_id': thread.get('supp_id'),
+            'title': thread.get('title'),
+            'default_options': thread.get('default_options'),
+        })
+
+    def invalidate_thread(self, thread_id: str, phone_number: str = None):
+        # the phone number mapping only needs to go when the thread itself is gone
+        self.delete(f'thread:{thread_id}')
+        if phone_number is not None:
+            self.delete(f'phone:{phone_number}')
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counts)
+
+    def reset_stats(self):
+        with self.lock:
+            self.counts = {name: 0 for name in self.counts}
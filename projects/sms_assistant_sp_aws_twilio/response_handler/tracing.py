@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+
+
+# "emf" logs one CloudWatch embedded metric format line per message, "off" turns tracing into a no-op
+METRICS_MODE = os.environ.get('METRICS_MODE', 'emf').lower()
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'SmsAssistant')
+# every metric is reported per function (webhook or worker) and command (help, settings, chat, etc.)
+METRICS_DIMENSIONS = ['function', 'command']
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    def __init__(self, trace: dict, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        # a stage that runs more than once per message (i.e. sending two SMS) is reported as the total time
+        metric = f'{self.name}_ms'
+        self.trace['metrics'][metric] = self.trace['metrics'].get(metric, 0.0) + 1000 * (time.perf_counter() - self.start_time)
+        self.trace['units'][metric] = 'Milliseconds'
+        return False
+
+
+class Trace:
+    def __init__(self, tracer, properties: dict):
+        self.tracer = tracer
+        self.properties = properties
+
+    def __enter__(self):
+        # nested traces (i.e. a webhook that's answered inline) are part of the outer trace
+        self.owner = getattr(self.tracer.local, 'trace', None) is None
+        if self.owner:
+            self.tracer.start(**self.properties)
+        else:
+            self.tracer.set(**self.properties)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.tracer.set(error=exc_type.__name__)
+        if self.owner:
+            self.tracer.finish()
+        return False
+
+
+class Tracer:
+    """
+    Times the stages of handling one message and logs them as a single structured JSON line in CloudWatch's embedded
+    metric format (https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html),
+    so CloudWatch turns them into metrics without any extra API calls.
+
+        with TRACER.trace(function='worker'):
+            with TRACER.span('thread_lookup'):
+                ...
+            TRACER.set(command='chat')
+
+    Each thread has its own trace, so concurrent workers don't mix up their stages. Spans outside a trace, and
+    everything when `enabled` is False, are no-ops.
+    """
+    def __init__(self, enabled: bool = METRICS_MODE != 'off', namespace: str = METRICS_NAMESPACE, dimensions: list = METRICS_DIMENSIONS):
+        self.enabled = enabled
+        self.namespace = namespace
+        self.dimensions = dimensions
+        self.local = threading.local()
+        # where finished traces go. print ends up in CloudWatch logs
+        self.emit = print
+
+    def start(self, **properties):
+        if not self.enabled:
+            return
+        self.local.trace = {'start_time': time.perf_counter(), 'properties': dict(properties), 'metrics': {}, 'units': {}}
+
+    def trace(self, **properties):
+        # context manager version of start and finish
+        if not self.enabled:
+            return NULL_SPAN
+        return Trace(self, properties)
+
+    def span(self, name: str):
+        trace = getattr(self.local, 'trace', None) if self.enabled else None
+        if trace is None:
+            return NULL_SPAN
+        return Span(trace, name)
+
+    def set(self, **properties):
+        # properties are logged with the metrics. the ones named in `dimensions` are also metric dimensions
+        trace = getattr(self.local, 'trace', None) if self.enabled else None
+        if trace is not None:
+            trace['properties'].update(properties)
+
+    def metric(self, name: str, value: float, unit: str = 'Count'):
+        trace = getattr(self.local, 'trace', None) if self.enabled else None
+        if trace is not None:
+            trace['metrics'][name] = value
+            trace['units'][name] = unit
+
+    def finish(self, **properties) -> dict:
+        # logs the trace with the total time since `start`, and returns the log record
+        trace = getattr(self.local, 'trace', None) if self.enabled else None
+        if trace is None:
+            return None
+        self.local.trace = None
+        trace['properties'].update(properties)
+        trace['metrics']['total_ms'] = 1000 * (time.perf_counter() - trace['start_time'])
+        trace['units']['total_ms'] = 'Milliseconds'
+
+        dimensions = [name for name in self.dimensions if trace['properties'].get(name) is not None]
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [dimensions],
+                    'Metrics': [{'Name': name, 'Unit': trace['units'][name]} for name in trace['metrics']],
+                }],
+            },
+        }
+        record.update({name: str(value) if name in dimensions else value for name, value in trace['properties'].items()})
+        record.update({name: round(value, 3) if isinstance(value, float) else value for name, value in trace['metrics'].items()})
+        self.emit(json.dumps(record))
+        return record